@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'docmgr.settings')
+# 文档页面和列表使用异步视图（DOCUMENT_VIEWER['ASYNC_VIEWS']）
+os.environ.setdefault('DOCMGR_ASYNC_VIEWS', '1')
 
 application = get_asgi_application() 
\ No newline at end of file
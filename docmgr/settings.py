@@ -132,6 +132,85 @@ MARKDOWN_RENDER = {
             'permalink': False,
         },
     },
+    # 图片处理方式：'url' 通过带缓存头的资源地址访问，'inline' 内联为 data URI（离线导出）
+    'IMAGE_MODE': 'url',
+    # 代码高亮样式，样式表通过 {% pygments_css_url %} 引用
+    'PYGMENTS_STYLE': 'default',
+    # 异步视图中同时进行的渲染数（渲染线程池大小）
+    'MAX_CONCURRENT_RENDERS': 4,
+    # 可选：在有CPU时间、内存和墙钟时间上限的工作进程中渲染，超出时显示原文
+    'ISOLATION': {
+        'ENABLED': False,
+        'WORKERS': 2,
+        'TIMEOUT': 10,       # 秒
+        'CPU_SECONDS': 5,
+        'MEMORY_MB': 512,
+    },
+    # 大文档按块增量渲染，修改一段后只转换变化的部分
+    'INCREMENTAL': {
+        'ENABLED': True,
+        'MIN_LENGTH': 64 * 1024,  # 字符数
+    },
+    # 超大文档分段加载：在二级及以上标题处分段，每段单独渲染和缓存
+    'SECTIONS': {
+        'LEVEL': 2,
+        'MAX_SECTION_LENGTH': 64 * 1024,  # 字符数
+        'MAX_SIZE': 32 * 1024 * 1024,
+    },
+    # 公式渲染：'client' 由浏览器端 KaTeX 渲染，'mathml' 在服务端转换为 MathML（需要 latex2mathml）
+    'MATH': {
+        'MODE': 'client',
+        'CACHE_MAX_BYTES': 4 * 1024 * 1024,
+    },
+    # 图片缩略图：为较宽的位图生成多个宽度的版本，<img> 上给出 srcset（需要 Pillow）
+    'IMAGES': {
+        'ENABLED': True,
+        'WIDTHS': [320, 800, 1600],
+        'FORMAT': 'webp',  # Pillow 不支持 WebP 时使用 JPEG
+        'QUALITY': 80,
+    },
+    # 可选：渲染结果缓存（进程内LRU + 持久化存储）
+    'CACHE': {
+        'ENABLED': True,
+        'MEMORY_MAX_BYTES': 32 * 1024 * 1024,  # 32MB
+        'BACKEND': 'file',  # 'file'、'django' 或 None
+        'DIR': os.path.join(BASE_DIR, 'cache', 'markdown_renderer'),
+    },
+}
+
+# 文档后台处理（上传后预先渲染、高亮并提取文本）
+DOCUMENT_PROCESSING = {
+    'ENABLED': True,
+    'EXECUTOR': 'thread',  # 'thread' 或 'process'
+    'WORKERS': 2,
+    'MAX_ATTEMPTS': 3,
+    'RETRY_DELAY': 2,  # 第一次重试前等待的秒数，之后每次加倍
+    'ARTIFACT_ROOT': os.path.join(BASE_DIR, 'artifacts'),
+}
+
+# 文档查看
+DOCUMENT_VIEWER = {
+    'PAGED_TEXT_THRESHOLD': 1024 * 1024,  # 超过1MB的文本文件分页显示
+    'LINES_PER_PAGE': 500,
+    'MAX_PAGE_BYTES': 1024 * 1024,  # 每页最多读取的字节数（单行极长的文件）
+    'SECTIONED_MARKDOWN_THRESHOLD': 1024 * 1024,  # 超过1MB的Markdown文件先显示目录和第一段，其余按需加载
+    # ASGI部署（例如 uvicorn docmgr.asgi:application）时使用异步视图，asgi.py 会设置该环境变量
+    'ASYNC_VIEWS': os.environ.get('DOCMGR_ASYNC_VIEWS') == '1',
+}
+
+# 可续传的分块上传
+DOCUMENT_UPLOADS = {
+    'CHUNK_SIZE': 8 * 1024 * 1024,
+    'MAX_SIZE': 1024 * 1024 * 1024,  # 1GB，MAX_SIZES 中没有列出的文件类型
+    # 按文件类型的大小上限，上传过程中超出即停止接收
+    'MAX_SIZES': {
+        'markdown': 32 * 1024 * 1024,
+        'code': 32 * 1024 * 1024,
+        'image': 50 * 1024 * 1024,
+    },
+    'SESSION_TIMEOUT': 24 * 60 * 60,  # 秒，超过该时间没有新数据的上传会话被清理
+    'MAX_ACTIVE_SESSIONS': 10,
+    'BROWSER_THRESHOLD': 16 * 1024 * 1024,  # 上传页面对超过16MB的文件使用分块上传
 }
 
 # 日志配置
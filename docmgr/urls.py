@@ -15,6 +15,9 @@ urlpatterns = [
     # 文档管理
     path('documents/', include('documents.urls')),
     
+    # Markdown渲染器（文档图片等资源）
+    path('markdown/', include('markdown_renderer.urls')),
+    
     # 首页
     path('', HomeView.as_view(), name='home'),
 ]
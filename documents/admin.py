@@ -1,8 +1,18 @@
 from django.contrib import admin
-from .models import Document
+from .models import Document, ProcessingJob, UploadSession
 
 @admin.register(Document)
 class DocumentAdmin(admin.ModelAdmin):
-    list_display = ('title', 'owner', 'uploaded_at')
-    list_filter = ('owner', 'uploaded_at')
-    search_fields = ('title',) 
\ No newline at end of file
+    list_display = ('title', 'owner', 'uploaded_at', 'status')
+    list_filter = ('owner', 'uploaded_at', 'status')
+    search_fields = ('title',)
+
+@admin.register(ProcessingJob)
+class ProcessingJobAdmin(admin.ModelAdmin):
+    list_display = ('document', 'status', 'attempts', 'updated_at')
+    list_filter = ('status',)
+
+@admin.register(UploadSession)
+class UploadSessionAdmin(admin.ModelAdmin):
+    list_display = ('file_name', 'owner', 'total_size', 'created_at', 'expires_at')
+    list_filter = ('owner',)
@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class DocumentsConfig(AppConfig):
+    name = 'documents'
+    verbose_name = '文档管理'
+
+    def ready(self):
+        from . import signals  # noqa: F401
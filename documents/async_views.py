@@ -0,0 +1,180 @@
+"""
+ASGI部署使用的异步视图
+
+与 views 中的同名视图输出相同的页面。数据库查询使用异步ORM，文件读取放到线程中，
+CPU密集的渲染交给有界的渲染线程池（markdown_renderer.utils.render_limiter）。
+304 和进程内缓存命中在事件循环中直接返回，慢渲染不会占满线程，廉价请求不受影响。
+是否启用由 DOCUMENT_VIEWER['ASYNC_VIEWS'] 控制，见 urls.py。
+"""
+import functools
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.views import redirect_to_login
+from django.db import connections
+from django.shortcuts import render
+
+from markdown_renderer.utils import MarkdownRenderer, render_cache, render_limiter, render_markdown_async
+from markdown_renderer.utils.metrics import server_timing, timing
+
+from .conditional import document_last_modified, document_view_etag, not_modified_response, set_validators
+from .models import Document, FILE_TYPE_CHOICES
+from .pagination import KeysetPaginator
+from .pipeline import ensure_started, read_preview_artifact
+from .textpager import should_section
+from .views import (DocumentListView, SimpleDocumentListView, document_error_response, document_message_response,
+                    embedded_preview, sectioned_markdown_preview, text_document_preview, text_preview_error)
+
+
+def async_login_required(view_func):
+    """异步视图的 login_required"""
+    @functools.wraps(view_func)
+    async def wrapper(request, *args, **kwargs):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        # 模板和上下文处理器通过 request.user 访问用户，换成已加载的对象，避免在事件循环中同步查询数据库
+        request.user = user
+        return await view_func(request, *args, **kwargs)
+    return wrapper
+
+
+def _in_render_thread(func):
+    """渲染线程不属于任何请求，用完数据库连接（例如保存检测到的编码）后立即关闭"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            connections.close_all()
+    return wrapper
+
+
+_read_preview_artifact = sync_to_async(read_preview_artifact, thread_sensitive=False)
+
+
+async def _markdown_preview(request, document) -> str:
+    if should_section(document):
+        # 超大文档分段加载：索引和第一段的读取或渲染同样在渲染线程池中完成
+        sectioned = await render_limiter.run(_in_render_thread(sectioned_markdown_preview), request, document)
+        if sectioned is not None:
+            return sectioned
+
+    file_path = document.file.path
+    cache_key = MarkdownRenderer.get_cache_key(document.sha256, file_path, asset_owner=document.owner_id) \
+        if document.sha256 else None
+    if cache_key:
+        with timing('cache'):
+            cached = render_cache.get_memory(cache_key)
+        if cached is not None:
+            return cached
+
+    with timing('artifact'):
+        prepared = await _read_preview_artifact(document)
+    if prepared is not None:
+        if cache_key:
+            render_cache.set_memory(cache_key, prepared)
+        return prepared
+
+    return await render_markdown_async(file_path, encoding=document.encoding or None, asset_owner=document.owner_id)
+
+
+async def _text_preview(request, document):
+    with timing('artifact'):
+        prepared = await _read_preview_artifact(document)
+    if prepared is not None:
+        return prepared, True
+    try:
+        with timing('highlight'):
+            html_content = await render_limiter.run(_in_render_thread(text_document_preview), request, document)
+        return html_content, True
+    except FileNotFoundError:
+        raise
+    except Exception as e:
+        return text_preview_error(e), False
+
+
+@async_login_required
+@server_timing('document_view')
+async def document_view(request, doc_id):
+    try:
+        document = await Document.objects.filter(id=doc_id).afirst()
+        if document is None:
+            return document_message_response(
+                request, '文档不存在', f"<div class='alert alert-danger'>ID为{doc_id}的文档不存在。</div>")
+        if document.owner_id != request.user.pk:
+            return document_message_response(
+                request, '访问被拒绝', "<div class='alert alert-danger'>您没有权限查看此文档。</div>")
+
+        # 内容、配置和模板都没有变化时，不读取文件也不渲染
+        etag = document_view_etag(document, request.user)
+        last_modified = document_last_modified(document)
+        not_modified = not_modified_response(request, etag, last_modified)
+        if not_modified is not None:
+            return not_modified
+
+        try:
+            if document.file_size is None:
+                # 旧记录还没有元数据时补齐一次，之后不再访问文件系统
+                await sync_to_async(document.populate_file_metadata)()
+            if document.status == Document.STATUS_PENDING:
+                # 进程重启后首次访问时恢复未完成的处理任务
+                await sync_to_async(ensure_started)()
+
+            file_type = document.get_file_type()
+            if file_type == 'markdown':
+                html_content, is_preview = await _markdown_preview(request, document), True
+            elif file_type == 'text' or file_type == 'code':
+                html_content, is_preview = await _text_preview(request, document)
+            else:
+                # 图片的 srcset 需要读取图片尺寸（Pillow），同样不在事件循环中进行
+                html_content, is_preview = await render_limiter.run(
+                    _in_render_thread(embedded_preview), document, file_type)
+        except FileNotFoundError:
+            return document_message_response(
+                request, document.title, "<div class='alert alert-danger'>文件不存在或已被删除。</div>", document)
+
+        with timing('template'):
+            response = render(request, 'documents/document_view.html', {
+                'document': document,
+                'html_content': html_content,
+                'is_markdown': is_preview,
+                'file_type': file_type,
+            })
+        return set_validators(response, etag, last_modified)
+    except Exception as e:
+        return document_error_response(request, e)
+
+
+async def _document_list(request, view_class):
+    """与 OwnedDocumentListMixin 相同的查询和模板上下文"""
+    queryset = Document.objects.filter(owner=request.user)
+    file_type = request.GET.get('type')
+    if file_type:
+        queryset = queryset.filter(file_type=file_type)
+
+    paginator = KeysetPaginator(queryset, view_class.keyset_ordering, view_class.paginate_by)
+    page = await paginator.apage(after=request.GET.get('after'), before=request.GET.get('before'))
+
+    query = request.GET.copy()
+    query.pop('after', None)
+    query.pop('before', None)
+    return render(request, view_class.template_name, {
+        'paginator': paginator,
+        'page_obj': page,
+        'is_paginated': page.has_other_pages(),
+        'object_list': page.object_list,
+        'documents': page.object_list,
+        'pagination_query': query.urlencode(),
+        'file_types': FILE_TYPE_CHOICES,
+        'current_type': request.GET.get('type', ''),
+    })
+
+
+@async_login_required
+async def document_list(request):
+    return await _document_list(request, DocumentListView)
+
+
+@async_login_required
+async def simple_document_list(request):
+    return await _document_list(request, SimpleDocumentListView)
@@ -0,0 +1,101 @@
+"""
+文档页面和原文件的条件请求（ETag / Last-Modified / 304）
+
+校验值只由数据库中的字段和进程内的配置指纹计算，浏览器重新打开同一文档时
+在读取文件或渲染之前就可以返回 304。
+"""
+import hashlib
+import json
+from datetime import datetime
+from functools import lru_cache
+from typing import Optional, Tuple
+
+from django.conf import settings
+from django.template.loader import get_template
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from markdown_renderer.utils import MarkdownRenderer
+
+from .previews import highlight_fingerprint
+from .textpager import get_viewer_config
+
+# document_view 用到的模板，内容变化后页面的 ETag 随之变化
+VIEW_TEMPLATES = ('base.html', 'documents/document_view.html', 'documents/text_page_fragment.html',
+                  'documents/markdown_sections.html')
+
+
+@lru_cache(maxsize=4)
+def _template_fingerprint(names: Tuple[str, ...]) -> str:
+    digest = hashlib.sha256()
+    for name in names:
+        digest.update(get_template(name).template.source.encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+def template_fingerprint() -> str:
+    """页面模板的版本；DEBUG 时每次重新读取，修改模板后立即生效"""
+    if settings.DEBUG:
+        _template_fingerprint.cache_clear()
+    return _template_fingerprint(VIEW_TEMPLATES)
+
+
+def document_view_etag(document, user) -> Optional[str]:
+    """文档页面的强 ETag：内容哈希 + 渲染配置 + 模板版本 + 页面上显示的字段"""
+    if not document.sha256:
+        return None
+    payload = json.dumps([
+        document.sha256,
+        MarkdownRenderer.get_config_fingerprint(),
+        highlight_fingerprint(),
+        template_fingerprint(),
+        get_viewer_config(),
+        document.title,
+        document.status,
+        document.encoding,
+        document.processed_at.isoformat() if document.processed_at else None,
+        user.pk,
+        user.get_username(),
+    ], sort_keys=True, default=str)
+    return quote_etag(hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32])
+
+
+def document_section_etag(document, number: int) -> Optional[str]:
+    """分段加载的一段：取决于内容、渲染配置和所有者（图片地址签给所有者）"""
+    if not document.sha256:
+        return None
+    payload = f'{document.sha256}:{MarkdownRenderer.get_config_fingerprint()}:{document.owner_id}:{number}'
+    return quote_etag(hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32])
+
+
+def document_file_etag(document) -> Optional[str]:
+    """原文件的强 ETag 就是内容哈希"""
+    return quote_etag(document.sha256) if document.sha256 else None
+
+
+def document_last_modified(document) -> datetime:
+    """文件上传后内容不再变化；页面在后台处理完成后会变化"""
+    if document.processed_at and document.processed_at > document.uploaded_at:
+        return document.processed_at
+    return document.uploaded_at
+
+
+def not_modified_response(request, etag: Optional[str], last_modified: Optional[datetime]):
+    """请求中的校验值仍然有效时返回 304 响应，否则返回 None"""
+    if request.method not in ('GET', 'HEAD'):
+        return None
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if response is None:
+        return None
+    return set_validators(response, etag, last_modified)
+
+
+def set_validators(response, etag: Optional[str], last_modified: Optional[datetime]):
+    """写入 ETag / Last-Modified，并要求浏览器每次使用前重新验证"""
+    if etag:
+        response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    response['Cache-Control'] = 'private, no-cache'
+    return response
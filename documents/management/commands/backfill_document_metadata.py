@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from documents.models import Document
+
+
+class Command(BaseCommand):
+    help = '为缺少元数据（大小、SHA-256、MIME类型、修改时间）的文档补齐字段'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='重新采集所有文档的元数据（包括重新计算哈希）')
+
+    def handle(self, *args, **options):
+        documents = Document.objects.all()
+        if not options['force']:
+            documents = documents.filter(file_size__isnull=True)
+
+        updated = missing = 0
+        for document in documents.iterator():
+            if options['force']:
+                document.sha256 = ''
+            try:
+                document.populate_file_metadata()
+            except FileNotFoundError:
+                missing += 1
+                self.stderr.write(f'{document.pk} {document.title}: 文件不存在')
+                continue
+            updated += 1
+
+        self.stdout.write(self.style.SUCCESS(f'元数据更新完成: 更新 {updated}，文件缺失 {missing}'))
@@ -0,0 +1,89 @@
+import random
+import sqlite3
+import string
+import time
+
+from django.core.management.base import BaseCommand
+
+from documents import search
+from markdown_renderer.benchmarks import measure
+
+CJK_WORDS = ['文档', '管理', '系统', '渲染', '搜索', '索引', '缓存', '用户', '上传', '预览', '配置', '性能',
+             '数据库', '服务器', '浏览器', '表格', '图片', '公式', '代码', '高亮']
+
+
+def make_vocabulary(rng: random.Random, size: int):
+    return [''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(4, 9))) for _ in range(size)]
+
+
+def make_body(rng: random.Random, vocabulary, words: int) -> str:
+    # 少量中文常用词，使常见词查询命中大量文档
+    return ' '.join(rng.choice(CJK_WORDS) if rng.random() < 0.05 else rng.choice(vocabulary) for _ in range(words))
+
+
+class Command(BaseCommand):
+    help = '在内存SQLite数据库中生成大量文档，测量FTS5全文搜索与LIKE扫描的查询延迟'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--documents', type=int, default=100000, help='生成的文档数')
+        parser.add_argument('--words', type=int, default=100, help='每个文档的词数')
+        parser.add_argument('--owners', type=int, default=10, help='文档分布的用户数')
+        parser.add_argument('--iterations', type=int, default=50, help='每个查询的迭代次数')
+        parser.add_argument('--skip-like', action='store_true', help='不测量LIKE扫描（文档很多时很慢）')
+
+    def handle(self, *args, **options):
+        rng = random.Random(42)
+        vocabulary = make_vocabulary(rng, 30000)
+        db = sqlite3.connect(':memory:')
+        cursor = db.cursor()
+        tokenizer = search.create_search_table(cursor)
+        cursor.execute('CREATE TABLE plain (id INTEGER PRIMARY KEY, title TEXT, body TEXT, owner_id INTEGER)')
+        cursor.execute('CREATE INDEX plain_owner ON plain (owner_id)')
+
+        start = time.perf_counter()
+        batch = []
+        for doc_id in range(1, options['documents'] + 1):
+            batch.append((doc_id, f'文档 {rng.choice(vocabulary)} {doc_id}',
+                          make_body(rng, vocabulary, options['words']), rng.randint(1, options['owners'])))
+            if len(batch) >= 5000:
+                self._insert(cursor, batch)
+                batch = []
+        self._insert(cursor, batch)
+        db.commit()
+        self.stdout.write(f"生成 {options['documents']} 个文档并建立索引（{tokenizer}）: "
+                          f"{time.perf_counter() - start:.1f} s")
+
+        sql = search.SEARCH_SQL.replace('%s', '?')
+        owner_id = 1
+        queries = [vocabulary[0], vocabulary[1] + ' ' + vocabulary[2], '数据库', '服务器 浏览器']
+        for query in queries:
+            params = search.search_params(search.build_match_query(query, owner_id), 50)
+
+            def run_fts():
+                return cursor.execute(sql, params).fetchall()
+
+            hits = len(run_fts())
+            self._report(f'fts5 "{query}" ({hits} 条)', measure(run_fts, options['iterations']))
+
+            if not options['skip_like']:
+                terms = query.split()
+                like_sql = 'SELECT id FROM plain WHERE owner_id = ? AND ' + ' AND '.join(
+                    '(title LIKE ? OR body LIKE ?)' for _ in terms) + ' LIMIT 50'
+                like_params = [owner_id] + [f'%{term}%' for term in terms for _ in range(2)]
+
+                def run_like():
+                    cursor.execute(like_sql, like_params).fetchall()
+
+                self._report(f'like "{query}"', measure(run_like, max(1, options['iterations'] // 5)))
+
+    @staticmethod
+    def _insert(cursor, rows):
+        cursor.executemany(f'INSERT INTO {search.SEARCH_TABLE} (rowid, title, body, owner_key) VALUES (?, ?, ?, ?)',
+                           [(doc_id, title, body, search.owner_key(owner)) for doc_id, title, body, owner in rows])
+        cursor.executemany('INSERT INTO plain (id, title, body, owner_id) VALUES (?, ?, ?, ?)', rows)
+
+    def _report(self, label, stats):
+        self.stdout.write(
+            f"  {label:<36} mean {stats['mean_ms']:8.3f} ms  "
+            f"p50 {stats['p50_ms']:8.3f} ms  p95 {stats['p95_ms']:8.3f} ms"
+        )
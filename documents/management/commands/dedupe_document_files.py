@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+
+from documents.models import Document
+from documents.storage import ContentAddressedStorage, blob_references
+
+
+class Command(BaseCommand):
+    help = '把按原文件名保存的旧文档文件迁移到内容寻址存储，内容相同的文件合并为一个'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='只统计，不移动文件')
+
+    def handle(self, *args, **options):
+        moved = merged = missing = 0
+        for document in Document.objects.iterator():
+            old_name = document.file.name
+            if not old_name or ContentAddressedStorage.digest_from_name(old_name):
+                continue
+            storage = document.file.storage
+            if not storage.exists(old_name):
+                missing += 1
+                self.stderr.write(f'{document.pk} {document.title}: 文件不存在')
+                continue
+            if options['dry_run']:
+                moved += 1
+                continue
+
+            with storage.open(old_name, 'rb') as f:
+                new_name = storage.save(old_name, f)
+            was_shared = Document.objects.filter(file=new_name).exists()
+            Document.objects.filter(pk=document.pk).update(
+                file=new_name, original_name=document.original_name or old_name.rsplit('/', 1)[-1])
+            blob_references.unpin(new_name)
+            document.file.name = new_name
+            document.populate_file_metadata()
+            if not Document.objects.filter(file=old_name).exists():
+                storage.delete(old_name)
+            if was_shared:
+                merged += 1
+            else:
+                moved += 1
+
+        self.stdout.write(self.style.SUCCESS(f'迁移完成: 迁移 {moved}，合并到已有文件 {merged}，文件缺失 {missing}'))
@@ -0,0 +1,29 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from documents.models import UploadSession
+from documents.storage import document_storage
+from documents.uploads import expire_sessions, get_upload_config, upload_directory
+
+
+class Command(BaseCommand):
+    help = '清理过期的分块上传会话及其临时文件，以及没有对应会话的临时文件'
+
+    def handle(self, *args, **options):
+        expired = expire_sessions()
+
+        orphaned = 0
+        temp_dir = document_storage.path(f'{upload_directory()}/.uploads')
+        if os.path.isdir(temp_dir):
+            active = {str(pk) for pk in UploadSession.objects.values_list('pk', flat=True)}
+            cutoff = time.time() - get_upload_config()['SESSION_TIMEOUT']
+            for entry in os.scandir(temp_dir):
+                session_id = entry.name[:-len('.part')] if entry.name.endswith('.part') else None
+                if session_id in active or entry.stat().st_mtime > cutoff:
+                    continue
+                os.remove(entry.path)
+                orphaned += 1
+
+        self.stdout.write(self.style.SUCCESS(f'清理完成: 过期会话 {expired}，孤立的临时文件 {orphaned}'))
@@ -0,0 +1,109 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from documents.models import Document, FILE_TYPE_CHOICES
+from documents import pipeline, search
+
+
+class Command(BaseCommand):
+    help = '在多个进程中批量预先渲染文档，生成预览产物并填充渲染缓存（例如部署或修改 MARKDOWN_RENDER 之后）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--owner', help='只处理该用户（用户名）的文档')
+        parser.add_argument('--type', dest='file_type', choices=[value for value, _ in FILE_TYPE_CHOICES],
+                            help='只处理该类型的文档')
+        parser.add_argument('--since', help='只处理该日期（YYYY-MM-DD）及之后上传的文档')
+        parser.add_argument('--until', help='只处理该日期（YYYY-MM-DD）及之前上传的文档')
+        parser.add_argument('--workers', type=int, default=None, help='工作进程数（默认CPU核数）')
+        parser.add_argument('--chunksize', type=int, default=8, help='每次分派给工作进程的文档数')
+        parser.add_argument('--force', action='store_true', help='产物已是最新时也重新渲染')
+
+    def get_queryset(self, options):
+        # 还没有采集元数据的旧记录 file_type 为空，也交给工作进程处理
+        documents = Document.objects.filter(Q(file_type__in=pipeline.PREVIEW_TYPES) | Q(file_type=''))
+        if options['owner']:
+            try:
+                documents = documents.filter(owner=User.objects.get(username=options['owner']))
+            except User.DoesNotExist:
+                raise CommandError(f"用户不存在: {options['owner']}")
+        if options['file_type']:
+            documents = documents.filter(file_type=options['file_type'])
+        for option, lookup in (('since', 'uploaded_at__date__gte'), ('until', 'uploaded_at__date__lte')):
+            if options[option]:
+                day = parse_date(options[option])
+                if day is None:
+                    raise CommandError(f"无效的日期: {options[option]}")
+                documents = documents.filter(**{lookup: day})
+        return documents.order_by('id')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+
+        # 内容相同的文档共用产物，每个内容只渲染一次
+        groups = {}
+        skipped = 0
+        for document in self.get_queryset(options).iterator():
+            key = document.sha256 or f'id:{document.pk}'
+            if key in groups:
+                groups[key].append(document)
+            elif not options['force'] and pipeline.artifacts_are_current(document):
+                skipped += 1
+                if document.status != Document.STATUS_READY:
+                    self.mark_ready([document])
+            else:
+                groups[key] = [document]
+
+        if options['force']:
+            for documents in groups.values():
+                self.clear_artifacts(documents[0])
+
+        failed = 0
+        if groups:
+            keys = list(groups)
+            # fork 之前关闭数据库连接，避免子进程共用父进程的连接
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=options['workers'],
+                                     initializer=pipeline.init_process_worker) as executor:
+                results = executor.map(pipeline.prerender_document, [groups[key][0].pk for key in keys],
+                                       chunksize=max(1, options['chunksize']))
+                for key, error in zip(keys, results):
+                    documents = groups[key]
+                    if error:
+                        failed += len(documents)
+                        for document in documents:
+                            self.stderr.write(f'{document.pk} {document.title}: {error}')
+                        continue
+                    for document in documents:
+                        document.refresh_from_db()
+                    self.mark_ready(documents)
+
+        rendered = sum(len(documents) for documents in groups.values()) - failed
+        elapsed = time.perf_counter() - start
+        rate = len(groups) / elapsed if elapsed else 0.0
+        self.stdout.write(self.style.SUCCESS(
+            f'预渲染完成: 渲染 {rendered}（{len(groups)} 份不同内容），已是最新 {skipped}，失败 {failed}，'
+            f'耗时 {elapsed:.1f} s，{rate:.1f} 份/秒'))
+
+    @staticmethod
+    def mark_ready(documents):
+        Document.objects.filter(pk__in=[document.pk for document in documents]).exclude(
+            status=Document.STATUS_READY).update(status=Document.STATUS_READY, processed_at=timezone.now())
+        for document in documents:
+            search.index_document(document, search.extract_text(document))
+
+    @staticmethod
+    def clear_artifacts(document):
+        # 删除元数据后工作进程会重新生成全部产物
+        if document.sha256:
+            try:
+                os.remove(os.path.join(document.artifact_dir, 'meta.json'))
+            except OSError:
+                pass
@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from documents.models import Document, ProcessingJob
+from documents import pipeline
+
+
+class Command(BaseCommand):
+    help = '在当前进程中处理未就绪的文档（生成预览、纯文本和元数据）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='重新处理所有文档，包括已就绪的文档')
+        parser.add_argument('--include-failed', action='store_true', help='同时重试处理失败的文档')
+
+    def handle(self, *args, **options):
+        documents = Document.objects.all()
+        if not options['all']:
+            statuses = [Document.STATUS_PENDING]
+            if options['include_failed']:
+                statuses.append(Document.STATUS_FAILED)
+            documents = documents.filter(status__in=statuses)
+
+        processed = failed = 0
+        for document in documents.iterator():
+            job = ProcessingJob.objects.create(document=document)
+            retry_delay = pipeline.run_job(job.id)
+            while retry_delay is not None:
+                time.sleep(retry_delay)
+                retry_delay = pipeline.run_job(job.id)
+            job.refresh_from_db()
+            if job.status == ProcessingJob.STATUS_DONE:
+                processed += 1
+            else:
+                failed += 1
+                self.stderr.write(f'{document.pk} {document.title}: {job.error}')
+
+        self.stdout.write(self.style.SUCCESS(f'处理完成: 成功 {processed}，失败 {failed}'))
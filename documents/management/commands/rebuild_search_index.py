@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from documents.models import Document
+from documents import search
+
+
+class Command(BaseCommand):
+    help = '重新建立全文搜索索引'
+
+    def handle(self, *args, **options):
+        if not search.is_available():
+            raise CommandError('全文搜索只支持SQLite数据库')
+
+        indexed = failed = 0
+        for document in Document.objects.iterator():
+            try:
+                text = search.extract_text(document)
+            except OSError as e:
+                failed += 1
+                self.stderr.write(f'{document.pk} {document.title}: {e}')
+                text = ''
+            search.index_document(document, text)
+            indexed += 1
+
+        self.stdout.write(self.style.SUCCESS(f'索引完成: {indexed} 个文档，读取失败 {failed}'))
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-18 18:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0002_processing_pipeline'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='encoding',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+    ]
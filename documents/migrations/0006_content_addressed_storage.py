@@ -0,0 +1,24 @@
+# Generated by Django 5.0.1 on 2026-10-18 18:23
+
+import documents.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0005_document_file_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='original_name',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='document',
+            name='file',
+            field=models.FileField(db_index=True, storage=documents.storage.get_document_storage, upload_to='documents/'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+from django.db import migrations
+
+# 迁移中固定表结构，不引用 documents.search 中可能随代码变化的定义
+CREATE_TABLE_SQL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS documents_search "
+    "USING fts5(title, body, owner_key, tokenize='{tokenizer}')"
+)
+
+
+def create_search_index(apps, schema_editor):
+    # FTS5 是SQLite的虚拟表，其它数据库不创建
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        # SQLite不支持 trigram 分词时退回 unicode61
+        for tokenizer in ('trigram', 'unicode61'):
+            try:
+                cursor.execute(CREATE_TABLE_SQL.format(tokenizer=tokenizer))
+                return
+            except Exception:
+                continue
+    raise RuntimeError('SQLite不支持FTS5，无法创建搜索索引')
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('DROP TABLE IF EXISTS documents_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0006_content_addressed_storage'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
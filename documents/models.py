@@ -1,37 +1,224 @@
 from django.db import models
 from django.contrib.auth.models import User
+import datetime
+import hashlib
 import os
+import uuid
+
+from .storage import ContentAddressedStorage, get_document_storage
+
+# 扩展名到文件类型的映射
+FILE_TYPE_EXTENSIONS = {
+    'markdown': ['.md', '.markdown'],
+    'text': ['.txt', '.log', '.ini', '.conf', '.cfg', '.properties'],
+    'code': ['.html', '.htm', '.xml', '.json', '.yaml', '.yml', '.css', '.js'],
+    'image': ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.svg', '.webp'],
+    'pdf': ['.pdf'],
+    'office': ['.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx'],
+}
+
+FILE_TYPE_BY_EXTENSION = {ext: file_type for file_type, exts in FILE_TYPE_EXTENSIONS.items() for ext in exts}
+
+FILE_TYPE_CHOICES = [(file_type, file_type.title()) for file_type in FILE_TYPE_EXTENSIONS] + [('other', 'Other')]
+
+
+def detect_file_type(file_name):
+    """根据扩展名判断文件类型"""
+    _, ext = os.path.splitext(file_name)
+    return FILE_TYPE_BY_EXTENSION.get(ext.lower(), 'other')
+
 
 class Document(models.Model):
+    # 后台处理状态
+    STATUS_PENDING = 'pending'
+    STATUS_READY = 'ready'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, '处理中'),
+        (STATUS_READY, '已就绪'),
+        (STATUS_FAILED, '处理失败'),
+    ]
+    
     title = models.CharField(max_length=255)
-    file = models.FileField(upload_to='documents/')
+    # 按内容哈希保存，相同内容的上传共用一个文件
+    file = models.FileField(upload_to='documents/', storage=get_document_storage, db_index=True)
+    original_name = models.CharField(max_length=255, blank=True)
     owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='documents')
     uploaded_at = models.DateTimeField(auto_now_add=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    # 检测到的文本编码，之后的访问直接按此解码
+    encoding = models.CharField(max_length=32, blank=True)
+    # 上传时采集的文件元数据，查看和列表时不必再访问文件系统
+    file_type = models.CharField(max_length=16, choices=FILE_TYPE_CHOICES, blank=True)
+    file_size = models.BigIntegerField(null=True, blank=True)
+    sha256 = models.CharField(max_length=64, blank=True, db_index=True)
+    mime_type = models.CharField(max_length=100, blank=True)
+    file_mtime = models.DateTimeField(null=True, blank=True)
+    # 上传时边接收边统计的行数（换行符数加一），非上传方式创建的记录为空
+    line_count = models.PositiveIntegerField(null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['owner', 'file_type', 'uploaded_at'], name='document_owner_type_idx'),
+            # 列表页按 (owner, uploaded_at, id) / (owner, title, id) 做游标分页
+            models.Index(fields=['owner', 'uploaded_at'], name='document_owner_uploaded_idx'),
+            models.Index(fields=['owner', 'title'], name='document_owner_title_idx'),
+        ]
+    
     def __str__(self):
         return self.title
     
     def is_markdown(self):
         """检查文件是否为Markdown文件"""
-        _, ext = os.path.splitext(self.file.name)
-        return ext.lower() in ['.md', '.markdown']
+        return self.get_file_type() == 'markdown'
         
     def get_file_type(self):
-        """获取文件类型"""
-        _, ext = os.path.splitext(self.file.name)
-        ext = ext.lower()
+        """获取文件类型，优先使用上传时保存的值"""
+        return self.file_type or detect_file_type(self.file.name)
+    
+    def save(self, *args, **kwargs):
+        if self.file and not self.file._committed:
+            self.original_name = os.path.basename(self.file.name)
+        if not self.file_type and self.file:
+            self.file_type = detect_file_type(self.file.name)
+        super().save(*args, **kwargs)
+    
+    def get_download_name(self):
+        """下载时使用的文件名（存储中的文件名是内容哈希）"""
+        return self.original_name or os.path.basename(self.file.name)
+    
+    def blob_reference_count(self):
+        """引用同一个存储文件的文档数"""
+        return Document.objects.filter(file=self.file.name).count()
+    
+    def populate_file_metadata(self, save=True):
+        """
+        采集文件大小、SHA-256、MIME类型和修改时间
+        
+        已有 sha256（例如上传时边接收边计算的）时不再重新读取文件；内容寻址存储的文件名就是哈希。
+        已有的 mime_type（上传时按文件头判断的）在内容不变时保留。
+        """
+        from markdown_renderer.utils import FileValidator
+        
+        path = self.file.path
+        stat = os.stat(path)
+        mtime = datetime.datetime.fromtimestamp(stat.st_mtime, tz=datetime.timezone.utc)
+        previous_sha256 = self.sha256
+        blob_digest = ContentAddressedStorage.digest_from_name(self.file.name)
+        if blob_digest:
+            self.sha256 = blob_digest
+        elif not self.sha256 or self.file_size != stat.st_size or (self.file_mtime and self.file_mtime != mtime):
+            hasher = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    hasher.update(chunk)
+            self.sha256 = hasher.hexdigest()
+        self.file_size = stat.st_size
+        self.file_mtime = mtime
+        # 上传处理器按文件头判断的类型比按扩展名猜测的准确，内容未变时保留
+        if not self.mime_type or (previous_sha256 and previous_sha256 != self.sha256):
+            self.mime_type = FileValidator.guess_mimetype(path) or ''
+        self.file_type = detect_file_type(self.file.name)
+        if save and self.pk:
+            Document.objects.filter(pk=self.pk).update(
+                sha256=self.sha256, file_size=self.file_size, file_mtime=self.file_mtime,
+                mime_type=self.mime_type, file_type=self.file_type)
+    
+    def read_text(self):
+        """读取并解码文本内容，首次检测到的编码会保存到记录中"""
+        from markdown_renderer.utils import read_text
+        content, encoding = read_text(self.file.path, self.encoding or None)
+        if encoding != self.encoding:
+            self.encoding = encoding
+            if self.pk:
+                Document.objects.filter(pk=self.pk).update(encoding=encoding)
+        return content
+    
+    def detect_encoding(self):
+        """只读取文件开头的样本检测编码并保存，用于不整体读取的大文件"""
+        from markdown_renderer.utils.encoding import sniff_encoding, DETECT_SAMPLE_SIZE
+        with open(self.file.path, 'rb') as f:
+            sample = f.read(DETECT_SAMPLE_SIZE)
+        self.encoding = sniff_encoding(sample)
+        if self.pk:
+            Document.objects.filter(pk=self.pk).update(encoding=self.encoding)
+        return self.encoding
+    
+    @property
+    def artifact_dir(self):
+        """
+        后台处理生成的预览、文本和元数据所在目录
         
-        if ext in ['.md', '.markdown']:
-            return 'markdown'
-        elif ext in ['.txt', '.log', '.ini', '.conf', '.cfg', '.properties']:
-            return 'text'
-        elif ext in ['.html', '.htm', '.xml', '.json', '.yaml', '.yml', '.css', '.js']:
-            return 'code'
-        elif ext in ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.svg', '.webp']:
-            return 'image'
-        elif ext in ['.pdf']:
-            return 'pdf'
-        elif ext in ['.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx']:
-            return 'office'
-        else:
-            return 'other'
\ No newline at end of file
+        按内容哈希存放，内容相同的文档共用一份产物；还没有哈希的旧记录按主键存放。
+        """
+        from .pipeline import get_artifact_root
+        if self.sha256:
+            return os.path.join(get_artifact_root(), self.sha256[:2], self.sha256)
+        return os.path.join(get_artifact_root(), str(self.pk))
+
+
+class ProcessingJob(models.Model):
+    """后台处理任务表，进程重启后据此恢复未完成的任务"""
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, '等待'),
+        (STATUS_RUNNING, '运行中'),
+        (STATUS_DONE, '完成'),
+        (STATUS_FAILED, '失败'),
+    ]
+    
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='jobs')
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_PENDING, db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f'{self.document_id}: {self.status}'
+
+
+class UploadSession(models.Model):
+    """
+    可续传的分块上传会话（见 uploads.py）
+    
+    各块直接写入临时文件的对应偏移处，完成后重命名为内容寻址的 blob；超过 expires_at 未完成的会话被清理。
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions')
+    title = models.CharField(max_length=255)
+    file_name = models.CharField(max_length=255)
+    total_size = models.BigIntegerField()
+    chunk_size = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+    
+    def __str__(self):
+        return f'{self.file_name} ({self.id})'
+    
+    @property
+    def chunk_count(self):
+        return max(1, -(-self.total_size // self.chunk_size))
+    
+    def chunk_range(self, number):
+        """第 number 块（从0开始）在文件中的 (偏移, 长度)"""
+        offset = number * self.chunk_size
+        return offset, min(self.chunk_size, self.total_size - offset)
+
+
+class UploadChunk(models.Model):
+    """上传会话中已完整写入的块"""
+    session = models.ForeignKey(UploadSession, on_delete=models.CASCADE, related_name='chunks')
+    number = models.PositiveIntegerField()
+    size = models.PositiveIntegerField()
+    sha256 = models.CharField(max_length=64)
+    lines = models.PositiveIntegerField(default=0)  # 块中的换行符数
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['session', 'number'], name='upload_chunk_unique_number'),
+        ]
@@ -0,0 +1,175 @@
+"""
+基于游标（keyset）的分页
+
+按 (排序字段, id) 定位下一页，不使用 OFFSET，翻到很靠后的页也只需一次索引范围查询。
+"""
+import base64
+import json
+from datetime import datetime
+from typing import List, Optional, Sequence, Tuple
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q, QuerySet
+from django.http import Http404
+from django.utils.dateparse import parse_datetime
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {'dt': value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict) and 'dt' in value:
+        parsed = parse_datetime(value['dt'])
+        if parsed is None:
+            raise ValueError('无效的时间值')
+        return parsed
+    return value
+
+
+def encode_cursor(values: Sequence) -> str:
+    payload = json.dumps([_encode_value(v) for v in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str) -> list:
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        if not isinstance(values, list):
+            raise ValueError('无效的游标')
+        return [_decode_value(v) for v in values]
+    except (ValueError, TypeError, UnicodeError):
+        raise Http404("无效的分页游标")
+
+
+class KeysetPage:
+    def __init__(self, object_list: List, next_cursor: Optional[str], previous_cursor: Optional[str]):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def has_next(self) -> bool:
+        return self.next_cursor is not None
+
+    def has_previous(self) -> bool:
+        return self.previous_cursor is not None
+
+    def has_other_pages(self) -> bool:
+        return self.has_next() or self.has_previous()
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class KeysetPaginator:
+    """
+    游标分页器
+
+    ordering 为排序字段元组，最后一个字段必须唯一（通常是 id），例如 ('-uploaded_at', '-id')。
+    """
+
+    def __init__(self, queryset: QuerySet, ordering: Tuple[str, ...], per_page: int):
+        self.queryset = queryset
+        self.ordering = ordering
+        self.per_page = per_page
+
+    @staticmethod
+    def _field(name: str) -> Tuple[str, bool]:
+        return name.lstrip('-'), name.startswith('-')
+
+    def _keys(self, obj) -> list:
+        return [getattr(obj, self._field(name)[0]) for name in self.ordering]
+
+    def _after(self, values: list, reverse: bool) -> Q:
+        """构造“排在 values 之后”的条件：(a > x) OR (a = x AND b > y) ..."""
+        condition = Q()
+        for i, name in enumerate(self.ordering):
+            field, descending = self._field(name)
+            lookup = 'lt' if descending != reverse else 'gt'
+            clause = Q(**{f'{field}__{lookup}': values[i]})
+            for j in range(i):
+                clause &= Q(**{self._field(self.ordering[j])[0]: values[j]})
+            condition |= clause
+        return condition
+
+    def _reversed_ordering(self) -> List[str]:
+        return [name[1:] if name.startswith('-') else f'-{name}' for name in self.ordering]
+
+    def _cursor_values(self, cursor: str) -> list:
+        """解码游标并按排序字段的类型转换；游标可被客户端篡改，类型不符时返回404而不是在查询时出错"""
+        values = decode_cursor(cursor)
+        if len(values) != len(self.ordering):
+            raise Http404("无效的分页游标")
+        model_meta = self.queryset.model._meta
+        try:
+            converted = [model_meta.get_field(self._field(name)[0]).to_python(value)
+                         for name, value in zip(self.ordering, values)]
+        except (ValidationError, TypeError, ValueError):
+            raise Http404("无效的分页游标")
+        if any(value is None for value in converted):
+            raise Http404("无效的分页游标")
+        return converted
+
+    def _query(self, after: Optional[str], before: Optional[str]) -> QuerySet:
+        """本页查询（多取一行用于判断是否还有更多）"""
+        queryset = self.queryset
+        if before:
+            values = self._cursor_values(before)
+            return (queryset.filter(self._after(values, reverse=True))
+                    .order_by(*self._reversed_ordering())[:self.per_page + 1])
+
+        if after:
+            values = self._cursor_values(after)
+            queryset = queryset.filter(self._after(values, reverse=False))
+        return queryset.order_by(*self.ordering)[:self.per_page + 1]
+
+    def _build_page(self, rows: list, after: Optional[str], before: Optional[str]) -> KeysetPage:
+        has_more = len(rows) > self.per_page
+        if before:
+            rows = rows[:self.per_page][::-1]
+            previous_cursor = encode_cursor(self._keys(rows[0])) if has_more and rows else None
+            next_cursor = encode_cursor(self._keys(rows[-1])) if rows else None
+            return KeysetPage(rows, next_cursor, previous_cursor)
+
+        rows = rows[:self.per_page]
+        next_cursor = encode_cursor(self._keys(rows[-1])) if has_more and rows else None
+        previous_cursor = encode_cursor(self._keys(rows[0])) if after and rows else None
+        return KeysetPage(rows, next_cursor, previous_cursor)
+
+    def page(self, after: Optional[str] = None, before: Optional[str] = None) -> KeysetPage:
+        """after 为下一页游标，before 为上一页游标，都为空时返回第一页"""
+        return self._build_page(list(self._query(after, before)), after, before)
+
+    async def apage(self, after: Optional[str] = None, before: Optional[str] = None) -> KeysetPage:
+        """page 的异步版本，使用异步ORM查询"""
+        return self._build_page([row async for row in self._query(after, before)], after, before)
+
+
+class KeysetPaginationMixin:
+    """
+    为 ListView 提供游标分页
+
+    子类设置 keyset_ordering 和 paginate_by，模板通过 page_obj.next_cursor / page_obj.previous_cursor 翻页。
+    """
+    keyset_ordering: Tuple[str, ...] = ('-id',)
+    paginate_by = 50
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # 翻页链接需要保留的其它查询参数（例如筛选条件）
+        query = self.request.GET.copy()
+        query.pop('after', None)
+        query.pop('before', None)
+        context['pagination_query'] = query.urlencode()
+        return context
+    
+    def paginate_queryset(self, queryset, page_size):
+        paginator = KeysetPaginator(queryset, self.keyset_ordering, page_size)
+        page = paginator.page(after=self.request.GET.get('after'), before=self.request.GET.get('before'))
+        return paginator, page, page.object_list, page.has_other_pages()
@@ -0,0 +1,324 @@
+"""
+文档后台处理流水线
+
+文档保存后在本地线程池（或进程池）中预先渲染Markdown、高亮代码并提取文本和元数据，
+结果保存在文档的产物目录中，document_view 在状态为就绪时直接返回预生成的预览。
+任务记录在 ProcessingJob 表中，进程重启后未完成的任务会被重新提交。
+"""
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Optional, Dict, Any
+
+from django.conf import settings
+from django.db import close_old_connections, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.html import strip_tags
+
+from . import search
+
+logger = logging.getLogger('documents')
+
+
+DEFAULT_PROCESSING_CONFIG = {
+    'ENABLED': True,
+    'EXECUTOR': 'thread',   # 'thread' 或 'process'
+    'WORKERS': 2,
+    'MAX_ATTEMPTS': 3,
+    'RETRY_DELAY': 2,       # 第一次重试前等待的秒数，之后每次加倍
+    'STALE_AFTER': 600,     # 运行超过该秒数仍未更新的任务视为已中断
+    'ARTIFACT_ROOT': None,  # 默认 BASE_DIR/artifacts
+}
+
+PREVIEW_TYPES = ('markdown', 'text', 'code')
+
+
+def get_processing_config() -> Dict[str, Any]:
+    config = DEFAULT_PROCESSING_CONFIG.copy()
+    config.update(getattr(settings, 'DOCUMENT_PROCESSING', {}))
+    return config
+
+
+def get_artifact_root() -> str:
+    root = get_processing_config()['ARTIFACT_ROOT']
+    return root or os.path.join(settings.BASE_DIR, 'artifacts')
+
+
+def preview_fingerprint(file_type: str) -> str:
+    """预览产物的版本标识，渲染配置变化后旧的预览不再使用"""
+    if file_type == 'markdown':
+        from markdown_renderer.utils import MarkdownRenderer
+        return MarkdownRenderer.get_config_fingerprint()
+    if file_type == 'code':
+        from .previews import highlight_fingerprint
+        return f'code-{highlight_fingerprint()}'
+    return 'text'
+
+
+def preview_artifact_path(document) -> str:
+    file_type = document.get_file_type()
+    name = f'preview.{preview_fingerprint(file_type)}'
+    if file_type == 'markdown':
+        # 产物目录按内容共用，Markdown预览中的图片地址只对文档所有者有效（见 build_asset_url）
+        name += f'.{document.owner_id}'
+    return os.path.join(document.artifact_dir, f'{name}.html')
+
+
+def read_preview_artifact(document) -> Optional[str]:
+    """状态为就绪且产物存在时返回预生成的预览HTML"""
+    from .textpager import should_page
+    if document.status != document.STATUS_READY or document.get_file_type() not in PREVIEW_TYPES:
+        return None
+    if should_page(document):
+        return None
+    try:
+        with open(preview_artifact_path(document), 'r', encoding='utf-8') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _write_artifact(path: str, data: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def process_document(document) -> None:
+    """生成文档的预览、纯文本和元数据产物"""
+    from markdown_renderer.utils import MarkdownRenderer
+    from .previews import render_text_preview
+    from markdown_renderer.utils.sections import render_section
+    from .textpager import should_page, should_section, ensure_line_index, read_page
+
+    file_path = document.file.path
+    # 上传时已写入的元数据字段只在文件有变化时重新计算
+    document.populate_file_metadata()
+    file_type = document.get_file_type()
+
+    if file_type == 'image':
+        # 缩略图按内容哈希保存在渲染缓存目录中，已存在的不会重新生成
+        from markdown_renderer.utils.images import generate_derivatives
+        generate_derivatives(file_path, document.sha256 or None)
+
+    # 产物按内容哈希存放，相同内容已处理过时直接复用
+    if artifacts_are_current(document):
+        return
+    meta_path = os.path.join(document.artifact_dir, 'meta.json')
+
+    meta = {
+        'file_type': file_type,
+        'size': document.file_size,
+        'sha256': document.sha256,
+        'mime_type': document.mime_type,
+    }
+
+    if should_page(document):
+        # 大文本文件分页显示，只需要建立行索引，不生成整份预览
+        ensure_line_index(document)
+        meta['lines'] = read_page(document, page=1, lines_per_page=1).total_lines
+        meta['encoding'] = document.encoding
+    elif file_type in PREVIEW_TYPES:
+        content = document.read_text()
+        meta['encoding'] = document.encoding
+        if file_type == 'markdown' and should_section(document) and \
+                render_section(file_path, 0, encoding=document.encoding, asset_owner=document.owner_id) is not None:
+            # 分段加载的文档只预先建立分段索引并渲染第一段，不做整份渲染（文件可能超过 MAX_SIZE）；
+            # 页面不使用整份预览，搜索文本直接取源文本
+            preview = None
+            text = content
+            meta['sectioned'] = preview_fingerprint(file_type)
+        elif file_type == 'markdown':
+            preview = MarkdownRenderer.render_file(file_path, encoding=document.encoding,
+                                                   asset_owner=document.owner_id)
+            text = strip_tags(preview)
+        else:
+            preview = render_text_preview(document, content)
+            text = content
+        meta['lines'] = content.count('\n') + 1 if content else 0
+
+        if preview is not None:
+            _write_artifact(preview_artifact_path(document), preview)
+        _write_artifact(os.path.join(document.artifact_dir, 'text.txt'), text)
+
+    _write_artifact(meta_path, json.dumps(meta, ensure_ascii=False))
+
+
+def artifacts_are_current(document) -> bool:
+    """同一内容的产物已经生成（且渲染配置未变）时返回 True，并沿用其中记录的编码"""
+    from .textpager import should_page
+
+    if not document.sha256:
+        return False
+    meta_path = os.path.join(document.artifact_dir, 'meta.json')
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return False
+    if meta.get('sha256') != document.sha256:
+        return False
+    file_type = document.get_file_type()
+    if file_type in PREVIEW_TYPES and not should_page(document) and \
+            meta.get('sectioned') != preview_fingerprint(file_type):
+        if not os.path.exists(preview_artifact_path(document)):
+            return False
+    if meta.get('encoding') and not document.encoding:
+        document.encoding = meta['encoding']
+        type(document).objects.filter(pk=document.pk).update(encoding=document.encoding)
+    return True
+
+
+def run_job(job_id: int) -> Optional[float]:
+    """
+    执行一个处理任务；任务已被其它工作线程领取时直接返回
+
+    任务失败但还可以重试时返回重试前等待的秒数，由提交方延迟后重新提交；否则返回 None。
+    """
+    from markdown_renderer.utils.isolation import RenderLimitExceeded
+    from .models import Document, ProcessingJob
+
+    claimed = ProcessingJob.objects.filter(id=job_id, status=ProcessingJob.STATUS_PENDING).update(
+        status=ProcessingJob.STATUS_RUNNING, attempts=F('attempts') + 1, updated_at=timezone.now())
+    if not claimed:
+        return None
+
+    job = ProcessingJob.objects.select_related('document').get(id=job_id)
+    document = job.document
+    try:
+        process_document(document)
+        search.index_document(document, search.extract_text(document))
+    except Exception as e:
+        logger.warning(f"处理文档 {document.pk} 失败（第{job.attempts}次）: {e}")
+        # 超出渲染上限的文档重试也不会成功，页面上显示原文
+        config = get_processing_config()
+        retry = (not isinstance(e, RenderLimitExceeded) and job.attempts < config['MAX_ATTEMPTS'])
+        job.status = ProcessingJob.STATUS_PENDING if retry else ProcessingJob.STATUS_FAILED
+        job.error = str(e)
+        job.save(update_fields=['status', 'error', 'updated_at'])
+        if not retry:
+            Document.objects.filter(pk=document.pk).update(status=Document.STATUS_FAILED)
+            return None
+        # 数据库被锁、文件仍在写入等临时原因需要时间消除，立即重试只会很快用完所有次数
+        return config['RETRY_DELAY'] * 2 ** (job.attempts - 1)
+
+    job.status = ProcessingJob.STATUS_DONE
+    job.error = ''
+    job.save(update_fields=['status', 'error', 'updated_at'])
+    Document.objects.filter(pk=document.pk).update(status=Document.STATUS_READY, processed_at=timezone.now())
+    return None
+
+
+def prerender_document(document_id: int) -> Optional[str]:
+    """在工作进程中生成一个文档的产物（供 prerender_documents 命令使用），失败时返回错误信息"""
+    from .models import Document
+
+    close_old_connections()
+    try:
+        process_document(Document.objects.get(pk=document_id))
+    except Exception as e:
+        return str(e) or e.__class__.__name__
+    finally:
+        close_old_connections()
+    return None
+
+
+def _run_job_in_worker(job_id: int) -> Optional[float]:
+    # 工作线程不经过请求周期，需要自己清理过期的数据库连接
+    close_old_connections()
+    try:
+        return run_job(job_id)
+    finally:
+        close_old_connections()
+
+
+def init_process_worker() -> None:
+    import django
+    django.setup()
+
+
+_executor: Optional[Executor] = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> Executor:
+    """首次使用时创建执行器，并恢复上次进程退出时未完成的任务"""
+    global _executor
+    if _executor is not None:
+        return _executor
+    with _executor_lock:
+        if _executor is None:
+            config = get_processing_config()
+            if config['EXECUTOR'] == 'process':
+                # 服务进程中有多个线程，直接 fork 可能复制其它线程持有的锁；与渲染隔离（isolation.py）一样
+                # 使用 forkserver（不可用时 spawn），子进程在 init_process_worker 中重新初始化 Django
+                method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                connections.close_all()
+                _executor = ProcessPoolExecutor(max_workers=config['WORKERS'], initializer=init_process_worker,
+                                                mp_context=multiprocessing.get_context(method))
+            else:
+                _executor = ThreadPoolExecutor(max_workers=config['WORKERS'], thread_name_prefix='doc-pipeline')
+            recover_jobs()
+    return _executor
+
+
+def submit(job_id: int) -> None:
+    def on_done(future):
+        # 回调在提交方进程中执行，进程池模式下也不会在子进程里再创建执行器
+        try:
+            retry_delay = future.result()
+        except Exception as e:
+            logger.error(f"文档处理任务 {job_id} 异常退出: {e}")
+            return
+        if retry_delay is not None:
+            timer = threading.Timer(retry_delay, submit, (job_id,))
+            timer.daemon = True
+            timer.start()
+
+    get_executor().submit(_run_job_in_worker, job_id).add_done_callback(on_done)
+
+
+def recover_jobs() -> int:
+    """把中断的任务重置为等待状态并重新提交，返回提交的任务数"""
+    from datetime import timedelta
+    from .models import ProcessingJob
+
+    # 只回收长时间没有更新的任务，其它进程中正在运行的任务不受影响
+    stale_before = timezone.now() - timedelta(seconds=get_processing_config()['STALE_AFTER'])
+    ProcessingJob.objects.filter(status=ProcessingJob.STATUS_RUNNING, updated_at__lt=stale_before).update(
+        status=ProcessingJob.STATUS_PENDING)
+    job_ids = list(ProcessingJob.objects.filter(status=ProcessingJob.STATUS_PENDING).values_list('id', flat=True))
+    for job_id in job_ids:
+        submit(job_id)
+    if job_ids:
+        logger.info(f"恢复了 {len(job_ids)} 个未完成的文档处理任务")
+    return len(job_ids)
+
+
+def ensure_started() -> None:
+    """确保执行器已启动（从而恢复未完成的任务）"""
+    if get_processing_config()['ENABLED']:
+        get_executor()
+
+
+def enqueue(document):
+    """为文档创建处理任务，在事务提交后提交到执行器"""
+    from .models import ProcessingJob
+
+    if not get_processing_config()['ENABLED']:
+        return None
+    job = ProcessingJob.objects.create(document=document)
+    transaction.on_commit(lambda: submit(job.id))
+    return job
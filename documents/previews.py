@@ -0,0 +1,79 @@
+"""
+文本和代码文件的预览生成
+
+document_view 和后台处理流水线共用这里的逻辑。
+"""
+import hashlib
+import json
+from typing import Optional
+
+import pygments
+from pygments.formatters import HtmlFormatter
+from pygments.lexers import get_lexer_for_filename
+from pygments.util import ClassNotFound
+from django.utils.html import escape
+
+from markdown_renderer.utils.cache import TieredCache, file_digest
+
+# 代码预览的Pygments格式化选项，样式表通过 {% pygments_css_url %} 单独引用
+HIGHLIGHT_OPTIONS = {
+    'linenos': True,
+    'cssclass': 'highlight',
+}
+
+highlight_cache = TieredCache('highlight')
+
+
+def highlight_fingerprint() -> str:
+    """高亮输出的版本标识：Pygments版本 + 格式化选项"""
+    payload = json.dumps({'pygments': pygments.__version__, 'options': HIGHLIGHT_OPTIONS}, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+
+def get_lexer(file_path: str):
+    try:
+        return get_lexer_for_filename(file_path)
+    except ClassNotFound:
+        return None
+
+
+def highlight_code(content: str, lexer) -> str:
+    """用Pygments高亮代码，没有合适的词法分析器时退回纯文本"""
+    if lexer is None:
+        return f'<pre class="text-content">{escape(content)}</pre>'
+    # Pygments会自行转义，这里不能预先escape，否则 < 等字符会显示成实体
+    highlighted = pygments.highlight(content, lexer, HtmlFormatter(**HIGHLIGHT_OPTIONS))
+    return f'<div class="code-container">{highlighted}</div>'
+
+
+def render_code_preview(document, content: Optional[str] = None) -> str:
+    """
+    生成代码文件的高亮预览
+
+    结果按 (文件内容哈希, 词法分析器, 格式化选项) 缓存，大文件不必每次重新高亮。
+    """
+    file_path = document.file.path
+    lexer = get_lexer(file_path)
+    # 上传时已记录内容哈希，只有旧数据才需要重新读取整个文件计算
+    digest = document.sha256 or file_digest(file_path)
+    key_source = '|'.join([digest, lexer.name if lexer else 'plain', highlight_fingerprint()])
+    cache_key = hashlib.sha256(key_source.encode('utf-8')).hexdigest()
+
+    cached = highlight_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    if content is None:
+        content = document.read_text()
+    html_content = highlight_code(content, lexer)
+    highlight_cache.set(cache_key, html_content)
+    return html_content
+
+
+def render_text_preview(document, content: Optional[str] = None) -> str:
+    """生成文本或代码文件的预览HTML；已读取的内容可以通过 content 传入"""
+    if document.get_file_type() == 'code':
+        return render_code_preview(document, content)
+    if content is None:
+        content = document.read_text()
+    return f'<pre class="text-content">{escape(content)}</pre>'
@@ -0,0 +1,194 @@
+"""
+文档全文搜索
+
+在现有SQLite数据库中维护一张FTS5虚拟表（rowid 为文档ID），标题和正文文本由后台处理流水线写入，
+删除文档时同步删除。文档所有者也作为一个词写入索引，按用户过滤在倒排表中完成，
+不必逐行回表读取所有者字段（命中很多的常见词上快一个数量级）。使用 trigram 分词，中文也可以按任意子串搜索；少于3个字符的搜索词
+无法使用 trigram 索引，只匹配标题。非SQLite数据库下搜索不可用。
+"""
+import html
+import logging
+import os
+from dataclasses import dataclass
+from typing import List, Optional
+
+from django.db import connection, OperationalError, DatabaseError
+
+logger = logging.getLogger('documents')
+
+SEARCH_TABLE = 'documents_search'
+
+# 索引的正文最多保留的字符数，超大的文本文件只索引开头部分
+MAX_INDEX_CHARS = 1000000
+
+# trigram 分词要求搜索词至少3个字符
+MIN_TERM_LENGTH = 3
+
+# bm25 权重：标题命中比正文命中更重要，所有者列不参与排序
+TITLE_WEIGHT = 10.0
+BODY_WEIGHT = 1.0
+OWNER_WEIGHT = 0.0
+
+# 所有者ID编码为3个补充私用区字符：在 trigram 分词下恰好是一个独立的词，不会与正文中的文字重合
+_OWNER_KEY_BASE = 0xF0000
+_OWNER_KEY_BITS = 10
+
+SNIPPET_TOKENS = 16
+
+# 高亮标记先用私有区字符占位，转义正文后再替换为 <mark>
+_MARK_START = '\ue000'
+_MARK_END = '\ue001'
+
+CREATE_TABLE_SQL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} "
+    f"USING fts5(title, body, owner_key, tokenize='{{tokenizer}}')"
+)
+
+SEARCH_SQL = (
+    f"SELECT rowid, snippet({SEARCH_TABLE}, 1, %s, %s, '…', {SNIPPET_TOKENS}), "
+    f"bm25({SEARCH_TABLE}, {TITLE_WEIGHT}, {BODY_WEIGHT}, {OWNER_WEIGHT}) AS rank "
+    f"FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s "
+    f"ORDER BY rank LIMIT %s"
+)
+
+
+def create_search_table(cursor) -> str:
+    """创建FTS5表，SQLite不支持 trigram 分词时退回 unicode61，返回实际使用的分词器"""
+    for tokenizer in ('trigram', 'unicode61'):
+        try:
+            cursor.execute(CREATE_TABLE_SQL.format(tokenizer=tokenizer))
+            return tokenizer
+        except Exception:
+            continue
+    raise RuntimeError('SQLite不支持FTS5，无法创建搜索索引')
+
+
+def is_available() -> bool:
+    return connection.vendor == 'sqlite'
+
+
+def owner_key(owner_id: int) -> str:
+    return ''.join(chr(_OWNER_KEY_BASE + ((owner_id >> shift) & ((1 << _OWNER_KEY_BITS) - 1)))
+                   for shift in (2 * _OWNER_KEY_BITS, _OWNER_KEY_BITS, 0))
+
+
+def build_match_query(query: str, owner_id: Optional[int] = None) -> Optional[str]:
+    """
+    把用户输入转换为FTS5查询：每个词作为短语加引号（避免用户输入被当作FTS语法），多个词之间为AND
+
+    没有可用于索引的词时返回 None。传入 owner_id 时只匹配该用户的文档。
+    """
+    terms = [term for term in query.split() if len(term) >= MIN_TERM_LENGTH]
+    if not terms:
+        return None
+    phrases = ' '.join('"{}"'.format(term.replace('"', '""')) for term in terms)
+    match = f'{{title body}} : ({phrases})'
+    if owner_id is not None:
+        match = f'owner_key : "{owner_key(owner_id)}" AND {match}'
+    return match
+
+
+def search_params(match: str, limit: int) -> list:
+    """SEARCH_SQL 的参数"""
+    return [_MARK_START, _MARK_END, match, limit]
+
+
+def render_snippet(snippet: str) -> str:
+    """转义片段文本并把命中位置替换为 <mark>"""
+    escaped = html.escape(snippet or '')
+    return escaped.replace(_MARK_START, '<mark>').replace(_MARK_END, '</mark>')
+
+
+def index_document(document, text: str) -> None:
+    """写入（或替换）文档的索引记录"""
+    if not is_available():
+        return
+    body = (text or '')[:MAX_INDEX_CHARS]
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", [document.pk])
+            cursor.execute(
+                f"INSERT INTO {SEARCH_TABLE} (rowid, title, body, owner_key) VALUES (%s, %s, %s, %s)",
+                [document.pk, document.title, body, owner_key(document.owner_id)])
+    except DatabaseError as e:
+        logger.warning(f"更新文档 {document.pk} 的搜索索引失败: {e}")
+
+
+def update_title(document) -> None:
+    if not is_available():
+        return
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"UPDATE {SEARCH_TABLE} SET title = %s WHERE rowid = %s", [document.title, document.pk])
+    except DatabaseError as e:
+        logger.warning(f"更新文档 {document.pk} 的搜索标题失败: {e}")
+
+
+def remove_document(document_id: int) -> None:
+    if not is_available():
+        return
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", [document_id])
+    except DatabaseError as e:
+        logger.warning(f"删除文档 {document_id} 的搜索索引失败: {e}")
+
+
+def extract_text(document) -> str:
+    """
+    取得文档用于索引的文本
+
+    优先使用后台处理生成的纯文本产物；Markdown直接索引源文本，大文本文件只读取开头部分。
+    """
+    from .pipeline import PREVIEW_TYPES
+
+    if document.get_file_type() not in PREVIEW_TYPES:
+        return ''
+    text_path = os.path.join(document.artifact_dir, 'text.txt')
+    try:
+        with open(text_path, 'r', encoding='utf-8') as f:
+            return f.read(MAX_INDEX_CHARS)
+    except OSError:
+        pass
+
+    from .textpager import should_page
+    if should_page(document):
+        encoding = document.encoding or document.detect_encoding()
+        with open(document.file.path, 'rb') as f:
+            return f.read(MAX_INDEX_CHARS).decode(encoding, errors='replace')
+    return document.read_text()
+
+
+@dataclass
+class SearchHit:
+    document: object
+    snippet: str
+    rank: float
+
+
+def search(user, query: str, limit: int = 50) -> List[SearchHit]:
+    """按相关度返回用户自己的文档"""
+    from .models import Document
+
+    query = (query or '').strip()
+    if not query:
+        return []
+
+    match = build_match_query(query, user.pk) if is_available() else None
+    if match is None:
+        # 搜索词太短（或数据库不支持FTS5）时只按标题匹配，标题不在文件中，不需要读取文件
+        documents = Document.objects.filter(owner=user, title__icontains=query).order_by('-uploaded_at')[:limit]
+        return [SearchHit(document, '', 0.0) for document in documents]
+
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(SEARCH_SQL, search_params(match, limit))
+            rows = cursor.fetchall()
+    except OperationalError as e:
+        logger.warning(f"全文搜索失败: {e}")
+        return []
+
+    # owner_key 只是索引中的过滤词，可能碰撞或过期；结果仍按所有者过滤，不会显示其他用户的文档和片段
+    documents = Document.objects.filter(owner=user).in_bulk([row[0] for row in rows])
+    return [SearchHit(documents[doc_id], render_snippet(snippet), rank)
+            for doc_id, snippet, rank in rows if doc_id in documents]
@@ -0,0 +1,52 @@
+import shutil
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Document, UploadSession
+from .storage import blob_references
+from . import pipeline, search
+
+
+@receiver(post_save, sender=Document)
+def enqueue_document_processing(sender, instance, created, raw=False, **kwargs):
+    """新文档保存后提交后台处理任务；已有文档保存时同步搜索索引中的标题"""
+    if created and not raw:
+        if instance.file:
+            # 记录提交后数据库中已能看到这条引用，解除上传时对 blob 的钉住
+            transaction.on_commit(partial(blob_references.unpin, instance.file.name))
+        pipeline.enqueue(instance)
+    elif not raw:
+        search.update_title(instance)
+
+
+@receiver(post_delete, sender=Document)
+def release_document_blob(sender, instance, **kwargs):
+    """删除最后一条引用时才删除存储文件和后台处理生成的产物；删除在事务提交后进行，回滚时文件保留"""
+    search.remove_document(instance.pk)
+    if not instance.file:
+        return
+    transaction.on_commit(partial(remove_unreferenced_blob, instance.file.storage, instance.file.name,
+                                  instance.sha256, instance.artifact_dir))
+
+
+def remove_unreferenced_blob(storage, name, sha256, artifact_dir):
+    """没有文档引用时删除 blob 和它的处理产物；与上传时“blob 已存在则直接引用”的判断互斥，并重新检查已提交和未提交的引用"""
+    with blob_references.lock(name):
+        if blob_references.is_pinned(name):
+            return
+        if sha256 and Document.objects.filter(sha256=sha256).exists():
+            return
+        if Document.objects.filter(file=name).exists():
+            return
+        shutil.rmtree(artifact_dir, ignore_errors=True)
+        storage.delete(name)
+
+
+@receiver(post_delete, sender=UploadSession)
+def remove_upload_temp_file(sender, instance, **kwargs):
+    """上传会话被取消、过期或随用户删除时删除临时文件（完成时临时文件已被移走）"""
+    from .uploads import remove_temp_file
+    remove_temp_file(instance)
@@ -0,0 +1,160 @@
+"""
+按内容哈希寻址的文档存储
+
+文件保存为 <upload_to>/<哈希前两位>/<sha256><扩展名>，内容相同的上传共用同一个文件（blob），
+不再产生 test_document_88fkooA.md 这样的副本。写入时先写临时文件再原子重命名，
+并发上传同一内容也不会读到写了一半的文件。上传处理器已经算好哈希的临时文件直接移动（同一文件系统上是重命名，否则先复制到 blob 目录中再重命名）。
+blob 被多少条文档记录引用由数据库决定，最后一条引用删除时才删除文件（见 signals.py）。
+"""
+import hashlib
+import os
+import re
+import tempfile
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+_BLOB_NAME_RE = re.compile(r'(?:^|/)[0-9a-f]{2}/([0-9a-f]{64})(?:\.[^/]*)?$')
+
+
+class BlobReferences:
+    """
+    按 blob 名的锁和尚未提交的引用
+
+    上传写入新 blob 或复用已有 blob 后，到文档记录提交之前数据库中还看不到这条引用，
+    此时 blob 被“钉住”（pin）；删除最后一条引用的清理在事务提交后持有同一把锁进行，
+    被钉住或仍有引用时不删除。锁和计数只在进程内有效。
+    """
+
+    def __init__(self):
+        self._guard = threading.Lock()
+        self._locks: Dict[str, List] = {}
+        self._pins: Counter = Counter()
+
+    @contextmanager
+    def lock(self, name: str):
+        with self._guard:
+            entry = self._locks.setdefault(name, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._guard:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[name]
+
+    def pin(self, name: str) -> None:
+        with self._guard:
+            self._pins[name] += 1
+
+    def unpin(self, name: str) -> None:
+        with self._guard:
+            if self._pins[name] > 1:
+                self._pins[name] -= 1
+            else:
+                self._pins.pop(name, None)
+
+    def is_pinned(self, name: str) -> bool:
+        with self._guard:
+            return self._pins[name] > 0
+
+
+blob_references = BlobReferences()
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+
+    @staticmethod
+    def digest_from_name(name: str) -> Optional[str]:
+        """从 blob 文件名中取出内容哈希，旧的按原文件名保存的文件返回 None"""
+        match = _BLOB_NAME_RE.search(name.replace('\\', '/'))
+        return match.group(1) if match else None
+
+    @staticmethod
+    def blob_name(directory: str, digest: str, ext: str) -> str:
+        return '/'.join(part for part in (directory, digest[:2], f'{digest}{ext.lower()}') if part)
+
+    def get_available_name(self, name, max_length=None):
+        # 最终文件名由内容决定，同名不需要改名
+        return name
+
+    def _save(self, name, content):
+        directory, base_name = os.path.split(name.replace('\\', '/'))
+        ext = os.path.splitext(base_name)[1]
+        digest = getattr(content, 'sha256', None)
+        if digest and hasattr(content, 'temporary_file_path'):
+            # 上传处理器已经边接收边计算了哈希（见 upload_handlers.py），临时文件直接移动到位，不再复制
+            return self._move_blob(directory, digest, ext, content.temporary_file_path())
+        tmp_dir = self.path(directory)
+        os.makedirs(tmp_dir, exist_ok=True)
+
+        # 边写临时文件边计算哈希，只读取一遍上传内容
+        hasher = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir, prefix='.upload-', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks(HASH_CHUNK_SIZE):
+                    hasher.update(chunk)
+                    f.write(chunk)
+            digest = hasher.hexdigest()
+            blob = self.blob_name(directory, digest, ext)
+            blob_path = self.path(blob)
+            with blob_references.lock(blob):
+                if os.path.exists(blob_path):
+                    # 已有相同内容的 blob，直接引用
+                    os.remove(tmp_path)
+                else:
+                    os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                    if self.file_permissions_mode is not None:
+                        os.chmod(tmp_path, self.file_permissions_mode)
+                    os.replace(tmp_path, blob_path)
+                # 文档记录提交后解除（见 signals.py）
+                blob_references.pin(blob)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return blob
+
+    def _move_blob(self, directory, digest, ext, tmp_path):
+        blob = self.blob_name(directory, digest, ext)
+        blob_path = self.path(blob)
+        blob_dir = os.path.dirname(blob_path)
+        os.makedirs(blob_dir, exist_ok=True)
+        # 上传临时目录可能在其它文件系统上，此时 file_move_safe 会退回复制；
+        # 先移动到 blob 目录中的临时文件，再原子重命名，读者和并发上传不会看到写了一半的 blob
+        fd, staging_path = tempfile.mkstemp(dir=blob_dir, prefix='.upload-', suffix='.tmp')
+        os.close(fd)
+        try:
+            file_move_safe(tmp_path, staging_path, allow_overwrite=True)
+            if self.file_permissions_mode is not None:
+                os.chmod(staging_path, self.file_permissions_mode)
+            with blob_references.lock(blob):
+                if os.path.exists(blob_path):
+                    os.remove(staging_path)
+                else:
+                    os.replace(staging_path, blob_path)
+                blob_references.pin(blob)
+        except BaseException:
+            if os.path.exists(staging_path):
+                os.remove(staging_path)
+            raise
+        return blob
+
+document_storage = ContentAddressedStorage()
+
+
+def get_document_storage():
+    return document_storage
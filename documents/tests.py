@@ -0,0 +1,173 @@
+import base64
+import io
+import json
+import os
+import tempfile
+from concurrent.futures import Executor, Future
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.http import Http404
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from documents.models import Document, ProcessingJob
+from documents import pipeline, uploads
+from documents.pagination import KeysetPaginator, encode_cursor
+from documents.storage import blob_references, document_storage
+from markdown_renderer.utils import FileValidator
+
+
+def _raw_cursor(values) -> str:
+    payload = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
+
+
+class KeysetCursorTests(TestCase):
+    """被篡改的分页游标返回404，而不是在执行查询时出错"""
+
+    TAMPERED = (['notadate', 5], [1, 2], [[1], 2], [{'x': 1}, 5], [None, 5], ['2024-01-01T00:00:00', 'x'])
+
+    def test_tampered_cursor_is_rejected(self):
+        paginator = KeysetPaginator(Document.objects.all(), ('-uploaded_at', '-id'), 10)
+        for values in self.TAMPERED:
+            for param in ('after', 'before'):
+                with self.subTest(values=values, param=param):
+                    with self.assertRaises(Http404):
+                        paginator.page(**{param: _raw_cursor(values)})
+
+    def test_list_view_returns_404(self):
+        user = User.objects.create_user('reader', password='pw')
+        self.client.force_login(user)
+        for values in self.TAMPERED:
+            with self.subTest(values=values):
+                response = self.client.get('/documents/', {'after': _raw_cursor(values)})
+                self.assertEqual(response.status_code, 404)
+
+    def test_valid_cursor_still_pages(self):
+        paginator = KeysetPaginator(Document.objects.all(), ('-uploaded_at', '-id'), 10)
+        page = paginator.page(after=encode_cursor([timezone.now(), 1]))
+        self.assertEqual(list(page), [])
+
+
+class UploadRejectionTests(TestCase):
+    """表单上传：超过大小上限返回413，类型不符返回415，保存的MIME类型来自上传处理器"""
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=media.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.client.force_login(User.objects.create_user('uploader', password='pw'))
+
+    def upload(self, name: str, content: bytes):
+        return self.client.post('/documents/upload/', {'title': name, 'file': SimpleUploadedFile(name, content)})
+
+    def test_mismatched_content_is_415(self):
+        self.assertEqual(self.upload('photo.png', b'not a png\n').status_code, 415)
+
+    def test_disallowed_extension_is_415(self):
+        self.assertEqual(self.upload('tool.exe', b'MZ\x90\x00').status_code, 415)
+
+    @override_settings(DOCUMENT_UPLOADS={'MAX_SIZES': {'markdown': 16}})
+    def test_oversized_file_is_413(self):
+        self.assertEqual(self.upload('big.md', b'# title\n' * 64).status_code, 413)
+
+    def test_sniffed_mime_type_is_stored(self):
+        # 按扩展名猜测为 text/x-python，上传处理器按白名单判断为 text/plain
+        content = b'print(1)\n'
+        self.assertEqual(self.upload('script.py', content).status_code, 302)
+        document = Document.objects.get(title='script.py')
+        self.assertEqual(document.mime_type, FileValidator.sniff_mimetype('script.py', content))
+        self.assertNotEqual(document.mime_type, FileValidator.guess_mimetype(document.file.path))
+
+
+class CompleteSessionFailureTests(TestCase):
+    """文档记录写入失败时，complete_session 移入的 blob 没有其它引用就删除"""
+
+    CONTENT = b'# chunked\n'
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        # 不启动后台处理，处理产物也放在临时目录中
+        media_settings = override_settings(MEDIA_ROOT=media.name, DOCUMENT_PROCESSING={
+            'ENABLED': False, 'ARTIFACT_ROOT': os.path.join(media.name, 'artifacts')})
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.user = User.objects.create_user('chunker', password='pw')
+
+    def uploaded_session(self):
+        session = uploads.create_session(self.user, 'chunked', 'chunked.md', len(self.CONTENT))
+        uploads.write_chunk(session, 0, io.BytesIO(self.CONTENT), len(self.CONTENT))
+        return session
+
+    def complete_failing(self, session):
+        with mock.patch.object(Document, 'populate_file_metadata', side_effect=RuntimeError('boom')):
+            with self.assertRaises(RuntimeError):
+                uploads.complete_session(session)
+
+    def test_new_blob_is_removed(self):
+        session = self.uploaded_session()
+        self.complete_failing(session)
+        self.assertFalse(Document.objects.exists())
+        blobs = [name for _, _, names in os.walk(document_storage.location) for name in names
+                 if name.endswith('.md')]
+        self.assertEqual(blobs, [])
+
+    def test_referenced_blob_is_kept(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            existing = uploads.complete_session(self.uploaded_session())
+        self.complete_failing(self.uploaded_session())
+        self.assertTrue(os.path.exists(existing.file.path))
+        self.assertFalse(blob_references.is_pinned(existing.file.name))
+
+
+class _ImmediateExecutor(Executor):
+    """在当前线程中同步执行提交的任务"""
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        future.set_result(fn(*args, **kwargs))
+        return future
+
+
+@override_settings(DOCUMENT_PROCESSING={'ENABLED': False, 'MAX_ATTEMPTS': 3, 'RETRY_DELAY': 2})
+class ProcessingRetryTests(TestCase):
+    """可重试的失败回到等待状态，延迟后再次执行，等待时间逐次加倍"""
+
+    def setUp(self):
+        user = User.objects.create_user('processor', password='pw')
+        self.document = Document.objects.create(title='retry', owner=user, file='documents/retry.md')
+        self.job = ProcessingJob.objects.create(document=self.document)
+
+    @mock.patch.object(pipeline.search, 'extract_text', return_value='')
+    @mock.patch.object(pipeline.search, 'index_document')
+    def test_failed_job_returns_to_pending_and_runs_again(self, index_document, extract_text):
+        with mock.patch.object(pipeline, 'process_document', side_effect=[OSError('database is locked'), None]):
+            self.assertEqual(pipeline.run_job(self.job.id), 2)
+            self.job.refresh_from_db()
+            self.assertEqual((self.job.status, self.job.attempts), (ProcessingJob.STATUS_PENDING, 1))
+
+            self.assertIsNone(pipeline.run_job(self.job.id))
+        self.job.refresh_from_db()
+        self.document.refresh_from_db()
+        self.assertEqual((self.job.status, self.job.attempts), (ProcessingJob.STATUS_DONE, 2))
+        self.assertEqual(self.document.status, Document.STATUS_READY)
+
+    def test_last_attempt_fails_the_document(self):
+        ProcessingJob.objects.filter(pk=self.job.pk).update(attempts=2)
+        with mock.patch.object(pipeline, 'process_document', side_effect=OSError('database is locked')):
+            self.assertIsNone(pipeline.run_job(self.job.id))
+        self.document.refresh_from_db()
+        self.assertEqual(self.document.status, Document.STATUS_FAILED)
+
+    def test_retry_is_delayed(self):
+        with mock.patch.object(pipeline, 'get_executor', return_value=_ImmediateExecutor()), \
+                mock.patch.object(pipeline, '_run_job_in_worker', return_value=4), \
+                mock.patch.object(pipeline.threading, 'Timer') as timer:
+            pipeline.submit(self.job.id)
+        timer.assert_called_once_with(4, pipeline.submit, (self.job.id,))
+        timer.return_value.start.assert_called_once_with()
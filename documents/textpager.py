@@ -0,0 +1,259 @@
+"""
+大文本文件分页
+
+为每个文件建立一次行偏移索引（保存在文档产物目录中），之后通过 mmap 只读取所需页的字节，
+单次请求的内存占用与文件大小无关（每页最多读取 MAX_PAGE_BYTES 字节）。
+换行按字节 b'\n' 查找，只适用于与ASCII兼容的编码；UTF-16/32 文件先流式转码为 UTF-8 副本再建立索引。
+"""
+import codecs
+import mmap
+import os
+import struct
+import tempfile
+from array import array
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from django.conf import settings
+
+DEFAULT_VIEWER_CONFIG = {
+    'PAGED_TEXT_THRESHOLD': 1024 * 1024,  # 超过该大小的文本文件分页显示
+    'LINES_PER_PAGE': 500,
+    'MAX_PAGE_BYTES': 1024 * 1024,  # 每页最多读取的字节数，单行极长的文件一页也不会读入整个文件
+    'SECTIONED_MARKDOWN_THRESHOLD': 1024 * 1024,  # 超过该大小的Markdown文件分段加载
+    'ASYNC_VIEWS': False,  # 文档页面和列表使用异步视图（ASGI部署）
+}
+
+# 索引文件头：魔数、源文件大小、源文件 mtime_ns、行数
+INDEX_MAGIC = b'LIDX0001'
+INDEX_HEADER = struct.Struct('<8sQQQ')
+OFFSET_SIZE = 8
+
+# 建立索引时每次扫描的字节数
+SCAN_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def get_viewer_config():
+    config = DEFAULT_VIEWER_CONFIG.copy()
+    config.update(getattr(settings, 'DOCUMENT_VIEWER', {}))
+    return config
+
+
+def should_page(document) -> bool:
+    """文本文件超过阈值时分页显示"""
+    if document.get_file_type() != 'text':
+        return False
+    size = document.file_size
+    if size is None:
+        try:
+            size = os.path.getsize(document.file.path)
+        except OSError:
+            return False
+    return size > get_viewer_config()['PAGED_TEXT_THRESHOLD']
+
+
+def should_section(document) -> bool:
+    """Markdown文件超过阈值时先显示目录和第一段，其余各段按需加载"""
+    if document.get_file_type() != 'markdown':
+        return False
+    size = document.file_size
+    if size is None:
+        try:
+            size = os.path.getsize(document.file.path)
+        except OSError:
+            return False
+    return size > get_viewer_config()['SECTIONED_MARKDOWN_THRESHOLD']
+
+
+def is_wide_encoding(encoding: str) -> bool:
+    """UTF-16/32：换行符不是单个字节 b'\\n'，不能直接按字节建立行索引"""
+    try:
+        name = codecs.lookup(encoding).name
+    except LookupError:
+        return False
+    return name.startswith(('utf-16', 'utf-32'))
+
+
+def transcode_to_utf8(file_path: str, target_path: str, encoding: str) -> None:
+    """按块流式转码为 UTF-8，内存占用与文件大小无关"""
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target_path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as out, open(file_path, 'rb') as f:
+            while True:
+                chunk = f.read(SCAN_CHUNK_SIZE)
+                out.write(decoder.decode(chunk, final=not chunk).encode('utf-8'))
+                if not chunk:
+                    break
+        os.replace(tmp_path, target_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def paged_source(document) -> Tuple[str, str]:
+    """分页读取的文件和编码；UTF-16/32 文件返回产物目录中的 UTF-8 副本"""
+    file_path = document.file.path
+    encoding = document.encoding or document.detect_encoding()
+    if not is_wide_encoding(encoding):
+        return file_path, encoding
+    stat = os.stat(file_path)
+    # 副本名包含源文件大小和修改时间，源文件变化后自动重新转码
+    target_path = os.path.join(document.artifact_dir, f'text-{stat.st_size}-{stat.st_mtime_ns}.utf8')
+    if not os.path.exists(target_path):
+        transcode_to_utf8(file_path, target_path, encoding)
+    return target_path, 'utf-8'
+
+
+def build_line_index(file_path: str, index_path: str) -> None:
+    """扫描文件中的换行符，把每行的起始偏移写入索引文件"""
+    stat = os.stat(file_path)
+    offsets = array('Q', [0])
+
+    with open(file_path, 'rb') as f:
+        position = 0
+        while True:
+            chunk = f.read(SCAN_CHUNK_SIZE)
+            if not chunk:
+                break
+            find = chunk.find
+            start = find(b'\n')
+            while start != -1:
+                offsets.append(position + start + 1)
+                start = find(b'\n', start + 1)
+            position += len(chunk)
+
+    # 文件以换行结尾时最后一个偏移指向文件末尾，不构成新的一行
+    if len(offsets) > 1 and offsets[-1] == stat.st_size:
+        offsets.pop()
+    if stat.st_size == 0:
+        offsets = array('Q')
+
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(index_path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            out.write(INDEX_HEADER.pack(INDEX_MAGIC, stat.st_size, stat.st_mtime_ns, len(offsets)))
+            if offsets.itemsize != OFFSET_SIZE or offsets.typecode != 'Q':
+                raise RuntimeError('不支持的平台整数大小')
+            offsets.tofile(out)
+        os.replace(tmp_path, index_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _index_is_current(file_path: str, index_path: str) -> bool:
+    try:
+        with open(index_path, 'rb') as f:
+            header = f.read(INDEX_HEADER.size)
+    except OSError:
+        return False
+    if len(header) != INDEX_HEADER.size:
+        return False
+    magic, size, mtime_ns, _ = INDEX_HEADER.unpack(header)
+    stat = os.stat(file_path)
+    return magic == INDEX_MAGIC and size == stat.st_size and mtime_ns == stat.st_mtime_ns
+
+
+def ensure_line_index(document) -> str:
+    """返回文档的行索引路径，索引不存在或已过期时重新建立"""
+    source_path, _ = paged_source(document)
+    index_path = os.path.join(document.artifact_dir, 'lines.idx')
+    if not _index_is_current(source_path, index_path):
+        build_line_index(source_path, index_path)
+    return index_path
+
+
+@dataclass
+class TextPage:
+    number: int
+    page_count: int
+    first_line: int      # 从1开始
+    total_lines: int
+    lines: List[str]
+    truncated: bool = False  # 本页超过 MAX_PAGE_BYTES，只包含开头部分
+
+    @property
+    def has_previous(self) -> bool:
+        return self.number > 1
+
+    @property
+    def has_next(self) -> bool:
+        return self.number < self.page_count
+
+    @property
+    def previous_page_number(self) -> int:
+        return self.number - 1
+
+    @property
+    def next_page_number(self) -> int:
+        return self.number + 1
+
+    @property
+    def last_line(self) -> int:
+        return self.first_line + len(self.lines) - 1
+
+    def as_dict(self) -> dict:
+        return {
+            'page': self.number,
+            'pages': self.page_count,
+            'first_line': self.first_line,
+            'last_line': self.last_line,
+            'total_lines': self.total_lines,
+            'lines': self.lines,
+            'truncated': self.truncated,
+        }
+
+
+def read_page(document, page: Optional[int] = None, line: Optional[int] = None,
+              lines_per_page: Optional[int] = None) -> TextPage:
+    """
+    读取一页文本
+
+    page 从1开始；也可以传入 line（从1开始）读取包含该行的页。超出范围的页码会被限制到有效范围内。
+    """
+    config = get_viewer_config()
+    lines_per_page = lines_per_page or config['LINES_PER_PAGE']
+    index_path = ensure_line_index(document)
+    file_path, encoding = paged_source(document)
+
+    with open(index_path, 'rb') as index_file:
+        header = index_file.read(INDEX_HEADER.size)
+        _, file_size, _, total_lines = INDEX_HEADER.unpack(header)
+        page_count = max(1, -(-total_lines // lines_per_page))
+
+        if line is not None:
+            page = (max(1, line) - 1) // lines_per_page + 1
+        page = min(max(1, page or 1), page_count)
+
+        first = (page - 1) * lines_per_page
+        last = min(first + lines_per_page, total_lines)
+        if first >= last:
+            return TextPage(page, page_count, first + 1, total_lines, [])
+
+        # 只读取本页需要的偏移
+        index_file.seek(INDEX_HEADER.size + first * OFFSET_SIZE)
+        offsets = array('Q')
+        offsets.frombytes(index_file.read((last - first + 1) * OFFSET_SIZE))
+
+    start = offsets[0]
+    end = offsets[last - first] if len(offsets) > last - first else file_size
+    truncated = end - start > config['MAX_PAGE_BYTES']
+    if truncated:
+        end = start + config['MAX_PAGE_BYTES']
+
+    with open(file_path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            chunk = mm[start:end]
+
+    # 截断处可能在多字节字符中间，不完整的字符直接丢弃
+    text = codecs.getincrementaldecoder(encoding)(errors='replace').decode(chunk, final=not truncated)
+    lines = text.split('\n')
+    if lines and lines[-1] == '' and text.endswith('\n'):
+        lines.pop()
+    lines = [l[:-1] if l.endswith('\r') else l for l in lines]
+    return TextPage(page, page_count, first + 1, total_lines, lines, truncated)
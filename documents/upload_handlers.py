@@ -0,0 +1,110 @@
+"""
+边接收边验证的上传处理器
+
+Django 默认的上传处理器先把整个文件写到内存或临时文件，视图才能检查它。ValidatingUploadHandler 在数据流入时检查：
+
+- 文件名到达时检查扩展名白名单，请求的 Content-Length 超过该类型的大小上限时直接拒绝；
+- 第一段数据到达时按文件头（魔数、是否为文本）检查内容与扩展名是否相符；
+- 接收过程中累计大小，超过上限立即停止；
+- 同时计算 SHA-256 和行数，保存到上传文件对象上（sha256、line_count、mime_type），之后不必重新读取文件。
+
+不通过时不再读取请求体的剩余部分（StopUpload(connection_reset=True)），被拒绝的上传只消耗几KB；
+拒绝原因保存在 request.upload_rejection 中（UploadError，超过大小上限为413，类型不符为415），由视图显示给用户。
+"""
+import hashlib
+import logging
+from typing import Optional
+
+from django.core.exceptions import ValidationError
+from django.core.files.uploadhandler import StopUpload, TemporaryFileUploadHandler
+
+from markdown_renderer.utils import FileValidator
+
+from .uploads import UploadError, largest_upload_size, max_upload_size, validate_upload_name
+
+logger = logging.getLogger('documents')
+
+# 表单中除文件外其它字段和 multipart 边界占用的字节数上限，用于按 Content-Length 提前判断
+FORM_OVERHEAD = 64 * 1024
+
+
+class ValidatingUploadHandler(TemporaryFileUploadHandler):
+    """写入临时文件的同时验证、计算哈希和行数；完成后的文件可以直接重命名到存储中（见 storage.py）"""
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.request_length: Optional[int] = None
+        self.limit = 0
+        self.header = b''
+        self.mime_type: Optional[str] = None
+        self.hasher = None
+        self.lines = 0
+
+    def reject(self, message: str, status: int = 415) -> None:
+        logger.info(f"拒绝上传 {self.file_name or ''}: {message}")
+        if self.request is not None:
+            self.request.upload_rejection = UploadError(message, status)
+        # 已创建的临时文件由解析器关闭，关闭时自动删除
+        raise StopUpload(connection_reset=True)
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        self.request_length = content_length
+        # 返回 None，由默认的 multipart 解析器继续处理
+        return None
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None, content_type_extra=None):
+        self.file_name = file_name
+        try:
+            validate_upload_name(file_name)
+        except ValidationError as e:
+            self.reject(e.messages[0])
+        self.limit = max_upload_size(file_name)
+        # 整个请求已经超过上限时，不等文件内容到达
+        declared = content_length if content_length is not None else (
+            self.request_length - FORM_OVERHEAD if self.request_length else None)
+        if declared is not None and declared > self.limit:
+            self._reject_size(declared)
+
+        super().new_file(field_name, file_name, content_type, content_length, charset, content_type_extra)
+        self.header = b''
+        self.mime_type = None
+        self.hasher = hashlib.sha256()
+        self.lines = 0
+
+    def _reject_size(self, size: int) -> None:
+        try:
+            validate_upload_name(self.file_name, size)
+        except ValidationError as e:
+            self.reject(e.messages[0], 413)
+
+    def _check_header(self) -> None:
+        try:
+            self.mime_type = FileValidator.validate_header(self.file_name, self.header)
+        except ValidationError as e:
+            self.reject(e.messages[0])
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > self.limit:
+            self._reject_size(start + len(raw_data))
+        if self.mime_type is None:
+            self.header += raw_data[:FileValidator.HEADER_SIZE - len(self.header)]
+            if len(self.header) >= FileValidator.HEADER_SIZE:
+                self._check_header()
+        self.hasher.update(raw_data)
+        self.lines += raw_data.count(b'\n')
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        if self.mime_type is None:
+            # 文件比 HEADER_SIZE 短
+            self._check_header()
+        uploaded_file = super().file_complete(file_size)
+        uploaded_file.sha256 = self.hasher.hexdigest()
+        uploaded_file.line_count = self.lines + 1 if file_size else 0
+        uploaded_file.mime_type = self.mime_type
+        return uploaded_file
+
+
+def largest_request_size() -> int:
+    """可能接受的最大上传请求；Content-Length 更大的请求在读取请求体之前即可拒绝"""
+    return largest_upload_size() + FORM_OVERHEAD
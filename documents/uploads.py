@@ -0,0 +1,414 @@
+"""
+可续传的分块上传
+
+大文件不再用一次 multipart POST 上传：客户端先创建上传会话，再按编号逐块 PUT（可以并行、乱序、重传），
+随时可以查询服务器已收到哪些块，最后提交完成。连接中断后只需重传缺少的块。
+
+- 每块的请求体直接写入临时文件的对应偏移处，不经过 Django 的上传处理器，也不整体读入内存；
+- 边接收边计算每块的 SHA-256，以及整个文件的 SHA-256（按顺序到达的块在接收时计入，
+  乱序到达的块在前面的块补齐后从临时文件中补算，同一进程中顺序上传时完成时不需要再读取文件）；
+- 完成时把临时文件重命名为内容寻址的 blob（见 storage.py），不复制；
+- 超过 SESSION_TIMEOUT 没有新数据的会话及其临时文件被清理（expire_sessions，或 expire_uploads 命令）。
+"""
+import hashlib
+import logging
+import os
+import re
+import threading
+from datetime import timedelta
+from typing import Any, Dict, List, Optional
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.template.defaultfilters import filesizeformat
+from django.db import transaction
+from django.utils import timezone
+
+from markdown_renderer.utils import FileValidator
+
+from .models import Document, UploadChunk, UploadSession, detect_file_type
+from .signals import remove_unreferenced_blob
+from .storage import ContentAddressedStorage, blob_references, document_storage
+
+logger = logging.getLogger('documents')
+
+DEFAULT_UPLOAD_CONFIG = {
+    'CHUNK_SIZE': 8 * 1024 * 1024,       # 每块字节数（最后一块可以更小）
+    'MAX_SIZE': 1024 * 1024 * 1024,      # 上传文件大小上限（MAX_SIZES 中没有列出的类型）
+    # 按文件类型（见 models.FILE_TYPE_EXTENSIONS）的大小上限；Markdown 与分段渲染允许的大小一致
+    'MAX_SIZES': {
+        'markdown': 32 * 1024 * 1024,
+        'code': 32 * 1024 * 1024,
+        'image': 50 * 1024 * 1024,
+    },
+    'SESSION_TIMEOUT': 24 * 60 * 60,     # 秒；超过该时间没有新数据的会话被清理
+    'MAX_ACTIVE_SESSIONS': 10,           # 每个用户同时进行的上传会话数
+    'BROWSER_THRESHOLD': 16 * 1024 * 1024,  # 上传页面对超过该大小的文件使用分块上传
+}
+
+# 从请求体读取、写入临时文件的缓冲大小
+STREAM_BUFFER_SIZE = 256 * 1024
+
+_CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+
+def get_upload_config() -> Dict[str, Any]:
+    config = DEFAULT_UPLOAD_CONFIG.copy()
+    config.update(getattr(settings, 'DOCUMENT_UPLOADS', {}))
+    return config
+
+
+class UploadError(Exception):
+    """上传请求不合法；status 为返回给客户端的HTTP状态码"""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+def max_upload_size(file_name: str) -> int:
+    config = get_upload_config()
+    return config['MAX_SIZES'].get(detect_file_type(file_name), config['MAX_SIZE'])
+
+
+def largest_upload_size() -> int:
+    config = get_upload_config()
+    return max([config['MAX_SIZE']] + list(config['MAX_SIZES'].values()))
+
+
+def validate_upload_name(file_name: str, size: Optional[int] = None) -> None:
+    """按扩展名白名单和该类型的大小上限检查上传，不通过时抛出 ValidationError"""
+    FileValidator.validate_extension(file_name)
+    if size is not None:
+        limit = max_upload_size(file_name)
+        if size > limit:
+            raise ValidationError(f"文件过大，{detect_file_type(file_name)} 类型的文件最大允许 {filesizeformat(limit)}")
+
+
+def upload_directory() -> str:
+    return Document._meta.get_field('file').upload_to.strip('/')
+
+
+def temp_path(session: UploadSession) -> str:
+    """临时文件与 blob 在同一存储目录下，完成时可以原子重命名"""
+    return document_storage.path(f'{upload_directory()}/.uploads/{session.pk}.part')
+
+
+class _FileHasher:
+    """一个会话的整文件哈希：offset 之前的内容已计入；busy 时有请求正在按顺序计入"""
+
+    def __init__(self):
+        self.hasher = hashlib.sha256()
+        self.offset = 0
+        self.busy = False
+
+
+class _HasherRegistry:
+    """进程内各上传会话的整文件哈希状态；多进程部署时其它进程收到的块在完成时补算"""
+
+    def __init__(self):
+        self._hashers: Dict[str, _FileHasher] = {}
+        self._lock = threading.Lock()
+
+    def claim(self, session_id: str, offset: int) -> Optional[_FileHasher]:
+        """写入从 offset 开始的块时，如果它正好接在已计入的内容之后，取得哈希状态"""
+        with self._lock:
+            file_hasher = self._hashers.setdefault(session_id, _FileHasher())
+            if file_hasher.busy or file_hasher.offset != offset:
+                return None
+            file_hasher.busy = True
+            return file_hasher
+
+    def release(self, session_id: str, file_hasher: _FileHasher) -> None:
+        with self._lock:
+            file_hasher.busy = False
+
+    def discard(self, session_id: str) -> None:
+        """哈希状态不再可信（块写入失败或被重传）时丢弃，完成时从头补算"""
+        with self._lock:
+            self._hashers.pop(session_id, None)
+
+    def pop(self, session_id: str) -> Optional[_FileHasher]:
+        with self._lock:
+            file_hasher = self._hashers.get(session_id)
+            if file_hasher is None or file_hasher.busy:
+                return None
+            return self._hashers.pop(session_id)
+
+
+hashers = _HasherRegistry()
+
+
+def _received_numbers(session: UploadSession) -> List[int]:
+    return list(session.chunks.order_by('number').values_list('number', flat=True))
+
+
+def _contiguous_end(session: UploadSession, numbers: List[int]) -> int:
+    """从文件开头起连续收到的字节数"""
+    count = 0
+    for expected, number in enumerate(numbers):
+        if number != expected:
+            break
+        count += 1
+    return min(count * session.chunk_size, session.total_size)
+
+
+def _hash_file_range(file_hasher: _FileHasher, path: str, end: int) -> None:
+    """从临时文件中补算 [offset, end) 的哈希"""
+    if end <= file_hasher.offset:
+        return
+    with open(path, 'rb') as f:
+        f.seek(file_hasher.offset)
+        remaining = end - file_hasher.offset
+        while remaining:
+            data = f.read(min(STREAM_BUFFER_SIZE, remaining))
+            if not data:
+                raise UploadError('临时文件不完整', 409)
+            file_hasher.hasher.update(data)
+            remaining -= len(data)
+    file_hasher.offset = end
+
+
+def session_status(session: UploadSession) -> Dict[str, Any]:
+    """返回给客户端的会话状态：已收到的块编号和字节数"""
+    chunks = list(session.chunks.order_by('number').values_list('number', 'size'))
+    return {
+        'id': str(session.pk),
+        'title': session.title,
+        'file_name': session.file_name,
+        'size': session.total_size,
+        'chunk_size': session.chunk_size,
+        'chunk_count': session.chunk_count,
+        'received': [number for number, _ in chunks],
+        'received_bytes': sum(size for _, size in chunks),
+        'expires_at': session.expires_at.isoformat(),
+    }
+
+
+def create_session(owner, title: str, file_name: str, total_size: int) -> UploadSession:
+    config = get_upload_config()
+    title = (title or '').strip()
+    file_name = os.path.basename((file_name or '').replace('\\', '/')).strip()
+    if not title:
+        raise UploadError('标题不能为空')
+    if not file_name:
+        raise UploadError('文件名不能为空')
+    if total_size < 0:
+        raise UploadError('文件大小无效')
+    try:
+        validate_upload_name(file_name, total_size)
+    except ValidationError as e:
+        raise UploadError(e.messages[0], 413 if total_size > max_upload_size(file_name) else 415)
+
+    expire_sessions()
+    if UploadSession.objects.filter(owner=owner).count() >= config['MAX_ACTIVE_SESSIONS']:
+        raise UploadError('同时进行的上传过多，请先完成或取消其它上传', 429)
+
+    session = UploadSession.objects.create(
+        owner=owner, title=title[:255], file_name=file_name[:255], total_size=total_size,
+        chunk_size=config['CHUNK_SIZE'],
+        expires_at=timezone.now() + timedelta(seconds=config['SESSION_TIMEOUT']))
+    path = temp_path(session)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # 预先设定文件长度（稀疏文件），各块可以按任意顺序写入自己的偏移处
+    with open(path, 'wb') as f:
+        f.truncate(total_size)
+    return session
+
+
+def _read_at_least(stream, size: int) -> bytes:
+    """读取 size 字节（请求体提前结束时返回实际读到的部分）"""
+    parts = []
+    remaining = size
+    while remaining > 0:
+        data = stream.read(remaining)
+        if not data:
+            break
+        parts.append(data)
+        remaining -= len(data)
+    return b''.join(parts)
+
+
+def _check_content_range(header: Optional[str], offset: int, length: int, total: int) -> None:
+    """客户端给出 Content-Range 时，必须与块编号对应的偏移一致"""
+    if not header:
+        return
+    match = _CONTENT_RANGE_RE.match(header.strip())
+    if not match:
+        raise UploadError('Content-Range 格式无效')
+    start, end, size = (int(value) for value in match.groups())
+    if start != offset or end != offset + length - 1 or size != total:
+        raise UploadError(f'Content-Range 与块位置不符，应为 bytes {offset}-{offset + length - 1}/{total}', 416)
+
+
+def write_chunk(session: UploadSession, number: int, stream, content_length: Optional[int],
+                content_range: Optional[str] = None, expected_sha256: Optional[str] = None) -> UploadChunk:
+    """
+    把第 number 块的请求体写入临时文件
+
+    stream 为请求对象（按需 read），长度必须等于该块的大小。expected_sha256 不为空时校验该块的哈希，
+    不一致的块不记录，客户端需要重传。重传已收到的块时覆盖原内容。
+    """
+    if not 0 <= number < session.chunk_count:
+        raise UploadError(f'块编号超出范围（共 {session.chunk_count} 块）', 416)
+    offset, length = session.chunk_range(number)
+    if content_length != length:
+        raise UploadError(f'第 {number} 块应为 {length} 字节', 400)
+    _check_content_range(content_range, offset, length, session.total_size)
+
+    session_id = str(session.pk)
+    path = temp_path(session)
+    if not os.path.exists(path):
+        raise UploadError('上传会话已失效', 410)
+
+    resent = session.chunks.filter(number=number).exists()
+    if resent:
+        hashers.discard(session_id)
+    file_hasher = hashers.claim(session_id, offset)
+    chunk_hasher = hashlib.sha256()
+    written = lines = 0
+    try:
+        data = b''
+        if number == 0:
+            # 写入之前先按文件头检查内容是否与扩展名相符
+            data = _read_at_least(stream, min(FileValidator.HEADER_SIZE, length))
+            try:
+                FileValidator.validate_header(session.file_name, data)
+            except ValidationError as e:
+                raise UploadError(e.messages[0], 415)
+        with open(path, 'r+b') as f:
+            f.seek(offset)
+            while True:
+                if not data:
+                    if written >= length:
+                        break
+                    data = stream.read(min(STREAM_BUFFER_SIZE, length - written))
+                    if not data:
+                        break
+                f.write(data)
+                chunk_hasher.update(data)
+                if file_hasher is not None:
+                    file_hasher.hasher.update(data)
+                written += len(data)
+                lines += data.count(b'\n')
+                data = b''
+        digest = chunk_hasher.hexdigest()
+        if written != length:
+            raise UploadError(f'第 {number} 块不完整：收到 {written} / {length} 字节')
+        if expected_sha256 and expected_sha256.lower() != digest:
+            raise UploadError(f'第 {number} 块的 SHA-256 校验失败', 422)
+    except BaseException:
+        # 已计入整文件哈希的数据不再可信
+        if file_hasher is not None:
+            hashers.discard(session_id)
+        raise
+
+    with transaction.atomic():
+        chunk, _ = UploadChunk.objects.update_or_create(
+            session=session, number=number, defaults={'size': length, 'sha256': digest, 'lines': lines})
+        UploadSession.objects.filter(pk=session.pk).update(
+            expires_at=timezone.now() + timedelta(seconds=get_upload_config()['SESSION_TIMEOUT']))
+
+    if file_hasher is not None:
+        file_hasher.offset = offset + length
+        try:
+            # 之前乱序到达、接在本块之后的块现在可以补算
+            _hash_file_range(file_hasher, path, _contiguous_end(session, _received_numbers(session)))
+        except Exception:
+            hashers.discard(session_id)
+            raise
+        finally:
+            hashers.release(session_id, file_hasher)
+    return chunk
+
+
+def _line_count(session: UploadSession) -> int:
+    """按换行符计数，与预览中的行数一致（非空文件为换行数加一）"""
+    if not session.total_size:
+        return 0
+    return sum(session.chunks.values_list('lines', flat=True)) + 1
+
+
+def complete_session(session: UploadSession, expected_sha256: Optional[str] = None) -> Document:
+    """
+    全部块到齐后生成文档
+
+    临时文件重命名为内容寻址的 blob；已有相同内容的 blob 时直接引用并删除临时文件。
+    """
+    session_id = str(session.pk)
+    numbers = _received_numbers(session)
+    if len(numbers) != session.chunk_count:
+        missing = sorted(set(range(session.chunk_count)) - set(numbers))
+        raise UploadError(f'还有 {len(missing)} 块未上传：{missing[:20]}', 409)
+
+    path = temp_path(session)
+    file_hasher = hashers.pop(session_id) or _FileHasher()
+    _hash_file_range(file_hasher, path, session.total_size)
+    digest = file_hasher.hasher.hexdigest()
+    if expected_sha256 and expected_sha256.lower() != digest:
+        raise UploadError('文件的 SHA-256 校验失败', 422)
+
+    line_count = _line_count(session)
+
+    ext = os.path.splitext(session.file_name)[1]
+    blob = ContentAddressedStorage.blob_name(upload_directory(), digest, ext)
+    blob_path = document_storage.path(blob)
+    # 与删除最后一条引用时的清理互斥，文档记录提交前 blob 保持钉住（见 storage.BlobReferences）
+    with blob_references.lock(blob):
+        try:
+            # 临时文件只能被移走一次，并发的完成请求只有一个能成功
+            if os.path.exists(blob_path):
+                os.remove(path)
+            else:
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                if document_storage.file_permissions_mode is not None:
+                    os.chmod(path, document_storage.file_permissions_mode)
+                os.replace(path, blob_path)
+        except FileNotFoundError:
+            raise UploadError('上传会话已完成或已失效', 410)
+        blob_references.pin(blob)
+
+    try:
+        with transaction.atomic():
+            UploadSession.objects.filter(pk=session.pk).delete()
+            document = Document(title=session.title, owner=session.owner, original_name=session.file_name,
+                                sha256=digest, line_count=line_count)
+            document.file.name = blob
+            # 元数据写入后才提交事务，后台处理任务启动时即可使用这些字段
+            document.save()
+            document.populate_file_metadata()
+    except BaseException:
+        blob_references.unpin(blob)
+        # 文档记录没有写入，刚移入的 blob 没有其它文档引用时删除，否则会一直留在磁盘上
+        try:
+            remove_unreferenced_blob(document_storage, blob, digest, Document(sha256=digest).artifact_dir)
+        except Exception as e:
+            logger.warning(f"删除未被引用的 blob 失败 {blob}: {e}")
+        raise
+    return document
+
+
+def abort_session(session: UploadSession) -> None:
+    hashers.discard(str(session.pk))
+    session.delete()
+
+
+def expire_sessions(now=None) -> int:
+    """删除过期的上传会话（临时文件在 post_delete 信号中删除），返回删除的会话数"""
+    now = now or timezone.now()
+    expired = list(UploadSession.objects.filter(expires_at__lt=now))
+    for session in expired:
+        hashers.discard(str(session.pk))
+        session.delete()
+    if expired:
+        logger.info(f"清理了 {len(expired)} 个过期的上传会话")
+    return len(expired)
+
+
+def remove_temp_file(session: UploadSession) -> None:
+    try:
+        os.remove(temp_path(session))
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"删除上传临时文件失败: {e}")
@@ -1,12 +1,34 @@
 from django.urls import path
 from django.views.generic.base import RedirectView
 from . import views
+from .textpager import get_viewer_config
+
+# ASGI部署时文档页面和列表使用异步视图
+if get_viewer_config()['ASYNC_VIEWS']:
+    from . import async_views
+    document_list_view = async_views.document_list
+    simple_document_list_view = async_views.simple_document_list
+    document_view = async_views.document_view
+else:
+    document_list_view = views.DocumentListView.as_view()
+    simple_document_list_view = views.SimpleDocumentListView.as_view()
+    document_view = views.document_view
 
 urlpatterns = [
     path('upload/', views.upload_document, name='upload_document'),
-    path('', views.DocumentListView.as_view(), name='document_list'),
-    path('simple/', views.SimpleDocumentListView.as_view(), name='simple_document_list'),
-    path('<int:doc_id>/', views.document_view, name='document_view'),
+    # 可续传的分块上传（见 uploads.py）
+    path('uploads/', views.upload_sessions, name='upload_sessions'),
+    path('uploads/<uuid:session_id>/', views.upload_session, name='upload_session'),
+    path('uploads/<uuid:session_id>/chunks/<int:number>/', views.upload_chunk, name='upload_chunk'),
+    path('uploads/<uuid:session_id>/complete/', views.upload_complete, name='upload_complete'),
+    path('', document_list_view, name='document_list'),
+    path('simple/', simple_document_list_view, name='simple_document_list'),
+    path('search/', views.search_documents, name='search_documents'),
+    path('<int:doc_id>/', document_view, name='document_view'),
+    path('<int:doc_id>/text/', views.document_text, name='document_text'),
+    path('<int:doc_id>/file/', views.document_file, name='document_file'),
+    path('<int:doc_id>/image/<int:width>/', views.document_image, name='document_image'),
+    path('<int:doc_id>/sections/<int:number>/', views.document_section, name='document_section'),
     path('delete/<int:doc_id>/', views.delete_document, name='delete_document'),
     
     # 重定向错误的URL格式
@@ -1,179 +1,450 @@
 from django.shortcuts import render, redirect, get_object_or_404
+from django.template.loader import render_to_string
+from django.http import FileResponse, HttpResponse, JsonResponse
 from django.contrib.auth.decorators import login_required
 from django.views.generic import ListView
 from django.contrib.auth.mixins import LoginRequiredMixin
-from .models import Document
+from django.db import transaction
+from django.urls import reverse
+from django.core.exceptions import ValidationError
+from django.views.decorators.http import require_GET, require_POST, require_http_methods
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from django.template.defaultfilters import filesizeformat
+from .models import Document, UploadSession, FILE_TYPE_CHOICES
+from .conditional import (document_file_etag, document_last_modified, document_section_etag, document_view_etag,
+                          not_modified_response, set_validators)
 from .forms import DocumentForm
+from .pagination import KeysetPaginationMixin
+from .pipeline import read_preview_artifact, ensure_started
+from .previews import render_text_preview
+from . import search, uploads
+from .upload_handlers import ValidatingUploadHandler, largest_request_size
+from .uploads import largest_upload_size
+from .textpager import should_page, should_section, read_page
 from markdown_renderer.utils import render_markdown
+from markdown_renderer.utils.images import (build_srcset, derivative_etag, derivative_widths, get_derivative,
+                                            get_images_config)
+from markdown_renderer.utils.metrics import server_timing, timing
+from markdown_renderer.utils.sections import render_section
+import json
+import logging
 import os
+import re
 import django.http
 
+logger = logging.getLogger('markdown_renderer')
+
+@csrf_exempt
 @login_required
 def upload_document(request):
+    """上传表单；文件在接收过程中验证（见 upload_handlers.py），不合格的上传不必等整个请求体到达"""
+    if request.method == 'POST':
+        # 必须在读取 request.POST 之前替换上传处理器，CSRF 检查因此放到 _upload_document 中进行
+        request.upload_handlers = [ValidatingUploadHandler(request)]
+    return _upload_document(request)
+
+@csrf_protect
+def _upload_document(request):
+    rejection = None
     if request.method == 'POST':
-        form = DocumentForm(request.POST, request.FILES)
-        if form.is_valid():
+        content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+        if content_length > largest_request_size():
+            # 不读取请求体，直接拒绝
+            rejection = uploads.UploadError(f'文件过大，最大允许 {filesizeformat(largest_upload_size())}', 413)
+            form = DocumentForm()
+        else:
+            form = DocumentForm(request.POST, request.FILES)
+            rejection = getattr(request, 'upload_rejection', None)
+        if rejection:
+            # 只显示拒绝原因，不显示文件字段为空的错误
+            form.is_valid()
+            form.errors['file'] = form.error_class([str(rejection)])
+        elif form.is_valid():
             document = form.save(commit=False)
             document.owner = request.user
-            document.save()
+            # 上传处理器边接收边统计的行数和按文件头判断的MIME类型；哈希用于存储文件名（见 storage.py）
+            uploaded_file = request.FILES['file']
+            document.line_count = getattr(uploaded_file, 'line_count', None)
+            document.mime_type = getattr(uploaded_file, 'mime_type', None) or ''
+            # 元数据写入后才提交事务，后台处理任务启动时即可使用这些字段
+            with transaction.atomic():
+                document.save()
+                document.populate_file_metadata()
             return redirect('document_list')
     else:
         form = DocumentForm()
     
     return render(request, 'documents/upload.html', {
-        'form': form
-    })
+        'form': form,
+        'chunked_threshold': uploads.get_upload_config()['BROWSER_THRESHOLD'],
+    }, status=rejection.status if rejection else 200)
+
+def upload_error_response(error):
+    return JsonResponse({'error': str(error)}, status=error.status, json_dumps_params={'ensure_ascii': False})
+
+def owned_upload_session(request, session_id):
+    session = get_object_or_404(UploadSession, pk=session_id, owner=request.user)
+    if session.expires_at <= timezone.now():
+        uploads.abort_session(session)
+        raise uploads.UploadError('上传会话已过期', 410)
+    return session
+
+@login_required
+@require_POST
+def upload_sessions(request):
+    """
+    创建分块上传会话
+    
+    请求体为JSON：{"title": ..., "file_name": ..., "size": 字节数}；返回会话状态和每块大小。
+    """
+    try:
+        payload = json.loads(request.body or b'{}')
+        total_size = int(payload.get('size'))
+    except (ValueError, TypeError, AttributeError):
+        return JsonResponse({'error': '请求格式无效'}, status=400, json_dumps_params={'ensure_ascii': False})
+    try:
+        session = uploads.create_session(request.user, payload.get('title'), payload.get('file_name'), total_size)
+    except uploads.UploadError as e:
+        return upload_error_response(e)
+    return JsonResponse(uploads.session_status(session), status=201, json_dumps_params={'ensure_ascii': False})
+
+@login_required
+@require_http_methods(['GET', 'DELETE'])
+def upload_session(request, session_id):
+    """查询已收到的块（GET），或取消上传（DELETE）"""
+    try:
+        session = owned_upload_session(request, session_id)
+    except uploads.UploadError as e:
+        return upload_error_response(e)
+    if request.method == 'DELETE':
+        uploads.abort_session(session)
+        return HttpResponse(status=204)
+    return JsonResponse(uploads.session_status(session), json_dumps_params={'ensure_ascii': False})
 
-class DocumentListView(LoginRequiredMixin, ListView):
+@login_required
+@require_http_methods(['PUT'])
+def upload_chunk(request, session_id, number):
+    """
+    上传第 number 块（从0开始），请求体为该块的原始字节
+    
+    可选的 Content-Range 头校验偏移，X-Content-SHA256 头校验该块内容。
+    """
+    try:
+        session = owned_upload_session(request, session_id)
+        content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+        chunk = uploads.write_chunk(session, number, request, content_length,
+                                    content_range=request.headers.get('Content-Range'),
+                                    expected_sha256=request.headers.get('X-Content-SHA256'))
+    except uploads.UploadError as e:
+        return upload_error_response(e)
+    return JsonResponse({'number': chunk.number, 'size': chunk.size, 'sha256': chunk.sha256})
+
+@login_required
+@require_POST
+def upload_complete(request, session_id):
+    """全部块到齐后生成文档；请求体可以是 {"sha256": ...}，用于校验整个文件"""
+    try:
+        payload = json.loads(request.body or b'{}')
+    except ValueError:
+        payload = {}
+    try:
+        session = owned_upload_session(request, session_id)
+        document = uploads.complete_session(session, payload.get('sha256') if isinstance(payload, dict) else None)
+    except uploads.UploadError as e:
+        return upload_error_response(e)
+    return JsonResponse({
+        'id': document.id,
+        'sha256': document.sha256,
+        'url': reverse('document_view', args=[document.id]),
+    }, status=201)
+
+class OwnedDocumentListMixin(LoginRequiredMixin, KeysetPaginationMixin):
+    """当前用户的文档列表，可通过 ?type= 按文件类型筛选（使用数据库字段，不访问文件）"""
     model = Document
-    template_name = 'documents/document_list.html'
     context_object_name = 'documents'
     
     def get_queryset(self):
-        return Document.objects.filter(owner=self.request.user).order_by('-uploaded_at')
+        queryset = Document.objects.filter(owner=self.request.user)
+        file_type = self.request.GET.get('type')
+        if file_type:
+            queryset = queryset.filter(file_type=file_type)
+        return queryset
+    
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['file_types'] = FILE_TYPE_CHOICES
+        context['current_type'] = self.request.GET.get('type', '')
+        return context
 
-class SimpleDocumentListView(LoginRequiredMixin, ListView):
-    model = Document
+class DocumentListView(OwnedDocumentListMixin, ListView):
+    template_name = 'documents/document_list.html'
+    keyset_ordering = ('-uploaded_at', '-id')
+
+class SimpleDocumentListView(OwnedDocumentListMixin, ListView):
     template_name = 'documents/simple_document_list.html'
-    context_object_name = 'documents'
+    keyset_ordering = ('title', 'id')
     
-    def get_queryset(self):
-        return Document.objects.filter(owner=self.request.user).order_by('title')
+def embedded_preview(document, file_type):
+    """图片、PDF等由浏览器直接显示的文件，返回 (HTML, 是否为预览)"""
+    if file_type == 'image':
+        file_url = reverse('document_file', args=[document.id])
+        srcset = build_srcset(document.file.path, file_url,
+                              lambda width: reverse('document_image', args=[document.id, width]),
+                              document.sha256 or None)
+        responsive = f' srcset="{srcset}" sizes="{get_images_config()["SIZES"]}"' if srcset else ''
+        html_content = f"""
+        <div class="image-container text-center">
+            <img src="{file_url}"{responsive} class="img-fluid" alt="{document.title}">
+        </div>
+        """
+        return html_content, True
+    if file_type == 'pdf':
+        file_url = reverse('document_file', args=[document.id])
+        html_content = f"""
+        <div class="pdf-container">
+            <embed src="{file_url}" type="application/pdf" width="100%" height="600px">
+            <p class="mt-2">如果您的浏览器无法预览PDF，请<a href="{file_url}" target="_blank">点击此处</a>下载查看。</p>
+        </div>
+        """
+        return html_content, True
+    return "<div class='alert alert-info'>此文件类型无法在线预览，请下载后查看。</div>", False
+
+def text_document_preview(request, document):
+    """文本和代码文件的预览HTML"""
+    if should_page(document):
+        # 大文件只显示第一页，其余通过分页接口读取
+        return render_to_string('documents/text_page_fragment.html', {
+            'document': document,
+            'page': read_page(document),
+        }, request=request)
+    return render_text_preview(document)
+
+def sectioned_markdown_preview(request, document):
+    """超大Markdown文档先返回目录和第一段，其余各段由浏览器按需请求；不适合分段时返回 None"""
+    try:
+        result = render_section(document.file.path, 0, encoding=document.encoding or None,
+                                asset_owner=document.owner_id)
+    except ValidationError:
+        # 由完整渲染显示验证错误
+        return None
+    if result is None:
+        return None
+    index, first_html = result
+    return render_to_string('documents/markdown_sections.html', {
+        'document': document,
+        'toc_html': index['toc'],
+        'first_html': first_html,
+        'sections': [{'number': number, 'anchors': ' '.join(ids)}
+                     for number, (_, _, ids) in enumerate(index['sections']) if number],
+    }, request=request)
+
+def text_preview_error(error):
+    return f"""
+    <div class='alert alert-warning'>
+        <h4>无法预览文本内容</h4>
+        <p>{str(error)}</p>
+    </div>
+    """
+
+def document_message_response(request, title, html_content, document=None):
+    """带提示信息的文档页面（不存在、无权限、文件丢失等）"""
+    return render(request, 'documents/document_view.html', {
+        'document': document if document is not None else {'title': title},
+        'html_content': html_content,
+        'is_markdown': False,
+    })
+
+def document_error_response(request, error):
+    import traceback
+    error_message = f"""
+    <div class='alert alert-danger'>
+        <h4>查看文档时发生错误</h4>
+        <p>{str(error)}</p>
+        <pre>{traceback.format_exc()}</pre>
+    </div>
+    """
+    document = type('obj', (object,), {
+        'title': '文档加载错误',
+        'file': None,
+        'uploaded_at': None
+    })
+    return document_message_response(request, '文档加载错误', error_message, document)
     
 @login_required
+@server_timing('document_view')
 def document_view(request, doc_id):
     try:
         try:
             document = get_object_or_404(Document, id=doc_id)
             
             if document.owner != request.user:
-                return render(request, 'documents/document_view.html', {
-                    'document': {'title': '访问被拒绝'},
-                    'html_content': "<div class='alert alert-danger'>您没有权限查看此文档。</div>",
-                    'is_markdown': False,
-                })
+                return document_message_response(
+                    request, '访问被拒绝', "<div class='alert alert-danger'>您没有权限查看此文档。</div>")
             
-            if not os.path.exists(document.file.path):
-                html_content = "<div class='alert alert-danger'>文件不存在或已被删除。</div>"
-                return render(request, 'documents/document_view.html', {
-                    'document': document,
-                    'html_content': html_content,
-                    'is_markdown': False,
-                })
+            # 内容、配置和模板都没有变化时，不读取文件也不渲染
+            etag = document_view_etag(document, request.user)
+            last_modified = document_last_modified(document)
+            not_modified = not_modified_response(request, etag, last_modified)
+            if not_modified is not None:
+                return not_modified
+            
+            if document.file_size is None:
+                # 旧记录还没有元数据时补齐一次，之后不再访问文件系统
+                document.populate_file_metadata()
             
             file_type = document.get_file_type()
             file_path = document.file.path
             
-            if file_type == 'markdown':
-                html_content = render_markdown(file_path)
+            # 超大Markdown文档分段加载；否则后台流水线已生成预览时直接使用
+            sectioned = sectioned_markdown_preview(request, document) if should_section(document) else None
+            prepared = None
+            if sectioned is None:
+                with timing('artifact'):
+                    prepared = read_preview_artifact(document)
+            if document.status == Document.STATUS_PENDING:
+                # 进程重启后首次访问时恢复未完成的处理任务
+                ensure_started()
+            
+            if sectioned is not None:
+                html_content = sectioned
+                is_preview = True
+            elif prepared is not None:
+                html_content = prepared
+                is_preview = True
+            elif file_type == 'markdown':
+                html_content = render_markdown(file_path, encoding=document.encoding or None,
+                                               asset_owner=document.owner_id)
                 is_preview = True
             elif file_type == 'text' or file_type == 'code':
                 try:
-                    encodings = ['utf-8', 'gbk', 'gb2312', 'latin-1']
-                    content = None
-                    
-                    for encoding in encodings:
-                        try:
-                            with open(file_path, 'r', encoding=encoding) as f:
-                                content = f.read()
-                            if '\ufffd' not in content[:100]:
-                                break
-                        except UnicodeDecodeError:
-                            continue
-                    
-                    if content is None or '\ufffd' in content[:100]:
-                        import chardet
-                        with open(file_path, 'rb') as f:
-                            raw_content = f.read()
-                            detected = chardet.detect(raw_content)
-                            encoding = detected['encoding'] or 'utf-8'
-                            content = raw_content.decode(encoding)
-                    
-                    from django.utils.html import escape
-                    content = escape(content)
-                    
-                    if file_type == 'code':
-                        import pygments
-                        from pygments.lexers import get_lexer_for_filename
-                        from pygments.formatters import HtmlFormatter
-                        
-                        try:
-                            lexer = get_lexer_for_filename(file_path)
-                            formatter = HtmlFormatter(linenos=True, cssclass="highlight")
-                            highlighted = pygments.highlight(content, lexer, formatter)
-                            html_content = f"""
-                            <div class="code-container">
-                                <style>{HtmlFormatter().get_style_defs('.highlight')}</style>
-                                {highlighted}
-                            </div>
-                            """
-                        except Exception:
-                            html_content = f'<pre class="text-content">{content}</pre>'
-                    else:
-                        html_content = f'<pre class="text-content">{content}</pre>'
-                    
+                    with timing('highlight'):
+                        html_content = text_document_preview(request, document)
                     is_preview = True
                 except Exception as e:
-                    html_content = f"""
-                    <div class='alert alert-warning'>
-                        <h4>无法预览文本内容</h4>
-                        <p>{str(e)}</p>
-                    </div>
-                    """
+                    html_content = text_preview_error(e)
                     is_preview = False
-            elif file_type == 'image':
-                file_url = document.file.url
-                html_content = f"""
-                <div class="image-container text-center">
-                    <img src="{file_url}" class="img-fluid" alt="{document.title}">
-                </div>
-                """
-                is_preview = True
-            elif file_type == 'pdf':
-                file_url = document.file.url
-                html_content = f"""
-                <div class="pdf-container">
-                    <embed src="{file_url}" type="application/pdf" width="100%" height="600px">
-                    <p class="mt-2">如果您的浏览器无法预览PDF，请<a href="{file_url}" target="_blank">点击此处</a>下载查看。</p>
-                </div>
-                """
-                is_preview = True
             else:
-                html_content = "<div class='alert alert-info'>此文件类型无法在线预览，请下载后查看。</div>"
-                is_preview = False
+                html_content, is_preview = embedded_preview(document, file_type)
             
-            return render(request, 'documents/document_view.html', {
-                'document': document,
-                'html_content': html_content,
-                'is_markdown': is_preview,
-                'file_type': file_type,
-            })
+            with timing('template'):
+                response = render(request, 'documents/document_view.html', {
+                    'document': document,
+                    'html_content': html_content,
+                    'is_markdown': is_preview,
+                    'file_type': file_type,
+                })
+            return set_validators(response, etag, last_modified)
+        except FileNotFoundError:
+            return document_message_response(
+                request, document.title, "<div class='alert alert-danger'>文件不存在或已被删除。</div>", document)
         except (Document.DoesNotExist, django.http.Http404):
-            return render(request, 'documents/document_view.html', {
-                'document': {'title': '文档不存在'},
-                'html_content': f"<div class='alert alert-danger'>ID为{doc_id}的文档不存在。</div>",
-                'is_markdown': False,
-            })
+            return document_message_response(
+                request, '文档不存在', f"<div class='alert alert-danger'>ID为{doc_id}的文档不存在。</div>")
     except Exception as e:
-        import traceback
-        error_message = f"""
-        <div class='alert alert-danger'>
-            <h4>查看文档时发生错误</h4>
-            <p>{str(e)}</p>
-            <pre>{traceback.format_exc()}</pre>
-        </div>
-        """
-        document = type('obj', (object,), {
-            'title': '文档加载错误',
-            'file': None,
-            'uploaded_at': None
-        })
-            
-        return render(request, 'documents/document_view.html', {
-            'document': document,
-            'html_content': error_message,
-            'is_markdown': False,
-        })
+        return document_error_response(request, e)
+    
+@login_required
+def document_text(request, doc_id):
+    """
+    分页读取文本文件
+    
+    参数 page（从1开始）或 line（跳转到包含该行的页）；format=json 时返回JSON。
+    """
+    document = get_object_or_404(Document, id=doc_id, owner=request.user)
+    
+    def int_param(name):
+        try:
+            return int(request.GET[name])
+        except (KeyError, ValueError):
+            return None
+    
+    page = read_page(document, page=int_param('page'), line=int_param('line'))
+    
+    if request.GET.get('format') == 'json':
+        return JsonResponse(page.as_dict(), json_dumps_params={'ensure_ascii': False})
+    
+    return render(request, 'documents/text_page.html', {
+        'document': document,
+        'page': page,
+    })
+    
+@login_required
+@require_GET
+@server_timing('document_section')
+def document_section(request, doc_id, number):
+    """分段加载的Markdown文档中的一段（HTML片段）"""
+    document = get_object_or_404(Document, id=doc_id, owner=request.user)
+    etag = document_section_etag(document, number)
+    last_modified = document_last_modified(document)
+    not_modified = not_modified_response(request, etag, last_modified)
+    if not_modified is not None:
+        return not_modified
+    
+    try:
+        result = render_section(document.file.path, number, encoding=document.encoding or None,
+                                asset_owner=document.owner_id)
+    except (FileNotFoundError, ValidationError):
+        raise django.http.Http404("文件不存在或已被删除")
+    if result is None:
+        raise django.http.Http404("章节不存在")
+    return set_validators(HttpResponse(result[1]), etag, last_modified)
+    
+@login_required
+@require_GET
+def document_file(request, doc_id):
+    """
+    返回文档的原文件；download=1 时作为附件下载
+
+    文件上传后内容不再变化，浏览器带着 ETag 或 Last-Modified 重新请求时直接返回 304。
+    """
+    document = get_object_or_404(Document, id=doc_id, owner=request.user)
+    etag = document_file_etag(document)
+    not_modified = not_modified_response(request, etag, document.uploaded_at)
+    if not_modified is not None:
+        return not_modified
+    
+    try:
+        file = document.file.open('rb')
+    except FileNotFoundError:
+        raise django.http.Http404("文件不存在或已被删除")
+    response = FileResponse(file, as_attachment=request.GET.get('download') == '1',
+                            filename=document.get_download_name(),
+                            content_type=document.mime_type or None)
+    return set_validators(response, etag, document.uploaded_at)
+    
+@login_required
+@require_GET
+def document_image(request, doc_id, width):
+    """图片文档的缩略图（见 markdown_renderer.utils.images）；没有该宽度的缩略图时返回原文件"""
+    document = get_object_or_404(Document, id=doc_id, owner=request.user)
+    try:
+        if width not in derivative_widths(document.file.path, document.sha256 or None):
+            return redirect('document_file', doc_id=document.id)
+    except FileNotFoundError:
+        raise django.http.Http404("文件不存在或已被删除")
+
+    # 先按校验值判断是否返回 304，之后才生成（可能需要缩放的）缩略图
+    etag = derivative_etag(document.sha256, width) if document.sha256 else None
+    not_modified = not_modified_response(request, etag, document.uploaded_at)
+    if not_modified is not None:
+        return not_modified
+    derivative = get_derivative(document.file.path, width, document.sha256 or None)
+    if derivative is None:
+        return redirect('document_file', doc_id=document.id)
+    response = FileResponse(open(derivative[0], 'rb'), content_type=derivative[1])
+    return set_validators(response, etag, document.uploaded_at)
+    
+@login_required
+def search_documents(request):
+    """全文搜索当前用户的文档，按相关度排序并高亮命中片段"""
+    query = request.GET.get('q', '').strip()
+    hits = search.search(request.user, query) if query else []
+    return render(request, 'documents/search.html', {
+        'query': query,
+        'hits': hits,
+        'short_query': bool(query) and search.build_match_query(query) is None,
+    })
     
 @login_required
 def delete_document(request, doc_id):
@@ -202,6 +473,25 @@ def delete_document(request, doc_id):
             'error_message': error_message,
         })
     
+def log_markdown_references(file_path, md_dir):
+    """记录Markdown文件中的图片和链接引用及图片是否存在（调试用）"""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        raw_content = f.read()
+    logger.debug("Markdown文件内容长度: %d 字节，前100字符: %r", len(raw_content), raw_content[:100])
+    
+    for i, (alt, src) in enumerate(re.findall(r'!\[(.*?)\]\s*\((.*?)\)', raw_content), 1):
+        img_path = src.strip()
+        if os.path.isabs(img_path):
+            candidates = [img_path]
+        else:
+            relative = img_path[2:] if img_path.startswith('./') else img_path
+            candidates = [os.path.join(os.path.dirname(file_path), relative), os.path.join(md_dir, relative)]
+        found = next((path for path in candidates if os.path.exists(path)), None)
+        logger.debug("图片 %d: alt=%r, src=%r, %s", i, alt, img_path, f"存在于 {found}" if found else "文件不存在")
+    
+    for i, (text, url) in enumerate(re.findall(r'(?<!!)\[(.*?)\]\s*\((.*?)\)', raw_content), 1):
+        logger.debug("超链接 %d: text=%r, url=%r", i, text, url.strip())
+    
 @login_required
 def external_markdown_view(request, file_name=None):
     if not file_name:
@@ -209,21 +499,9 @@ def external_markdown_view(request, file_name=None):
     
     file_path = os.path.join(r'E:\GitHub\markdown', file_name)
     
-    print(f"渲染外部Markdown文件: {file_path}")
-    print(f"文件是否存在: {os.path.exists(file_path)}")
-    
     md_dir = r'E:\GitHub\markdown'
     images_dir = os.path.join(md_dir, 'images')
-    print(f"Markdown目录是否存在: {os.path.exists(md_dir)}")
-    print(f"images目录是否存在: {os.path.exists(images_dir)}")
-    
-    if os.path.exists(images_dir):
-        try:
-            import glob
-            image_files = glob.glob(os.path.join(images_dir, '*.*'))
-            print(f"images目录中的文件: {image_files}")
-        except Exception as e:
-            print(f"列出images目录内容时出错: {str(e)}")
+    logger.debug("渲染外部Markdown文件: %s", file_path)
     
     if not os.path.exists(file_path):
         html_content = f"<div class='alert alert-danger'>文件 {file_name} 不存在或不可访问。</div>"
@@ -234,58 +512,16 @@ def external_markdown_view(request, file_name=None):
         })
     
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            raw_content = f.read()
-            print(f"Markdown文件内容长度: {len(raw_content)} 字节")
-            print(f"Markdown文件前100字符: {raw_content[:100].replace('\n', '\\n')}")
-            
-            if '![' in raw_content:
-                print(f"文件包含图片引用，总数: {raw_content.count('![')}")
-                import re
-                img_matches = re.findall(r'!\[(.*?)\]\s*\((.*?)\)', raw_content)
-                for i, (alt, src) in enumerate(img_matches, 1):
-                    print(f"图片 {i}: alt='{alt}', src='{src.strip()}'")
-                    
-                    img_path = src.strip()
-                    if img_path.startswith('./'):
-                        rel_path = os.path.join(os.path.dirname(file_path), img_path[2:])
-                        if os.path.exists(rel_path):
-                            print(f"  - 图片文件存在于相对路径: {rel_path}")
-                        else:
-                            alt_path = os.path.join(md_dir, img_path[2:])
-                            if os.path.exists(alt_path):
-                                print(f"  - 图片文件存在于替代路径: {alt_path}")
-                            else:
-                                print(f"  - 图片文件不存在!")
-                    elif os.path.isabs(img_path):
-                        if os.path.exists(img_path):
-                            print(f"  - 图片文件存在于绝对路径: {img_path}")
-                        else:
-                            print(f"  - 图片文件不存在!")
-                    else:
-                        rel_path = os.path.join(os.path.dirname(file_path), img_path)
-                        if os.path.exists(rel_path):
-                            print(f"  - 图片文件存在于相对路径: {rel_path}")
-                        else:
-                            alt_path = os.path.join(md_dir, img_path)
-                            if os.path.exists(alt_path):
-                                print(f"  - 图片文件存在于替代路径: {alt_path}")
-                            else:
-                                print(f"  - 图片文件不存在!")
-            
-            link_matches = re.findall(r'\[(.*?)\]\s*\((.*?)\)', raw_content)
-            if link_matches:
-                print(f"文件包含超链接，总数: {len(link_matches)}")
-                for i, (text, url) in enumerate(link_matches, 1):
-                    if not text.startswith('!'):
-                        print(f"超链接 {i}: text='{text}', url='{url.strip()}'")
+        # 诊断信息需要额外扫描文件内容，只在开启DEBUG日志时收集
+        if logger.isEnabledFor(logging.DEBUG):
+            log_markdown_references(file_path, md_dir)
         
         from markdown_renderer.utils import render_markdown
         html_content = render_markdown(file_path)
         
         img_count = html_content.count('<img')
         a_count = html_content.count('<a href')
-        print(f"渲染后HTML包含 {img_count} 个img标签, {a_count} 个a标签")
+        logger.debug("渲染后HTML包含 %d 个img标签, %d 个a标签", img_count, a_count)
         
         return render(request, 'documents/document_view.html', {
             'document': {'title': f'外部文件: {file_name}'},
@@ -302,8 +538,7 @@ def external_markdown_view(request, file_name=None):
         })
     except Exception as e:
         import traceback
-        print(f"渲染错误: {str(e)}")
-        print(traceback.format_exc())
+        logger.exception("渲染外部Markdown文件失败: %s", file_path)
         html_content = f"""
         <div class='alert alert-danger'>
             <h4>渲染错误</h4>
@@ -0,0 +1,254 @@
+"""
+Markdown渲染器基准测试
+
+供 manage.py benchmark_renderer 调用，每个基准函数返回若干计时结果。
+"""
+import copy
+import itertools
+import logging
+import os
+import random
+import re
+import statistics
+import time
+from typing import Callable, Dict, Any, List, Optional
+
+from django.conf import settings
+
+from .corpus import build_corpus, make_code, make_deep_toc, make_math, make_prose, make_tables
+from .utils.encoding import read_text
+from .utils.renderer import MarkdownRenderer
+from .utils.pool import MarkdownEnginePool
+from .utils.sanitizer import FileValidator
+from .utils.extensions import TableStyleTreeprocessor
+from .utils.blocks import render_blocks
+
+
+SHORT_DOCUMENT = """# 标题
+
+一段简短的说明文字，包含 **粗体**、*斜体* 和 `行内代码`。
+
+- 列表项一
+- 列表项二
+
+```python
+print("hello")
+```
+
+行内公式 $E = mc^2$。
+"""
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """毫秒样本的统计"""
+    samples = sorted(samples)
+    return {
+        'iterations': len(samples),
+        'mean_ms': statistics.fmean(samples),
+        'p50_ms': samples[len(samples) // 2],
+        'p95_ms': samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        'min_ms': samples[0],
+    }
+
+
+def measure(func: Callable[[], Any], iterations: int) -> Dict[str, float]:
+    """运行 func 若干次，返回毫秒级统计"""
+    func()  # 预热
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return summarize(samples)
+
+
+def bench_engine(iterations: int) -> Dict[str, Dict[str, float]]:
+    """每次新建引擎 vs 引擎池，渲染同一篇短文档"""
+    pool = MarkdownEnginePool()
+    fingerprint = MarkdownRenderer.get_config_fingerprint()
+
+    def fresh():
+        MarkdownRenderer.create_engine().convert(SHORT_DOCUMENT)
+
+    def pooled():
+        with pool.engine(fingerprint, MarkdownRenderer.create_engine) as md:
+            md.convert(SHORT_DOCUMENT)
+
+    return {
+        'setup_only': measure(MarkdownRenderer.create_engine, iterations),
+        'fresh_engine': measure(fresh, iterations),
+        'pooled_engine': measure(pooled, iterations),
+    }
+
+
+def make_table_document(tables: int = 300, rows: int = 10) -> str:
+    """生成包含大量表格的文档"""
+    parts = []
+    for t in range(tables):
+        parts.append(f"## 表格 {t}\n")
+        parts.append("| 名称 | 数值 | 说明 |")
+        parts.append("|------|-----:|------|")
+        for r in range(rows):
+            parts.append(f"| 项目{r} | {t * rows + r} | 第{t}个表格的第{r}行 |")
+        parts.append("")
+    return "\n".join(parts)
+
+
+def legacy_add_table_styles(html_content: str) -> str:
+    """旧版基于正则的表格样式后处理，仅作为基准对照"""
+    html_content = html_content.replace('<table>', '<table class="table table-bordered table-striped">')
+    for table in re.findall(r'<table[^>]*>', html_content):
+        if 'class=' not in table:
+            html_content = html_content.replace(table, table.replace('<table', '<table class="table table-bordered table-striped"'))
+        elif 'table ' not in table and 'table"' not in table:
+            html_content = html_content.replace(table, table.replace('class="', 'class="table table-bordered table-striped '))
+    return re.sub(r'(<table[^>]*>.*?</table>)', r'<div class="table-responsive">\1</div>', html_content, flags=re.DOTALL)
+
+
+def bench_tables(iterations: int) -> Dict[str, Dict[str, float]]:
+    """数百个表格的文档：树处理器样式 vs 旧版正则后处理"""
+    document = make_table_document()
+    md = MarkdownRenderer.create_engine()
+    processor = TableStyleTreeprocessor(md)
+    root = md.parser.parseDocument(document.split('\n')).getroot()
+
+    md.treeprocessors.deregister('table_style')
+    unstyled_html = md.convert(document)
+    md.reset()
+
+    return {
+        'tree_copy_only': measure(lambda: copy.deepcopy(root), iterations),
+        'tree_copy_and_style': measure(lambda: processor.run(copy.deepcopy(root)), iterations),
+        'legacy_regex': measure(lambda: legacy_add_table_styles(unstyled_html), iterations),
+        'full_render': measure(lambda: MarkdownRenderer._convert(document), max(1, iterations // 50)),
+    }
+
+
+def get_corpus_dir() -> str:
+    # 语料必须位于 FileValidator 允许的目录中
+    return os.path.join(settings.BASE_DIR, 'cache', 'markdown_benchmark')
+
+
+def _record_run(processor, samples: List[float]) -> None:
+    """包装树处理器的 run 方法，记录每次耗时"""
+    run = processor.run
+
+    def timed_run(root):
+        start = time.perf_counter()
+        try:
+            return run(root)
+        finally:
+            samples.append((time.perf_counter() - start) * 1000)
+
+    processor.run = timed_run
+
+
+def _iterations_for(size: int, iterations: int) -> int:
+    # 大文件减少迭代次数，每个文档的总耗时大致相同
+    return max(3, min(iterations, int(iterations * 64 * 1024 / max(size, 1))))
+
+
+def bench_corpus(iterations: int, corpus_dir: Optional[str] = None) -> Dict[str, Dict[str, float]]:
+    """
+    代表性语料上各阶段的耗时
+
+    validate: FileValidator.validate_file；decode: 读取并解码；convert: 完整的 md.convert；
+    image_asset / table_style: convert 中图片和表格树处理器所占的部分（原 _process_image_links / _add_table_styles）。
+    """
+    paths = build_corpus(corpus_dir or get_corpus_dir())
+    results = {}
+    # 语料中故意包含缺失的图片，不输出对应的警告
+    logging.disable(logging.WARNING)
+    try:
+        for name, path in paths.items():
+            results.update(_bench_corpus_document(name, path, iterations))
+    finally:
+        logging.disable(logging.NOTSET)
+    return results
+
+
+def _bench_corpus_document(name: str, path: str, iterations: int) -> Dict[str, Dict[str, float]]:
+    results = {}
+    count = _iterations_for(os.path.getsize(path), iterations)
+    text, _ = read_text(path)
+
+    results[f'{name}.validate'] = measure(lambda: FileValidator.validate_file(path), count)
+    results[f'{name}.decode'] = measure(lambda: read_text(path), count)
+
+    md = MarkdownRenderer.create_engine()
+    stage_samples = {'image_asset': [], 'table_style': []}
+    for stage, samples in stage_samples.items():
+        _record_run(md.treeprocessors[stage], samples)
+    convert_samples = []
+    for i in range(count + 1):
+        md.source_path = path
+        md.image_mode = MarkdownRenderer.get_image_mode()
+        md.asset_owner = None
+        start = time.perf_counter()
+        md.convert(text)
+        elapsed = (time.perf_counter() - start) * 1000
+        md.reset()
+        if i == 0:
+            # 第一次作为预热
+            for samples in stage_samples.values():
+                samples.clear()
+            continue
+        convert_samples.append(elapsed)
+
+    results[f'{name}.convert'] = summarize(convert_samples)
+    for stage, samples in stage_samples.items():
+        results[f'{name}.{stage}'] = summarize(samples)
+    return results
+
+
+def make_large_document(target_bytes: int = 1024 * 1024, seed: int = 7) -> str:
+    """正文、表格、代码、公式和多级标题混合的大文档"""
+    rng = random.Random(seed)
+    parts = [make_deep_toc(rng, 100), make_tables(rng, 100), make_code(rng, 150), make_math(rng, 150)]
+    size = sum(len(part.encode('utf-8')) for part in parts)
+    while size < target_bytes:
+        part = make_prose(rng, 300)
+        parts.append(part)
+        size += len(part.encode('utf-8'))
+    return '\n\n'.join(parts)
+
+
+def bench_incremental(iterations: int) -> Dict[str, Dict[str, float]]:
+    """约1MB的文档每次修改一段后重新渲染：完整转换 vs 按块增量渲染（首次 / 只有一段变化）"""
+    document = make_large_document()
+    paragraphs = document.split('\n\n')
+    editable = [index for index, paragraph in enumerate(paragraphs) if paragraph[:1].isalpha()]
+    counter = itertools.count()
+
+    def edited() -> str:
+        # 每次修改不同的段落，避免命中上一次迭代缓存的结果
+        n = next(counter)
+        parts = list(paragraphs)
+        parts[editable[n * 7919 % len(editable)]] += f' Edited {n}.'
+        return '\n\n'.join(parts)
+
+    md = MarkdownRenderer.create_engine()
+    md.source_path = os.path.join(get_corpus_dir(), 'incremental.md')
+    md.image_mode = MarkdownRenderer.get_image_mode()
+    md.asset_owner = None
+    context = MarkdownRenderer.get_cache_key('blocks', md.source_path)
+
+    def full():
+        md.convert(edited())
+        md.reset()
+
+    count = max(2, iterations // 100)
+    render_blocks(md, document, context)
+    return {
+        'full_convert': measure(full, count),
+        'incremental_cold': measure(lambda: render_blocks(md, document, f'{context}:{next(counter)}'), count),
+        'incremental_edit': measure(lambda: render_blocks(md, edited(), context), iterations),
+    }
+
+
+BENCHMARKS = {
+    'engine': bench_engine,
+    'tables': bench_tables,
+    'corpus': bench_corpus,
+    'incremental': bench_incremental,
+}
@@ -0,0 +1,159 @@
+"""
+基准测试语料
+
+按固定随机种子生成一组有代表性的Markdown文档，写入指定目录，供 benchmark_renderer 使用。
+同一版本的语料内容完全相同，不同时间、不同代码版本的测量结果可以直接比较。
+"""
+import base64
+import os
+import random
+from typing import Dict
+
+# 修改生成逻辑时递增，目录中已有的旧语料会被重新生成
+CORPUS_VERSION = '1'
+
+# 1x1 PNG
+_PNG_PIXEL = base64.b64decode(
+    'iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=='
+)
+
+_WORDS = ('render', 'document', 'cache', 'table', 'image', 'parser', 'engine', 'stream', 'value', 'result',
+          'config', 'server', 'request', 'module', 'layout', 'format', 'header', 'buffer', 'latency', 'index')
+
+_CJK_SENTENCES = (
+    '文档管理系统负责保存和展示用户上传的文件。',
+    'Markdown 渲染结果会被缓存，重复访问时直接返回。',
+    '表格、代码块和数学公式都需要额外的处理步骤。',
+    '大文件按页读取，避免一次性载入全部内容。',
+    '编码检测只在样本上进行，结果保存到数据库中。',
+    '图片通过带签名的地址访问，并设置长期缓存。',
+)
+
+
+def _sentence(rng: random.Random, words: int = 12) -> str:
+    text = ' '.join(rng.choice(_WORDS) for _ in range(words))
+    return text[0].upper() + text[1:] + '.'
+
+
+def make_prose(rng: random.Random, paragraphs: int = 200) -> str:
+    parts = ['# 正文\n']
+    for i in range(paragraphs):
+        if i % 20 == 0:
+            parts.append(f'## 第{i // 20 + 1}节\n')
+        parts.append(' '.join(_sentence(rng) for _ in range(5)) + ' **强调** 和 *斜体* 以及 `code`。\n')
+    return '\n'.join(parts)
+
+
+def make_tables(rng: random.Random, tables: int = 200, rows: int = 12) -> str:
+    parts = []
+    for t in range(tables):
+        parts.append(f'### 表格 {t}\n')
+        parts.append('| 名称 | 数值 | 比例 | 说明 |')
+        parts.append('|------|-----:|:----:|------|')
+        for r in range(rows):
+            parts.append(f'| {rng.choice(_WORDS)}{r} | {rng.randint(0, 99999)} | {rng.random():.2f} | {_sentence(rng, 4)} |')
+        parts.append('')
+    return '\n'.join(parts)
+
+
+def make_code(rng: random.Random, blocks: int = 150) -> str:
+    languages = ('python', 'javascript', 'sql', 'bash', None)
+    samples = {
+        'python': 'def {name}(value):\n    result = [v * 2 for v in range(value)]\n    return sum(result)\n',
+        'javascript': 'function {name}(value) {{\n  return Array.from({{length: value}}, (_, i) => i * 2);\n}}\n',
+        'sql': 'SELECT id, title FROM documents WHERE owner_id = 1 AND title LIKE \'%{name}%\';\n',
+        'bash': 'for f in *.md; do\n  echo "{name} $f"\ndone\n',
+        None: 'plain block {name}\n    indented line\nno language tag\n',
+    }
+    parts = ['# 代码\n']
+    for i in range(blocks):
+        lang = languages[i % len(languages)]
+        parts.append(f'段落 {i}：{_sentence(rng, 6)}\n')
+        parts.append(f"```{lang or ''}\n{samples[lang].format(name=f'{rng.choice(_WORDS)}_{i}')}```\n")
+    return '\n'.join(parts)
+
+
+def make_math(rng: random.Random, paragraphs: int = 150) -> str:
+    parts = ['# 公式\n']
+    for i in range(paragraphs):
+        a, b = rng.randint(1, 9), rng.randint(1, 9)
+        parts.append(f'行内公式 $x_{i} = {a}y^{b} + \\frac{{{a}}}{{{b}}}$，以及 $\\sum_{{k=1}}^{{n}} k^{b}$。\n')
+        if i % 3 == 0:
+            parts.append(f'$$\n\\int_0^{{{a}}} e^{{-{b}t}} \\, dt = \\frac{{1 - e^{{-{a * b}}}}}{{{b}}}\n$$\n')
+    return '\n'.join(parts)
+
+
+def make_images(rng: random.Random, images: int = 120) -> str:
+    parts = ['# 图片\n']
+    for i in range(images):
+        # 大部分引用存在的图片，少数引用不存在的图片和外部地址
+        if i % 10 == 9:
+            parts.append(f'![缺失{i}](images/missing_{i}.png)\n')
+        elif i % 10 == 8:
+            parts.append(f'![外部{i}](https://example.com/img_{i}.png)\n')
+        else:
+            parts.append(f'{_sentence(rng, 6)}\n\n![图片{i}](images/img_{i % 20}.png)\n')
+    return '\n'.join(parts)
+
+
+def make_deep_toc(rng: random.Random, sections: int = 60) -> str:
+    parts = ['[TOC]\n', '# 目录测试\n']
+    for i in range(sections):
+        for level in range(2, 7):
+            parts.append(f"{'#' * level} 第{i}节 第{level}级 {rng.choice(_WORDS)}\n")
+            parts.append(_sentence(rng, 8) + '\n')
+    return '\n'.join(parts)
+
+
+def make_cjk(rng: random.Random, target_bytes: int) -> str:
+    parts = ['# 中文长文档\n']
+    size = 0
+    section = 0
+    while size < target_bytes:
+        if section % 50 == 0:
+            parts.append(f'## 第{section // 50 + 1}章\n')
+        paragraph = ''.join(rng.choice(_CJK_SENTENCES) for _ in range(8)) + '\n'
+        parts.append(paragraph)
+        size += len(paragraph.encode('utf-8'))
+        section += 1
+    return '\n'.join(parts)
+
+
+def corpus_documents(seed: int = 42) -> Dict[str, tuple]:
+    """返回 {名称: (文件名, 文本, 编码)}"""
+    rng = random.Random(seed)
+    return {
+        'prose': ('prose.md', make_prose(rng), 'utf-8'),
+        'tables': ('tables.md', make_tables(rng), 'utf-8'),
+        'code': ('code.md', make_code(rng), 'utf-8'),
+        'math': ('math.md', make_math(rng), 'utf-8'),
+        'images': ('images.md', make_images(rng), 'utf-8'),
+        'toc': ('toc.md', make_deep_toc(rng), 'utf-8'),
+        'cjk_large': ('cjk_large.md', make_cjk(rng, 2 * 1024 * 1024), 'utf-8'),
+        'gbk_large': ('gbk_large.md', make_cjk(rng, 1024 * 1024), 'gbk'),
+    }
+
+
+def build_corpus(directory: str, seed: int = 42) -> Dict[str, str]:
+    """在 directory 中生成语料（已是当前版本时直接复用），返回 {名称: 文件路径}"""
+    documents = corpus_documents(seed)
+    paths = {name: os.path.join(directory, file_name) for name, (file_name, _, _) in documents.items()}
+
+    marker = os.path.join(directory, '.version')
+    try:
+        with open(marker, 'r', encoding='utf-8') as f:
+            if f.read().strip() == f'{CORPUS_VERSION}:{seed}' and all(os.path.exists(p) for p in paths.values()):
+                return paths
+    except OSError:
+        pass
+
+    os.makedirs(os.path.join(directory, 'images'), exist_ok=True)
+    for i in range(20):
+        with open(os.path.join(directory, 'images', f'img_{i}.png'), 'wb') as f:
+            f.write(_PNG_PIXEL)
+    for name, (file_name, text, encoding) in documents.items():
+        with open(paths[name], 'wb') as f:
+            f.write(text.encode(encoding))
+    with open(marker, 'w', encoding='utf-8') as f:
+        f.write(f'{CORPUS_VERSION}:{seed}')
+    return paths
@@ -0,0 +1,68 @@
+import json
+import platform
+
+import markdown
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from markdown_renderer.benchmarks import BENCHMARKS
+from markdown_renderer.utils import MarkdownRenderer
+
+
+class Command(BaseCommand):
+    help = '运行Markdown渲染器基准测试'
+
+    def add_arguments(self, parser):
+        parser.add_argument('benchmarks', nargs='*', help=f"要运行的基准，可选: {', '.join(BENCHMARKS)}（默认全部）")
+        parser.add_argument('--iterations', type=int, default=200, help='每项计时的迭代次数')
+        parser.add_argument('--corpus-dir', help='corpus 基准的语料目录（默认 BASE_DIR/cache/markdown_benchmark）')
+        parser.add_argument('--json', dest='json_path', help='把结果写入JSON文件，便于不同版本之间比较')
+        parser.add_argument('--compare', help='与之前保存的JSON结果比较平均耗时')
+
+    def handle(self, *args, **options):
+        names = options['benchmarks'] or list(BENCHMARKS)
+        unknown = [name for name in names if name not in BENCHMARKS]
+        if unknown:
+            raise CommandError(f"未知的基准: {', '.join(unknown)}")
+
+        baseline = {}
+        if options['compare']:
+            try:
+                with open(options['compare'], 'r', encoding='utf-8') as f:
+                    baseline = json.load(f).get('results', {})
+            except (OSError, ValueError) as e:
+                raise CommandError(f"无法读取比较基准: {e}")
+
+        all_results = {}
+        for name in names:
+            self.stdout.write(self.style.MIGRATE_HEADING(f'[{name}]'))
+            kwargs = {'corpus_dir': options['corpus_dir']} if name == 'corpus' and options['corpus_dir'] else {}
+            results = BENCHMARKS[name](options['iterations'], **kwargs)
+            all_results[name] = results
+            for label, stats in results.items():
+                line = (
+                    f"  {label:<24} mean {stats['mean_ms']:9.3f} ms  "
+                    f"p50 {stats['p50_ms']:9.3f} ms  p95 {stats['p95_ms']:9.3f} ms  "
+                    f"min {stats['min_ms']:9.3f} ms"
+                )
+                previous = baseline.get(name, {}).get(label)
+                if previous and previous.get('mean_ms'):
+                    change = (stats['mean_ms'] - previous['mean_ms']) / previous['mean_ms'] * 100
+                    line += f"  {change:+7.1f}%"
+                self.stdout.write(line)
+
+        if options['json_path']:
+            report = {
+                'meta': {
+                    'created_at': timezone.now().isoformat(),
+                    'python': platform.python_version(),
+                    'platform': platform.platform(),
+                    'markdown': markdown.__version__,
+                    'config_fingerprint': MarkdownRenderer.get_config_fingerprint(),
+                    'iterations': options['iterations'],
+                },
+                'results': all_results,
+            }
+            with open(options['json_path'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"结果已写入 {options['json_path']}"))
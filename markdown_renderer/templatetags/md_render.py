@@ -80,4 +80,30 @@ def markdown_filter(value: str) -> SafeString:
         SafeString: 渲染后的HTML内容
     """
     from markdown_renderer.utils.renderer import MarkdownRenderer
-    return MarkdownRenderer.render_markdown_content(value) 
\ No newline at end of file
+    return MarkdownRenderer.render_markdown_content(value)
+
+
+@register.simple_tag
+def pygments_css_url() -> str:
+    """
+    代码高亮样式表的地址（带内容哈希，可长期缓存）
+    
+    用法:
+    {% load md_render %}
+    <link rel="stylesheet" href="{% pygments_css_url %}">
+    """
+    from markdown_renderer.utils.highlight import get_pygments_stylesheet_url
+    return get_pygments_stylesheet_url() 
+
+@register.filter(name='needs_client_math')
+def needs_client_math_filter(value) -> bool:
+    """
+    渲染结果是否还需要浏览器端的公式渲染脚本（KaTeX）
+    
+    公式已在服务端转换为 MathML 时返回 False，页面可以不加载 KaTeX。
+    
+    用法:
+    {% if html_content|needs_client_math %}...{% endif %}
+    """
+    from markdown_renderer.utils.mathml import needs_client_math
+    return needs_client_math(str(value))
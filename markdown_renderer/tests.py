@@ -0,0 +1,114 @@
+import os
+import re
+import tempfile
+import threading
+import time
+from unittest import mock, skipIf
+
+from django.conf import settings
+from django.test import SimpleTestCase, override_settings
+
+from .utils import images
+from .utils.extensions import build_asset_url, is_allowed_image_path, unsign_asset_token
+from .utils.mathml import latex_to_mathml, sanitize_mathml
+from .utils.renderer import MarkdownRenderer
+
+
+def _math_settings():
+    config = dict(getattr(settings, 'MARKDOWN_RENDER', {}))
+    config['MATH'] = {'MODE': 'mathml'}
+    return config
+
+
+@skipIf(latex_to_mathml is None, '未安装 latex2mathml')
+@override_settings(MARKDOWN_RENDER=_math_settings())
+class MathMLSanitizeTests(SimpleTestCase):
+    """服务端 MathML 输出不能带入原始HTML"""
+
+    def test_text_with_html_is_not_emitted(self):
+        html = MarkdownRenderer.render_markdown_content('x $\\text{<img/src/onerror=alert(1)>}$ y')
+        # 无法安全转换时保留 mdx_math 的输出，TeX源码在 <script type="math/tex"> 中不会被解析为HTML
+        self.assertNotIn('<math', html)
+        outside_scripts = re.sub(r'<script type="math/tex">.*?</script>', '', html, flags=re.S)
+        self.assertNotIn('<img', outside_scripts)
+
+    def test_well_formed_html_in_text_is_rejected(self):
+        self.assertIsNone(sanitize_mathml(latex_to_mathml('\\text{<img src="x"/>}')))
+
+    def test_href_is_dropped(self):
+        mathml = sanitize_mathml(latex_to_mathml('\\href{javascript:alert(1)}{x}'))
+        self.assertIsNotNone(mathml)
+        self.assertNotIn('javascript', mathml)
+
+    def test_ordinary_formula_is_converted(self):
+        html = MarkdownRenderer.render_markdown_content('x $a<b$ y')
+        self.assertIn('<math', html)
+        self.assertIn('<mo>&lt;</mo>', html)
+
+
+@override_settings(MARKDOWN_RENDER={})
+class AssetPathTests(SimpleTestCase):
+    """文档只能引用自身目录中的图片，图片地址签入所有者"""
+
+    def test_paths_outside_document_dir_are_rejected(self):
+        with tempfile.TemporaryDirectory() as root:
+            doc_dir = os.path.join(root, 'docs')
+            source = os.path.join(doc_dir, 'a.md')
+            self.assertTrue(is_allowed_image_path(os.path.join(doc_dir, 'images', 'p.png'), source))
+            self.assertFalse(is_allowed_image_path(os.path.join(doc_dir, '..', 'secret.png'), source))
+            self.assertFalse(is_allowed_image_path(os.path.join(root, 'docs-other', 'p.png'), source))
+            self.assertFalse(is_allowed_image_path('/etc/passwd', source))
+
+    def test_token_carries_owner(self):
+        with tempfile.NamedTemporaryFile(suffix='.png') as image:
+            token = build_asset_url(image.name, owner=7).split('/')[-2]
+            self.assertEqual(unsign_asset_token(token), (image.name, 7))
+
+
+class DerivativeLockTests(SimpleTestCase):
+    """同一缩略图的并发请求只生成一次；第一次生成失败时，等待中的和新到达的请求也不会同时生成"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.target = os.path.join(directory.name, 'thumb.jpg')
+        for name, value in (('derivative_widths', [320]), ('derivative_format', 'jpeg'),
+                            ('derivative_path', self.target)):
+            patcher = mock.patch.object(images, name, return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.calls = []
+        self.release = threading.Event()
+
+    def fake_resize(self, img_path, width, target, fmt):
+        self.calls.append(threading.current_thread().name)
+        if len(self.calls) == 1:
+            time.sleep(0.05)
+            raise OSError('暂时失败')
+        self.release.wait(5)
+        with open(target, 'wb') as f:
+            f.write(b'jpeg')
+
+    def start(self, count):
+        threads = [threading.Thread(target=images.get_derivative, args=('photo.jpg', 320, 'ab' * 32))
+                   for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def test_resize_runs_once_after_failure(self):
+        with mock.patch.object(images, '_resize', side_effect=self.fake_resize) as resize:
+            threads = self.start(4)
+            deadline = time.monotonic() + 5
+            while len(self.calls) < 2 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            # 第二次生成进行中时到达的请求
+            threads += self.start(4)
+            time.sleep(0.2)
+            self.release.set()
+            for thread in threads:
+                thread.join(5)
+        # 第一次失败，之后只生成一次
+        self.assertEqual(resize.call_count, 2)
+        self.assertTrue(os.path.exists(self.target))
+        self.assertEqual(images._locks, {})
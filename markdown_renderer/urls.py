@@ -0,0 +1,9 @@
+from django.urls import path
+from . import views
+
+urlpatterns = [
+    path('asset/<str:token>/<str:name>', views.asset_view, name='markdown_asset'),
+    path('asset/<str:token>/w<int:width>/<str:name>', views.asset_view, name='markdown_asset_width'),
+    path('pygments.<str:digest>.css', views.pygments_css_view, name='markdown_pygments_css'),
+    path('metrics', views.metrics_view, name='markdown_metrics'),
+]
@@ -1,4 +1,7 @@
-from .renderer import render_markdown, MarkdownRenderer
+from .renderer import render_markdown, render_markdown_async, MarkdownRenderer
 from .sanitizer import FileValidator
+from .cache import render_cache
+from .concurrency import render_limiter
+from .encoding import read_text, decode_bytes
 
-__all__ = ['render_markdown', 'MarkdownRenderer', 'FileValidator'] 
\ No newline at end of file
+__all__ = ['render_markdown', 'render_markdown_async', 'MarkdownRenderer', 'FileValidator', 'render_cache', 'render_limiter', 'read_text', 'decode_bytes'] 
\ No newline at end of file
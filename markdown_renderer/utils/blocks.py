@@ -0,0 +1,370 @@
+"""
+按块增量渲染
+
+把文档拆成顶层块（围栏代码和 $$...$$ / \\begin...\\end 公式块不会被空行拆开，列表、引用和缩进的续行并入前一块），
+按块内容哈希缓存每块的HTML。重新上传稍作修改的大文档时，只有变化的块需要转换；
+未命中的块合并在一次 convert 中完成，块之间用分隔段落隔开，再按分隔段落拆回各块的输出。
+
+依赖全文的处理在拼接后统一完成：
+- 转换时标题 id 先用占位符，同时记录 toc 扩展计算出的 slug；拼接后按文档顺序去重，得到与完整转换相同的 id；
+- [TOC] 标记替换为由全部标题生成的目录；
+- 引用式链接的定义附加在每次 convert 之后，使用引用的块的缓存键包含全部定义的哈希。
+
+含图片的块不缓存（图片地址包含图片文件的哈希）。无法按块正确处理的文档
+（行首的原始HTML、未知扩展、带锚点链接的目录等）由调用方完整转换。
+"""
+import hashlib
+import json
+import re
+import zlib
+from typing import Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from markdown.extensions.toc import nest_toc_tokens, unique
+
+from .cache import TieredCache
+
+DEFAULT_INCREMENTAL_CONFIG = {
+    'ENABLED': True,
+    'MIN_LENGTH': 64 * 1024,  # 字符数；更短的文档完整转换更快
+}
+
+# 这些扩展的输出只取决于块本身（toc 由拼接后的处理负责）
+SAFE_EXTENSIONS = frozenset([
+    'tables', 'fenced_code', 'codehilite', 'toc', 'nl2br', 'sane_lists', 'smarty', 'meta', 'mdx_math',
+    'markdown.extensions.tables', 'markdown.extensions.fenced_code', 'markdown.extensions.codehilite',
+    'markdown.extensions.toc', 'markdown.extensions.nl2br', 'markdown.extensions.sane_lists',
+    'markdown.extensions.smarty', 'markdown.extensions.meta',
+])
+
+# 平均每组的块数：相邻的块按内容决定的边界分组，以组为单位缓存和转换。
+# 分隔段落本身也要经过完整的行内处理，逐块分隔会让首次渲染明显变慢；边界只取决于块的内容，
+# 修改一段只影响它所在的组
+GROUP_BLOCKS = 8
+MAX_GROUP_BLOCKS = 64
+
+# 块之间的分隔段落；用普通文本而不是HTML注释，大量原始HTML块会让 Python-Markdown 的HTML解析变成平方复杂度
+BLOCK_MARKER = 'MDBLOCKSEPARATOR7f3c9a1e'
+_MARKER_SPLIT_RE = re.compile(r'\n?<p>' + BLOCK_MARKER + r'</p>\n?')
+
+_FENCE_RE = re.compile(r'^(`{3,}|~{3,})')
+_LIST_ITEM_RE = re.compile(r'^ {0,3}(?:[*+-]|\d+\.)[ \t]')
+_RAW_HTML_RE = re.compile(r'^ {0,3}<[A-Za-z!/?]')
+_REFERENCE_RE = re.compile(r'^ {0,3}\[[^\[\]^]+\]:')
+_META_RE = re.compile(r'^[ ]{0,3}[A-Za-z0-9_-]+:')
+_MATH_BEGIN_RE = re.compile(r'^\s*\\begin\{([A-Za-z]+\*?)\}')
+HEADING_ID_PREFIX = 'md-block-h'
+_HEADING_ID_RE = re.compile(r'id="' + HEADING_ID_PREFIX + r'(\d+)"')
+
+block_cache = TieredCache('blocks')
+
+
+def get_incremental_config() -> dict:
+    config = getattr(settings, 'MARKDOWN_RENDER', {})
+    incremental_config = DEFAULT_INCREMENTAL_CONFIG.copy()
+    incremental_config.update(config.get('INCREMENTAL', {}))
+    return incremental_config
+
+
+def supports_extensions(extensions: Iterable) -> bool:
+    """只有全部扩展都在 SAFE_EXTENSIONS 中时才能按块渲染"""
+    return all(isinstance(name, str) and name in SAFE_EXTENSIONS for name in extensions)
+
+
+class UnsupportedDocument(Exception):
+    """文档含有无法按块处理的内容"""
+
+
+def _closing_line(lines: List[str], start: int, is_end) -> Optional[int]:
+    for j in range(start, len(lines)):
+        if is_end(lines[j]):
+            return j
+    return None
+
+
+def block_ranges(lines: List[str]) -> List[List[int]]:
+    """
+    顶层块的行范围 [起始行, 结束行(不含)]
+
+    块是原文的连续片段（保留内部的空行），遇到无法按块处理的内容时抛出 UnsupportedDocument。
+    """
+    ranges: List[List[int]] = []
+    start = None
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if not line.strip():
+            if start is not None:
+                ranges.append([start, i])
+                start = None
+            i += 1
+            continue
+        if start is None:
+            start = i
+
+        end = None
+        fence = _FENCE_RE.match(line)
+        if fence:
+            marker = fence.group(1)
+            end = _closing_line(lines, i + 1, lambda l: l.rstrip(' ') == marker)
+        elif line.lstrip().startswith('$$') and line.count('$$') == 1:
+            end = _closing_line(lines, i + 1, lambda l: '$$' in l)
+        else:
+            begin = _MATH_BEGIN_RE.match(line)
+            if begin:
+                closing = '\\end{%s}' % begin.group(1)
+                end = _closing_line(lines, i, lambda l: closing in l)
+            elif _RAW_HTML_RE.match(line):
+                raise UnsupportedDocument()
+        i = (end if end is not None else i) + 1
+    if start is not None:
+        ranges.append([start, len(lines)])
+
+    # 缩进的续行、同一列表的后续项、相邻的引用与前一块属于同一个元素
+    merged: List[List[int]] = []
+    for block in ranges:
+        first = lines[block[0]]
+        if merged:
+            previous_first = lines[merged[-1][0]]
+            if (first[:1] in (' ', '\t')
+                    or (_LIST_ITEM_RE.match(first) and _LIST_ITEM_RE.match(previous_first))
+                    or (first.lstrip().startswith('>') and previous_first.lstrip().startswith('>'))):
+                merged[-1][1] = block[1]
+                continue
+        merged.append(block)
+    return merged
+
+
+def reference_blocks(blocks: List[str]) -> List[str]:
+    """包含引用式链接定义的块"""
+    return [block for block in blocks
+            if not _FENCE_RE.match(block) and any(_REFERENCE_RE.match(l) for l in block.split('\n'))]
+
+
+def split_blocks(text: str) -> Tuple[List[str], List[str]]:
+    """拆分为顶层块，返回 (块列表, 包含引用定义的块)"""
+    lines = text.split('\n')
+    blocks = ['\n'.join(lines[a:b]) for a, b in block_ranges(lines)]
+    return blocks, reference_blocks(blocks)
+
+
+def group_blocks(blocks: List[str], alone: str = '') -> List[str]:
+    """把相邻的块合并成组，内容哈希能被 GROUP_BLOCKS 整除的块之后是组的边界；内容等于 alone 的块单独成组"""
+    groups = []
+    current: List[str] = []
+    for block in blocks:
+        if alone and block.strip() == alone:
+            if current:
+                groups.append('\n\n'.join(current))
+                current = []
+            groups.append(block)
+            continue
+        current.append(block)
+        if zlib.crc32(block.encode('utf-8')) % GROUP_BLOCKS == 0 or len(current) >= MAX_GROUP_BLOCKS:
+            groups.append('\n\n'.join(current))
+            current = []
+    if current:
+        groups.append('\n\n'.join(current))
+    return groups
+
+
+class _HeadingSlugs:
+    """临时替换 toc 的 slugify：记录真正的 slug，返回占位符 id"""
+
+    def __init__(self, slugify):
+        self.slugify = slugify
+        self.slugs: List[str] = []
+
+    def __call__(self, value: str, separator: str) -> str:
+        self.slugs.append(self.slugify(value, separator))
+        return f'{HEADING_ID_PREFIX}{len(self.slugs) - 1}'
+
+
+def _flatten_tokens(tokens: list, into: dict) -> dict:
+    for token in tokens:
+        into[token['id']] = token
+        _flatten_tokens(token['children'], into)
+    return into
+
+
+def _make_entry(piece: str, slugs: List[str], tokens: dict) -> str:
+    """块的缓存项：标题占位符改为块内编号，附带每个标题的 slug 和目录条目"""
+    headings = []
+
+    def renumber(match):
+        token = tokens.get(HEADING_ID_PREFIX + match.group(1))
+        headings.append([slugs[int(match.group(1))],
+                         token['level'] if token else None,
+                         token['name'] if token else None])
+        return f'id="{HEADING_ID_PREFIX}{len(headings) - 1}"'
+
+    return json.dumps([_HEADING_ID_RE.sub(renumber, piece), headings], ensure_ascii=False)
+
+
+def _convert_batch(md, toc, blocks: List[str], references: str, head: Optional[str] = None) -> List[str]:
+    """
+    一次转换多个块，按分隔段落拆回各块的缓存项
+
+    head 是需要放在文档开头单独转换的第一块（元数据），结果为返回值的第一项（没有时为空）；
+    引用定义放在最后一个分隔符之后，输出丢弃。
+    """
+    parts = [head] if head is not None else []
+    for block in blocks:
+        parts.append(BLOCK_MARKER)
+        parts.append(block)
+    parts.append(BLOCK_MARKER)
+    parts.append(references)
+
+    md.reset()
+    if toc is None:
+        output, slugs, tokens = md.convert('\n\n'.join(parts)), [], {}
+    else:
+        recorder = toc.slugify = _HeadingSlugs(toc.slugify)
+        try:
+            output = md.convert('\n\n'.join(parts))
+        finally:
+            toc.slugify = recorder.slugify
+        slugs, tokens = recorder.slugs, _flatten_tokens(md.toc_tokens, {})
+
+    pieces = _MARKER_SPLIT_RE.split(output)
+    if len(pieces) != len(blocks) + 2:
+        raise UnsupportedDocument()
+    return [_make_entry(piece, slugs, tokens) for piece in pieces[:-1]]
+
+
+def get_toc_processor(md):
+    """引擎的 toc 树处理器，没有 toc 扩展时返回 None；开启了锚点链接时抛出 UnsupportedDocument"""
+    toc = md.treeprocessors['toc'] if 'toc' in md.treeprocessors else None
+    if toc is not None and (toc.use_anchors or toc.use_permalinks not in (False, None)):
+        raise UnsupportedDocument()
+    return toc
+
+
+def find_markers(blocks: List[str], marker: str) -> List[int]:
+    """内容为 [TOC] 标记的块；标记出现在其它内容中时抛出 UnsupportedDocument"""
+    indexes = []
+    if marker:
+        for index, block in enumerate(blocks):
+            if marker in block:
+                if block.strip() != marker:
+                    raise UnsupportedDocument()
+                indexes.append(index)
+    return indexes
+
+
+def digest_references(references: str) -> str:
+    return hashlib.sha256(references.encode('utf-8')).hexdigest() if references else ''
+
+
+def is_metadata_head(md, block: str) -> bool:
+    """元数据只在文档开头生效，这样的第一块需要放在批次开头单独转换"""
+    return 'meta' in md.preprocessors and _META_RE.match(block) is not None
+
+
+def convert_blocks(md, toc, blocks: List[str], references: str, context: str, head_alone: bool = False) -> List[str]:
+    """
+    返回各块的缓存项，未命中的块合并在一次 convert 中完成
+
+    head_alone 为 True 时第一块放在批次开头转换（见 is_metadata_head）；其它块前面都有分隔段落，不会被当作元数据。
+    """
+    references_digest = digest_references(references)
+    keys: List[Optional[str]] = []
+    for index, block in enumerate(blocks):
+        if '![' in block:
+            keys.append(None)
+            continue
+        key_source = [context, block]
+        if references_digest and '[' in block:
+            key_source.append(references_digest)
+        if index == 0 and head_alone:
+            key_source.append('head')
+        keys.append(hashlib.sha256('\x00'.join(key_source).encode('utf-8')).hexdigest())
+
+    entries: List[Optional[str]] = [block_cache.get_memory(key) if key else None for key in keys]
+    missing = [index for index, entry in enumerate(entries) if entry is None]
+    if not missing:
+        return entries
+
+    head = None
+    if head_alone and missing[0] == 0:
+        head, missing = blocks[0], missing[1:]
+    try:
+        converted = _convert_batch(md, toc, [blocks[index] for index in missing], references, head)
+    finally:
+        md.reset()
+    if head is not None:
+        entries[0] = converted[0]
+        if keys[0]:
+            block_cache.set_memory(keys[0], converted[0])
+    for index, entry in zip(missing, converted[1:]):
+        entries[index] = entry
+        if keys[index]:
+            block_cache.set_memory(keys[index], entry)
+    return entries
+
+
+def assign_heading_ids(entries: List[str], used_ids: set,
+                       assigned: Optional[List[str]] = None) -> Tuple[List[str], list]:
+    """
+    按顺序为各块的标题分配不与 used_ids 重复的 id，返回 (各块HTML, 目录条目)
+
+    used_ids 会被更新；assigned 不为 None 时依次追加分配的全部 id（包括不在目录级别范围内的标题）。
+    """
+    tokens = []
+    pieces = []
+    for entry in entries:
+        piece, headings = json.loads(entry)
+
+        def assign(match):
+            slug, level, name = headings[int(match.group(1))]
+            heading_id = unique(slug, used_ids)
+            if assigned is not None:
+                assigned.append(heading_id)
+            if level is not None:
+                tokens.append({'level': level, 'id': heading_id, 'name': name})
+            return f'id="{heading_id}"'
+
+        pieces.append(_HEADING_ID_RE.sub(assign, piece))
+    return pieces, tokens
+
+
+def build_toc(md, toc, tokens: list) -> str:
+    """与 toc 扩展相同的目录HTML"""
+    toc_html = md.serializer(toc.build_toc_div(nest_toc_tokens(tokens)))
+    for postprocessor in md.postprocessors:
+        toc_html = postprocessor.run(toc_html)
+    return toc_html.strip('\n')
+
+
+def join_pieces(pieces: List[str]) -> str:
+    # 与 Markdown.convert 一样去掉首尾空白
+    return '\n'.join(piece for piece in pieces if piece).strip()
+
+
+def render_blocks(md, content: str, context: str) -> Optional[str]:
+    """
+    按块渲染 content，md 为已设置好 source_path / image_mode 的引擎；
+    context 为影响输出的其它因素（配置指纹、文档目录、图片模式）的摘要。
+
+    不适合按块处理时返回 None。
+    """
+    if BLOCK_MARKER in content:
+        return None
+    try:
+        toc = get_toc_processor(md)
+        blocks, references = split_blocks(content)
+        if not blocks:
+            return None
+        blocks = group_blocks(blocks, toc.marker if toc is not None else '')
+        marker_indexes = find_markers(blocks, toc.marker if toc is not None else '')
+        entries = convert_blocks(md, toc, blocks, '\n\n'.join(references), context,
+                                 head_alone=is_metadata_head(md, blocks[0]))
+    except UnsupportedDocument:
+        return None
+
+    pieces, tokens = assign_heading_ids(entries, set())
+    if marker_indexes:
+        toc_html = build_toc(md, toc, tokens)
+        for index in marker_indexes:
+            pieces[index] = toc_html
+    return join_pieces(pieces)
@@ -0,0 +1,304 @@
+"""
+渲染结果缓存
+
+两级缓存：进程内按字节数限制的LRU，后面是持久化存储（磁盘目录或Django缓存）。
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple
+
+from django.conf import settings
+
+from .metrics import metrics
+
+logger = logging.getLogger('markdown_renderer')
+
+
+DEFAULT_CACHE_CONFIG = {
+    'ENABLED': True,
+    'MEMORY_MAX_BYTES': 32 * 1024 * 1024,  # 进程内LRU上限 32MB
+    'BACKEND': 'file',                     # 'file'、'django' 或 None（仅内存）
+    'DIR': None,                           # 'file' 后端目录，默认 BASE_DIR/cache/markdown_renderer
+    'ALIAS': 'default',                    # 'django' 后端使用的缓存别名
+    'TIMEOUT': None,                       # 'django' 后端的过期时间（秒），None 表示不过期
+}
+
+
+def get_cache_config() -> Dict[str, Any]:
+    config = getattr(settings, 'MARKDOWN_RENDER', {})
+    cache_config = DEFAULT_CACHE_CONFIG.copy()
+    cache_config.update(config.get('CACHE', {}))
+    return cache_config
+
+
+def _default_cache_dir() -> str:
+    base_dir = getattr(settings, 'BASE_DIR', None)
+    if base_dir:
+        return os.path.join(base_dir, 'cache', 'markdown_renderer')
+    return os.path.join(tempfile.gettempdir(), 'markdown_renderer_cache')
+
+
+def _sizeof(value: str) -> int:
+    return len(value.encode('utf-8'))
+
+
+class MemoryLRU:
+    """按字节数限制容量的线程安全LRU"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._data: 'OrderedDict[str, Tuple[str, int]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            self._data.move_to_end(key)
+            return item[0]
+
+    def set(self, key: str, value: str) -> None:
+        size = _sizeof(value)
+        # 单个条目超过总容量时不缓存，避免把其它条目全部挤出
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[1]
+            self._data[key] = (value, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes and self._data:
+                _, (_, evicted_size) = self._data.popitem(last=False)
+                self.current_bytes -= evicted_size
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.current_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class FileStore:
+    """以 <目录>/<命名空间>/<前两位>/<键> 形式保存条目的磁盘存储"""
+
+    def __init__(self, directory: str, namespace: str):
+        self.directory = os.path.join(directory, namespace)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + '.html')
+
+    def get(self, key: str) -> Optional[str]:
+        try:
+            with open(self._path(key), 'r', encoding='utf-8') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def set(self, key: str, value: str) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 先写临时文件再原子替换，避免并发读到半个文件
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(value)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def clear(self) -> None:
+        import shutil
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class DjangoCacheStore:
+    """基于Django缓存框架的存储"""
+
+    def __init__(self, alias: str, namespace: str, timeout: Optional[int]):
+        from django.core.cache import caches
+        self.cache = caches[alias]
+        self.namespace = namespace
+        self.timeout = timeout
+
+    def get(self, key: str) -> Optional[str]:
+        return self.cache.get(f'md:{self.namespace}:{key}')
+
+    def set(self, key: str, value: str) -> None:
+        self.cache.set(f'md:{self.namespace}:{key}', value, self.timeout)
+
+    def clear(self) -> None:
+        # Django缓存没有按前缀删除的通用接口，只能依赖键中的配置指纹失效
+        pass
+
+
+class TieredCache:
+    """
+    两级缓存
+
+    先查进程内LRU，未命中再查持久化存储，命中后回填到LRU。
+    配置在首次使用时从 MARKDOWN_RENDER['CACHE'] 读取。
+    """
+
+    def __init__(self, namespace: str):
+        self.namespace = namespace
+        self._memory: Optional[MemoryLRU] = None
+        self._store = None
+        self._configured = False
+        self._enabled = True
+        self._lock = threading.Lock()
+        self._counters = {'memory_hits': 0, 'store_hits': 0, 'misses': 0, 'sets': 0, 'errors': 0}
+        metrics.register_cache(self)
+
+    def _configure(self) -> None:
+        if self._configured:
+            return
+        with self._lock:
+            if self._configured:
+                return
+            config = get_cache_config()
+            self._enabled = bool(config['ENABLED'])
+            self._memory = MemoryLRU(config['MEMORY_MAX_BYTES'])
+            backend = config['BACKEND']
+            if backend == 'file':
+                self._store = FileStore(config['DIR'] or _default_cache_dir(), self.namespace)
+            elif backend == 'django':
+                self._store = DjangoCacheStore(config['ALIAS'], self.namespace, config['TIMEOUT'])
+            else:
+                self._store = None
+            self._configured = True
+
+    def reset(self) -> None:
+        """丢弃当前配置和计数，下次使用时重新读取设置"""
+        with self._lock:
+            self._configured = False
+            self._memory = None
+            self._store = None
+            for name in self._counters:
+                self._counters[name] = 0
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counters[name] += 1
+
+    def get(self, key: str) -> Optional[str]:
+        self._configure()
+        if not self._enabled:
+            return None
+
+        value = self._memory.get(key)
+        if value is not None:
+            self._count('memory_hits')
+            return value
+
+        if self._store is not None:
+            try:
+                value = self._store.get(key)
+            except Exception as e:
+                self._count('errors')
+                logger.warning(f"读取{self.namespace}缓存失败: {e}")
+                value = None
+            if value is not None:
+                self._count('store_hits')
+                self._memory.set(key, value)
+                return value
+
+        self._count('misses')
+        return None
+
+    def get_memory(self, key: str) -> Optional[str]:
+        """只查进程内LRU，不访问持久化存储（异步视图中不占用线程）；未命中时不计数"""
+        self._configure()
+        if not self._enabled:
+            return None
+        value = self._memory.get(key)
+        if value is not None:
+            self._count('memory_hits')
+        return value
+
+    def set_memory(self, key: str, value: str) -> None:
+        """只写入进程内LRU，用于已经持久化在别处的内容（例如预生成的产物）"""
+        self._configure()
+        if self._enabled:
+            self._memory.set(key, value)
+
+    def set(self, key: str, value: str) -> None:
+        self._configure()
+        if not self._enabled:
+            return
+
+        self._memory.set(key, value)
+        self._count('sets')
+        if self._store is not None:
+            try:
+                self._store.set(key, value)
+            except Exception as e:
+                self._count('errors')
+                logger.warning(f"写入{self.namespace}缓存失败: {e}")
+
+    def clear(self) -> None:
+        self._configure()
+        self._memory.clear()
+        if self._store is not None:
+            self._store.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        self._configure()
+        with self._lock:
+            stats = dict(self._counters)
+        lookups = stats['memory_hits'] + stats['store_hits'] + stats['misses']
+        stats['hit_ratio'] = (stats['memory_hits'] + stats['store_hits']) / lookups if lookups else 0.0
+        stats['memory_entries'] = len(self._memory)
+        stats['memory_bytes'] = self._memory.current_bytes
+        return stats
+
+
+class _DigestMemo:
+    """按 (路径, mtime, 大小) 记住文件内容的SHA-256，文件未变时无需重新读取"""
+
+    MAX_ENTRIES = 4096
+
+    def __init__(self):
+        self._data: 'OrderedDict[str, Tuple[int, int, str]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def digest(self, file_path: str) -> str:
+        stat = os.stat(file_path)
+        with self._lock:
+            item = self._data.get(file_path)
+            if item is not None and item[0] == stat.st_mtime_ns and item[1] == stat.st_size:
+                self._data.move_to_end(file_path)
+                return item[2]
+
+        hasher = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                hasher.update(chunk)
+        digest = hasher.hexdigest()
+
+        with self._lock:
+            self._data[file_path] = (stat.st_mtime_ns, stat.st_size, digest)
+            self._data.move_to_end(file_path)
+            while len(self._data) > self.MAX_ENTRIES:
+                self._data.popitem(last=False)
+        return digest
+
+
+_digest_memo = _DigestMemo()
+
+
+def file_digest(file_path: str) -> str:
+    return _digest_memo.digest(file_path)
+
+
+render_cache = TieredCache('render')
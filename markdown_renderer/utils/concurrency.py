@@ -0,0 +1,74 @@
+"""
+异步视图中的渲染并发控制
+
+渲染是CPU密集的同步代码，放到固定大小的线程池中执行；信号量限制同时进行的渲染数，
+超出的请求在事件循环中等待（客户端断开时直接取消），不会占用线程，也不会堆积在线程池队列里。
+缓存命中等廉价请求不经过这里，慢渲染不会拖慢它们。
+"""
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from django.conf import settings
+
+from .metrics import timing
+
+DEFAULT_MAX_CONCURRENT_RENDERS = min(4, os.cpu_count() or 1)
+
+
+def get_max_concurrent_renders() -> int:
+    config = getattr(settings, 'MARKDOWN_RENDER', {})
+    return max(1, int(config.get('MAX_CONCURRENT_RENDERS', DEFAULT_MAX_CONCURRENT_RENDERS)))
+
+
+class RenderLimiter:
+    """有界线程池 + 每个事件循环一个信号量"""
+
+    def __init__(self):
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._semaphores: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]' = \
+            weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=get_max_concurrent_renders(),
+                                                        thread_name_prefix='markdown-render')
+        return self._executor
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            semaphore = self._semaphores.get(loop)
+            if semaphore is None:
+                semaphore = self._semaphores[loop] = asyncio.Semaphore(get_max_concurrent_renders())
+        return semaphore
+
+    async def run(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """在渲染线程池中执行 func；等待名额的时间计入 queue 阶段"""
+        with timing('queue'):
+            semaphore = self._get_semaphore()
+            await semaphore.acquire()
+        try:
+            # 复制上下文，线程中记录的阶段耗时仍然写入当前请求的 Server-Timing
+            call = functools.partial(contextvars.copy_context().run, func, *args, **kwargs)
+            return await asyncio.get_running_loop().run_in_executor(self._get_executor(), call)
+        finally:
+            semaphore.release()
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+            self._semaphores = weakref.WeakKeyDictionary()
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+
+render_limiter = RenderLimiter()
@@ -0,0 +1,119 @@
+"""
+文本解码
+
+文件只读取一次；先按UTF-8严格解码，失败时用增量检测器在有限大小的样本上检测编码，
+再依次回退到GBK和latin-1。
+"""
+import codecs
+from typing import Optional, Tuple
+
+# 编码检测最多查看的字节数
+DETECT_SAMPLE_SIZE = 64 * 1024
+
+# 检测结果的置信度低于该值时不采用（短样本容易被误判），改为依次尝试回退编码
+DETECT_MIN_CONFIDENCE = 0.8
+
+FALLBACK_ENCODINGS = ('gbk', 'latin-1')
+
+# 检测器给出的编码替换为兼容的超集，避免样本之外出现的字符解码失败
+ENCODING_SUPERSETS = {
+    'gb2312': 'gb18030',
+    'gbk': 'gb18030',
+    'ascii': 'utf-8',
+    'iso-8859-1': 'latin-1',
+}
+
+
+def detect_encoding(sample: bytes) -> Optional[str]:
+    """在样本上检测编码，置信度不足或无法检测时返回 None"""
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    if sample.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return 'utf-16'
+
+    try:
+        from chardet.universaldetector import UniversalDetector
+    except ImportError:
+        return None
+
+    detector = UniversalDetector()
+    for start in range(0, len(sample), 4096):
+        detector.feed(sample[start:start + 4096])
+        if detector.done:
+            break
+    result = detector.close()
+
+    encoding = result.get('encoding')
+    if not encoding or (result.get('confidence') or 0) < DETECT_MIN_CONFIDENCE:
+        return None
+    encoding = encoding.lower()
+    return ENCODING_SUPERSETS.get(encoding, encoding)
+
+
+def decode_bytes(raw: bytes, encoding: Optional[str] = None) -> Tuple[str, str]:
+    """
+    解码字节内容，返回 (文本, 实际使用的编码)
+
+    已知编码（例如保存在文档记录中的编码）可以通过 encoding 传入，解码失败时再重新检测。
+    """
+    if encoding:
+        try:
+            return raw.decode(encoding), encoding
+        except (UnicodeDecodeError, LookupError):
+            pass
+
+    if raw.startswith(codecs.BOM_UTF8):
+        return raw.decode('utf-8-sig'), 'utf-8-sig'
+
+    try:
+        return raw.decode('utf-8'), 'utf-8'
+    except UnicodeDecodeError:
+        pass
+
+    candidates = []
+    detected = detect_encoding(raw[:DETECT_SAMPLE_SIZE])
+    if detected:
+        candidates.append(detected)
+    candidates.extend(enc for enc in FALLBACK_ENCODINGS if enc not in candidates)
+
+    for candidate in candidates:
+        try:
+            return raw.decode(candidate), candidate
+        except (UnicodeDecodeError, LookupError):
+            continue
+
+    # latin-1 总能解码，不会走到这里
+    return raw.decode('latin-1', errors='replace'), 'latin-1'
+
+
+def sniff_encoding(sample: bytes) -> str:
+    """
+    只根据文件开头的样本判断编码，用于不整体读取文件的场景（例如分页查看大文件）
+
+    样本末尾可能截断在多字节字符中间，因此用增量解码器并且不要求结束。
+    """
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        pass
+
+    detected = detect_encoding(sample)
+    candidates = ([detected] if detected else []) + [enc for enc in FALLBACK_ENCODINGS if enc != detected]
+    for candidate in candidates:
+        try:
+            codecs.getincrementaldecoder(candidate)().decode(sample, final=False)
+            return candidate
+        except (UnicodeDecodeError, LookupError):
+            continue
+    return 'latin-1'
+
+
+def read_text(file_path: str, encoding: Optional[str] = None) -> Tuple[str, str]:
+    """读取并解码文本文件，返回 (文本, 编码)"""
+    with open(file_path, 'rb') as f:
+        raw = f.read()
+    return decode_bytes(raw, encoding)
@@ -0,0 +1,288 @@
+"""
+Markdown扩展
+
+在元素树上完成的后处理，避免对渲染后的整段HTML做正则替换。
+"""
+import base64
+import logging
+import mimetypes
+import os
+from typing import Optional, List, Tuple
+from urllib.parse import unquote
+from xml.etree import ElementTree as etree
+
+from django.conf import settings
+from django.core import signing
+from django.urls import reverse, NoReverseMatch
+from markdown.extensions import Extension
+from markdown.treeprocessors import Treeprocessor
+
+from .cache import file_digest
+from .images import build_srcset, get_images_config
+from .mathml import mathml_cache
+from .metrics import timing
+
+logger = logging.getLogger('markdown_renderer')
+
+
+IMAGE_MIME_MAP = {
+    '.png': 'image/png',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.gif': 'image/gif',
+    '.bmp': 'image/bmp',
+    '.webp': 'image/webp',
+    '.svg': 'image/svg+xml',
+}
+
+ASSET_SALT = 'markdown_renderer.asset'
+ASSET_TOKEN_VERSION = 2
+
+# 图片处理模式：'url' 改写为带内容哈希的资源地址，'inline' 内联为 data URI（离线导出用）
+IMAGE_MODE_URL = 'url'
+IMAGE_MODE_INLINE = 'inline'
+
+
+def get_image_mime_type(img_path: str) -> str:
+    mime_type, _ = mimetypes.guess_type(img_path)
+    if not mime_type:
+        ext = os.path.splitext(img_path.lower())[1]
+        mime_type = IMAGE_MIME_MAP.get(ext, 'image/png')
+    return mime_type
+
+
+def _external_dirs() -> List[str]:
+    config = getattr(settings, 'MARKDOWN_RENDER', {})
+    external_dirs = config.get('EXTERNAL_DIRS')
+    if not external_dirs:
+        return []
+    if isinstance(external_dirs, str):
+        return [external_dirs]
+    return list(external_dirs)
+
+
+def resolve_image_path(src: str, file_path: str) -> str:
+    """把Markdown中的图片地址解析为本地绝对路径"""
+    img_path = unquote(src.strip())
+    if os.path.isabs(img_path):
+        return img_path
+
+    base_dir = os.path.dirname(os.path.abspath(file_path))
+    full_path = os.path.normpath(os.path.join(base_dir, img_path))
+
+    # images/ 下的图片在文档目录中找不到时，再到外部Markdown目录中查找
+    if not os.path.exists(full_path) and (img_path.startswith('./images/') or img_path.startswith('images/')):
+        if img_path.startswith('./'):
+            img_path = img_path[2:]
+        for markdown_root in _external_dirs():
+            candidate = os.path.normpath(os.path.join(markdown_root, img_path))
+            if os.path.exists(candidate):
+                return candidate
+    return full_path
+
+
+def _is_within(path: str, root: str) -> bool:
+    root = os.path.join(os.path.realpath(root), '')
+    return os.path.realpath(path).startswith(root)
+
+
+def is_allowed_image_path(img_path: str, file_path: str) -> bool:
+    """文档只能引用自身所在目录（含子目录）或外部Markdown目录中的图片，绝对路径和 .. 不能越出这些目录"""
+    roots = [os.path.dirname(os.path.abspath(file_path))] + _external_dirs()
+    return any(_is_within(img_path, root) for root in roots)
+
+
+def build_asset_url(img_path: str, width: Optional[int] = None, owner: Optional[int] = None) -> str:
+    """
+    生成带签名和内容哈希的图片地址，签名保证只能访问渲染时引用过的文件
+
+    owner 为文档所有者的用户ID，签入地址后只有该用户可以访问；给出 width 时为该宽度的缩略图地址（见 images.py）。
+    """
+    token = signing.Signer(salt=ASSET_SALT).sign_object({'path': img_path, 'owner': owner}, compress=True)
+    ext = os.path.splitext(img_path.lower())[1]
+    name = file_digest(img_path)[:16] + ext
+    if width is not None:
+        return reverse('markdown_asset_width', args=[token, width, name])
+    return reverse('markdown_asset', args=[token, name])
+
+
+def unsign_asset_token(token: str) -> Tuple[str, Optional[int]]:
+    """返回 (图片路径, 所有者用户ID)；签名无效或格式不符时抛出 BadSignature"""
+    payload = signing.Signer(salt=ASSET_SALT).unsign_object(token)
+    if not isinstance(payload, dict) or not isinstance(payload.get('path'), str):
+        raise signing.BadSignature('资源地址格式无效')
+    return payload['path'], payload.get('owner')
+
+
+def build_data_uri(img_path: str) -> str:
+    with open(img_path, 'rb') as img_file:
+        img_data = img_file.read()
+    img_base64 = base64.b64encode(img_data).decode('utf-8')
+    return f"data:{get_image_mime_type(img_path)};base64,{img_base64}"
+
+
+class ImageAssetTreeprocessor(Treeprocessor):
+    """
+    解析文档中的本地图片
+
+    只处理真正的 <img> 元素，代码块中的图片语法不会被改写。
+    渲染前由调用方在引擎上设置 source_path、image_mode 和 asset_owner（图片地址签发给的用户）。
+    """
+
+    def run(self, root: etree.Element) -> None:
+        with timing('images'):
+            self._rewrite_images(root)
+
+    def _rewrite_images(self, root: etree.Element) -> None:
+        source_path: Optional[str] = getattr(self.md, 'source_path', None)
+        if not source_path:
+            return
+        image_mode = getattr(self.md, 'image_mode', IMAGE_MODE_URL)
+        owner = getattr(self.md, 'asset_owner', None)
+
+        for parent in root.iter():
+            for index, img in enumerate(list(parent)):
+                if img.tag != 'img':
+                    continue
+                src = img.get('src', '')
+                if not src or src.startswith(('http://', 'https://', 'data:', '//')):
+                    continue
+
+                img_path = resolve_image_path(src, source_path)
+                logger.debug(f"处理图片: alt='{img.get('alt', '')}', 路径='{img_path}'")
+
+                if not is_allowed_image_path(img_path, source_path):
+                    logger.warning(f"图片不在文档目录或外部目录中: {img_path}")
+                    parent[index] = self._error_element(img, '不允许引用文档目录以外的图片', src)
+                    continue
+
+                if not os.path.isfile(img_path):
+                    logger.warning(f"图片未找到: {img_path}")
+                    parent[index] = self._error_element(img, '文件不存在', img_path)
+                    continue
+
+                try:
+                    if image_mode == IMAGE_MODE_INLINE:
+                        img.set('src', build_data_uri(img_path))
+                    else:
+                        url = build_asset_url(img_path, owner=owner)
+                        img.set('src', url)
+                        img.set('loading', 'lazy')
+                        srcset = build_srcset(img_path, url, lambda width: build_asset_url(img_path, width, owner))
+                        if srcset:
+                            img.set('srcset', srcset)
+                            img.set('sizes', get_images_config()['SIZES'])
+                except NoReverseMatch:
+                    # 未挂载 markdown_renderer.urls 时退回内联模式
+                    logger.warning("未找到 markdown_asset 路由，图片改为内联")
+                    img.set('src', build_data_uri(img_path))
+                except Exception as e:
+                    logger.warning(f"图片加载错误 {img_path}: {e}")
+                    parent[index] = self._error_element(img, str(e), img_path)
+
+    @staticmethod
+    def _error_element(img: etree.Element, message: str, img_path: str) -> etree.Element:
+        error = etree.Element('span')
+        error.set('class', 'markdown-image-error')
+        error.set('style', 'display: block; color: red; border: 1px solid red; padding: 10px; '
+                           'margin: 10px 0; background-color: #ffeeee;')
+        strong = etree.SubElement(error, 'strong')
+        strong.text = '图片加载错误:'
+        strong.tail = f" {message} - {img_path}"
+        error.tail = img.tail
+        return error
+
+
+class ImageAssetExtension(Extension):
+    def extendMarkdown(self, md):
+        md.treeprocessors.register(ImageAssetTreeprocessor(md), 'image_asset', 15)
+
+
+TABLE_CLASSES = ['table', 'table-bordered', 'table-striped']
+
+# 这些元素内部不会再出现Markdown表格，遍历时不必深入
+TABLE_LEAF_TAGS = frozenset(['table', 'p', 'pre', 'code', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr'])
+
+
+class TableStyleTreeprocessor(Treeprocessor):
+    """为表格加上Bootstrap样式并包裹可横向滚动的容器，一次遍历完成"""
+
+    def run(self, root: etree.Element) -> None:
+        # 表格样式原先是转换后的HTML后处理步骤，计时仍记为 postprocess
+        with timing('postprocess'):
+            self._style_tables(root)
+
+    def _style_tables(self, root: etree.Element) -> None:
+        stack = [root]
+        while stack:
+            parent = stack.pop()
+            for index, child in enumerate(parent):
+                if child.tag == 'table':
+                    parent[index] = self._style(child)
+                elif child.tag not in TABLE_LEAF_TAGS:
+                    stack.append(child)
+
+    @staticmethod
+    def _style(table: etree.Element) -> etree.Element:
+        classes = table.get('class', '').split()
+        if 'table' not in classes:
+            table.set('class', ' '.join(TABLE_CLASSES + classes))
+
+        wrapper = etree.Element('div')
+        wrapper.set('class', 'table-responsive')
+        wrapper.tail = table.tail
+        table.tail = None
+        wrapper.append(table)
+        return wrapper
+
+
+class TableStyleExtension(Extension):
+    def extendMarkdown(self, md):
+        md.treeprocessors.register(TableStyleTreeprocessor(md), 'table_style', 14)
+
+
+def _math_script(element: etree.Element) -> Optional[etree.Element]:
+    """mdx_math 输出的公式节点：<script type="math/tex">，或带预览文本的 span/div 包装"""
+    if element.tag == 'script':
+        return element if element.get('type', '').startswith('math/tex') else None
+    if element.tag in ('span', 'div') and 0 < len(element) <= 2 and element.get('class') is None:
+        script = element[-1]
+        if script.tag == 'script' and script.get('type', '').startswith('math/tex'):
+            return script
+    return None
+
+
+class MathMLTreeprocessor(Treeprocessor):
+    """把 mdx_math 输出的TeX公式转换为 MathML（见 mathml），无法转换的保持原样"""
+
+    def run(self, root: etree.Element) -> None:
+        with timing('math'):
+            stack = [root]
+            while stack:
+                parent = stack.pop()
+                for index, child in enumerate(parent):
+                    script = _math_script(child)
+                    if script is None:
+                        stack.append(child)
+                        continue
+                    replacement = self._convert(script)
+                    if replacement is not None:
+                        replacement.tail = child.tail
+                        parent[index] = replacement
+
+    def _convert(self, script: etree.Element) -> Optional[etree.Element]:
+        display = 'mode=display' in script.get('type', '')
+        mathml = mathml_cache.convert(script.text or '', display)
+        if mathml is None:
+            return None
+        element = etree.Element('div' if display else 'span')
+        element.set('class', 'math')
+        # 已由 sanitize_mathml 按元素树重新序列化，作为原始HTML保存，避免被再次转义
+        element.text = self.md.htmlStash.store(mathml)
+        return element
+
+
+class MathMLExtension(Extension):
+    def extendMarkdown(self, md):
+        # 在行内处理（20）之后、图片（15）和表格（14）之前
+        md.treeprocessors.register(MathMLTreeprocessor(md), 'mathml', 16)
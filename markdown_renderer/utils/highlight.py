@@ -0,0 +1,35 @@
+"""
+Pygments样式表
+
+样式表只生成一次，通过带内容哈希的地址引用，页面中不再内嵌整份CSS。
+"""
+import hashlib
+from functools import lru_cache
+from typing import Tuple
+
+from django.conf import settings
+from django.urls import reverse
+from pygments.formatters import HtmlFormatter
+
+DEFAULT_PYGMENTS_STYLE = 'default'
+
+
+def get_pygments_style() -> str:
+    config = getattr(settings, 'MARKDOWN_RENDER', {})
+    return config.get('PYGMENTS_STYLE', DEFAULT_PYGMENTS_STYLE)
+
+
+@lru_cache(maxsize=8)
+def _build_stylesheet(style: str) -> Tuple[str, str]:
+    css = HtmlFormatter(style=style).get_style_defs('.highlight')
+    return css, hashlib.sha256(css.encode('utf-8')).hexdigest()[:12]
+
+
+def get_pygments_stylesheet() -> Tuple[str, str]:
+    """返回 (CSS内容, 内容哈希)"""
+    return _build_stylesheet(get_pygments_style())
+
+
+def get_pygments_stylesheet_url() -> str:
+    _, digest = get_pygments_stylesheet()
+    return reverse('markdown_pygments_css', args=[digest])
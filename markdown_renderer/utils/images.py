@@ -0,0 +1,245 @@
+"""
+图片缩略图（响应式图片）
+
+相机照片和截图经常有几MB，而页面上只按几百像素宽显示。这里为位图生成若干宽度（默认 320/800/1600）的缩小版本，
+按原图内容哈希保存在磁盘上；页面在 <img> 上给出 srcset，浏览器按显示宽度和像素密度选择足够大的最小版本。
+
+缩略图在上传后的后台处理中预先生成，或在第一次被请求时生成。依赖可选的 Pillow；未安装时只使用原图。
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+from .cache import _default_cache_dir, file_digest
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:  # 可选依赖
+    Image = None
+
+logger = logging.getLogger('markdown_renderer')
+
+DEFAULT_IMAGES_CONFIG = {
+    'ENABLED': True,
+    'WIDTHS': [320, 800, 1600],    # 缩略图宽度，只生成比原图窄的
+    'FORMAT': 'webp',              # 'webp' 或 'jpeg'；Pillow 不支持 WebP 时使用 JPEG
+    'QUALITY': 80,
+    'DIR': None,                   # 默认 <CACHE['DIR']>/images
+    'SIZES': '(max-width: 960px) 100vw, 960px',  # <img sizes>，页面内容区的显示宽度
+    'MAX_PIXELS': 80 * 1000 * 1000,              # 超过该像素数的图片不处理
+}
+
+# 可以缩放的位图；GIF 可能是动画、SVG 是矢量图，都直接使用原图
+RASTER_EXTENSIONS = frozenset(('.jpg', '.jpeg', '.png', '.webp', '.bmp'))
+
+DERIVATIVE_MIME_TYPES = {
+    'webp': 'image/webp',
+    'jpeg': 'image/jpeg',
+    'png': 'image/png',
+}
+
+_SIZE_MEMO_ENTRIES = 4096
+
+
+def get_images_config() -> Dict[str, Any]:
+    config = getattr(settings, 'MARKDOWN_RENDER', {})
+    images_config = DEFAULT_IMAGES_CONFIG.copy()
+    images_config.update(config.get('IMAGES', {}))
+    return images_config
+
+
+def derivatives_enabled() -> bool:
+    return Image is not None and bool(get_images_config()['ENABLED'])
+
+
+def derivative_format() -> str:
+    fmt = str(get_images_config()['FORMAT']).lower()
+    if fmt == 'webp' and not features.check('webp'):
+        return 'jpeg'
+    return 'jpeg' if fmt == 'jpg' else fmt
+
+
+def get_images_fingerprint() -> Optional[List[Any]]:
+    """影响渲染结果（srcset）的配置，计入渲染缓存的配置指纹"""
+    if not derivatives_enabled():
+        return None
+    config = get_images_config()
+    return [sorted(config['WIDTHS']), derivative_format(), config['SIZES']]
+
+
+def supports_derivatives(img_path: str) -> bool:
+    return derivatives_enabled() and os.path.splitext(img_path.lower())[1] in RASTER_EXTENSIONS
+
+
+class _SizeMemo:
+    """按内容哈希记住图片尺寸（经 EXIF 方向校正），只需要读一次文件头"""
+
+    def __init__(self):
+        self._data: 'OrderedDict[str, Optional[Tuple[int, int]]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def size(self, img_path: str, digest: str) -> Optional[Tuple[int, int]]:
+        with self._lock:
+            if digest in self._data:
+                self._data.move_to_end(digest)
+                return self._data[digest]
+        size = _read_size(img_path)
+        with self._lock:
+            self._data[digest] = size
+            while len(self._data) > _SIZE_MEMO_ENTRIES:
+                self._data.popitem(last=False)
+        return size
+
+
+def _read_size(img_path: str) -> Optional[Tuple[int, int]]:
+    try:
+        with Image.open(img_path) as image:
+            width, height = image.size
+            # EXIF 方向为 5-8 时图片需要旋转90度，显示时宽高互换
+            if image.getexif().get(0x0112) in (5, 6, 7, 8):
+                width, height = height, width
+    except Exception as e:
+        logger.warning(f"无法读取图片尺寸 {img_path}: {e}")
+        return None
+    if width * height > get_images_config()['MAX_PIXELS']:
+        return None
+    return width, height
+
+
+_size_memo = _SizeMemo()
+
+
+def image_size(img_path: str, digest: Optional[str] = None) -> Optional[Tuple[int, int]]:
+    """图片显示时的 (宽, 高)；无法读取或超过 MAX_PIXELS 时返回 None"""
+    if not supports_derivatives(img_path):
+        return None
+    return _size_memo.size(img_path, digest or file_digest(img_path))
+
+
+def derivative_widths(img_path: str, digest: Optional[str] = None) -> List[int]:
+    """需要生成的缩略图宽度（比原图窄的）"""
+    size = image_size(img_path, digest)
+    if size is None:
+        return []
+    return sorted(width for width in set(get_images_config()['WIDTHS']) if width < size[0])
+
+
+def _derivative_dir() -> str:
+    cache_dir = getattr(settings, 'MARKDOWN_RENDER', {}).get('CACHE', {}).get('DIR')
+    return get_images_config()['DIR'] or os.path.join(cache_dir or _default_cache_dir(), 'images')
+
+
+def derivative_path(digest: str, width: int, fmt: str) -> str:
+    extension = 'jpg' if fmt == 'jpeg' else fmt
+    return os.path.join(_derivative_dir(), digest[:2], f'{digest}-{width}.{extension}')
+
+
+# 每个缩略图一把锁和持有或等待它的线程数；没有线程使用时才删除，表的大小只与正在生成的缩略图数有关
+_locks: Dict[str, List] = {}
+_locks_guard = threading.Lock()
+
+
+@contextmanager
+def _locked(key: str):
+    with _locks_guard:
+        entry = _locks.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _locks_guard:
+            entry[1] -= 1
+            if not entry[1]:
+                del _locks[key]
+
+
+def _resize(img_path: str, width: int, target: str, fmt: str) -> None:
+    config = get_images_config()
+    with Image.open(img_path) as source:
+        rotated = source.getexif().get(0x0112) in (5, 6, 7, 8)
+        scale = width / (source.height if rotated else source.width)
+        # draft 让 JPEG 解码器直接按缩小比例解码（不小于目标尺寸），大照片快很多
+        source.draft('RGB', (int(source.width * scale) + 1, int(source.height * scale) + 1))
+        image = ImageOps.exif_transpose(source)
+        height = max(1, round(image.height * width / image.width))
+        has_alpha = image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info)
+        image = image.convert('RGBA' if has_alpha and fmt != 'jpeg' else 'RGB')
+        image = image.resize((width, height), Image.LANCZOS)
+
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target), prefix='.resize-', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                options = {'quality': config['QUALITY']}
+                if fmt == 'jpeg':
+                    options.update(optimize=True, progressive=True)
+                elif fmt == 'webp':
+                    options['method'] = 4
+                image.save(f, fmt.upper(), **options)
+            os.replace(tmp_path, target)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+def get_derivative(img_path: str, width: int, digest: Optional[str] = None) -> Optional[Tuple[str, str]]:
+    """
+    返回宽度为 width 的缩略图 (路径, MIME类型)，不存在时生成
+
+    width 不是配置中的宽度、不比原图窄或生成失败时返回 None，调用方应使用原图。
+    """
+    digest = digest or file_digest(img_path)
+    if width not in derivative_widths(img_path, digest):
+        return None
+    fmt = derivative_format()
+    target = derivative_path(digest, width, fmt)
+    if not os.path.exists(target):
+        # 同一缩略图的并发请求只生成一次
+        try:
+            with _locked(target):
+                if not os.path.exists(target):
+                    _resize(img_path, width, target, fmt)
+        except Exception as e:
+            logger.warning(f"无法生成缩略图 {img_path} ({width}px): {e}")
+            return None
+    return target, DERIVATIVE_MIME_TYPES[fmt]
+
+
+def generate_derivatives(img_path: str, digest: Optional[str] = None) -> int:
+    """预先生成全部缩略图（上传后的后台处理），返回缩略图数"""
+    digest = digest or file_digest(img_path)
+    widths = derivative_widths(img_path, digest)
+    for width in widths:
+        get_derivative(img_path, width, digest)
+    return len(widths)
+
+
+def build_srcset(img_path: str, original_url: str, url_for_width: Callable[[int], str],
+                 digest: Optional[str] = None) -> Optional[str]:
+    """
+    srcset 属性值：各缩略图加上原图（按原图宽度）
+
+    不需要缩略图（图片本来就不宽、不是位图或未安装 Pillow）时返回 None。
+    """
+    digest = digest or file_digest(img_path)
+    widths = derivative_widths(img_path, digest)
+    if not widths:
+        return None
+    original_width = image_size(img_path, digest)[0]
+    candidates = [f'{url_for_width(width)} {width}w' for width in widths]
+    candidates.append(f'{original_url} {original_width}w')
+    return ', '.join(candidates)
+
+
+def derivative_etag(digest: str, width: int) -> str:
+    payload = f'{digest}:{width}:{derivative_format()}:{get_images_config()["QUALITY"]}'
+    return '"' + hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32] + '"'
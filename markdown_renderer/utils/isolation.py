@@ -0,0 +1,263 @@
+"""
+在独立进程中渲染
+
+可选模式（MARKDOWN_RENDER['ISOLATION']['ENABLED']）。Markdown转换在一组工作进程中执行，
+每个文档有CPU时间、内存和墙钟时间上限：病态文件（极深的嵌套列表、超大表格等）只会占用一个工作进程一小段时间，
+不会长时间占住Web工作线程。超出上限时抛出 RenderLimitExceeded，触发上限的工作进程被回收并重新创建。
+CPU和内存上限依赖 resource 模块（仅Unix），其它平台只有墙钟时间上限。
+"""
+import logging
+import math
+import multiprocessing
+import os
+import signal
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger('markdown_renderer')
+
+DEFAULT_ISOLATION_CONFIG = {
+    'ENABLED': False,
+    'WORKERS': 2,                 # 工作进程数，同时也是同时进行的隔离渲染数
+    'TIMEOUT': 10,                # 每个文档的墙钟时间上限（秒）
+    'CPU_SECONDS': 5,             # 每个文档的CPU时间上限（秒）
+    'MEMORY_MB': 512,             # 每个文档可以额外使用的内存（MB）
+    'MAX_TASKS_PER_WORKER': 500,  # 渲染这么多文档后回收工作进程，释放碎片化的内存
+    'START_METHOD': None,         # multiprocessing 启动方式，默认 forkserver（不可用时 spawn）
+    'STARTUP_TIMEOUT': 60,        # 等待新工作进程完成 django.setup() 的时间（秒）
+}
+
+
+def get_isolation_config() -> Dict[str, Any]:
+    config = getattr(settings, 'MARKDOWN_RENDER', {})
+    isolation_config = DEFAULT_ISOLATION_CONFIG.copy()
+    isolation_config.update(config.get('ISOLATION', {}))
+    return isolation_config
+
+
+def isolation_enabled() -> bool:
+    return bool(get_isolation_config()['ENABLED'])
+
+
+class RenderLimitExceeded(Exception):
+    """渲染超出时间或内存上限"""
+
+
+class _CpuLimitReached(BaseException):
+    # 继承 BaseException，不会被渲染代码中的 except Exception 吞掉
+    pass
+
+
+def _on_cpu_limit(signum, frame):
+    raise _CpuLimitReached()
+
+
+def _address_space_size() -> int:
+    """当前进程的虚拟内存大小（字节），无法获取时返回0"""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[0]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return 0
+
+
+def _cpu_time() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _worker_main(conn, memory_mb: int) -> None:
+    """工作进程：逐个接收 (文件路径, 编码, 图片模式, CPU秒数)，返回 ('ok', HTML)、('limit', 原因) 或 ('error', 信息)"""
+    from django.apps import apps
+    if not apps.ready:
+        import django
+        django.setup()
+    from .encoding import read_text
+    from .renderer import MarkdownRenderer
+
+    if resource is not None:
+        if memory_mb:
+            _, hard = resource.getrlimit(resource.RLIMIT_AS)
+            limit = _address_space_size() + memory_mb * 1024 * 1024
+            if hard == resource.RLIM_INFINITY or limit < hard:
+                resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+        signal.signal(signal.SIGXCPU, _on_cpu_limit)
+    conn.send(('ready', os.getpid()))
+
+    while True:
+        try:
+            task = conn.recv()
+        except (EOFError, OSError):
+            return
+        if task is None:
+            return
+        file_path, encoding, image_mode, asset_owner, cpu_seconds = task
+
+        if resource is not None and cpu_seconds:
+            # RLIMIT_CPU 按进程累计，每个文档开始前把软上限设为“已用时间 + 本文档的预算”
+            _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+            soft = math.ceil(_cpu_time()) + cpu_seconds
+            if hard == resource.RLIM_INFINITY or soft < hard:
+                resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+        try:
+            content, _ = read_text(file_path, encoding)
+            conn.send(('ok', MarkdownRenderer._convert(content, file_path, image_mode, asset_owner)))
+        except _CpuLimitReached:
+            conn.send(('limit', f'CPU时间超过{cpu_seconds}秒'))
+            return
+        except MemoryError:
+            conn.send(('limit', f'内存超过{memory_mb}MB'))
+            return
+        except Exception as e:
+            conn.send(('error', f'{type(e).__name__}: {e}'))
+
+
+class _Worker:
+    def __init__(self, context, config: Dict[str, Any]):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn, config['MEMORY_MB']),
+                                       name='markdown-render-worker', daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.tasks = 0
+        if not self.conn.poll(config['STARTUP_TIMEOUT']):
+            self.kill()
+            raise RuntimeError('Markdown渲染工作进程启动超时')
+        try:
+            self.conn.recv()
+        except EOFError:
+            self.kill()
+            raise RuntimeError('Markdown渲染工作进程启动失败')
+
+    def kill(self) -> None:
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(timeout=5)
+        self.conn.close()
+
+
+class IsolatedRenderer:
+    """
+    渲染工作进程池
+
+    同一内容（路径、mtime、大小）超出上限后会被记住，之后直接抛出 RenderLimitExceeded，
+    不会每次打开都再占用一个工作进程到超时。
+    """
+
+    MAX_FAILURES = 1024
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._idle: List[_Worker] = []
+        self._slots: Optional[threading.BoundedSemaphore] = None
+        self._context = None
+        self._failures: 'OrderedDict[Tuple[str, int, int], str]' = OrderedDict()
+        self.recycled = 0
+
+    def _setup(self, config: Dict[str, Any]) -> None:
+        if self._slots is not None:
+            return
+        with self._lock:
+            if self._slots is None:
+                method = config['START_METHOD']
+                if method is None:
+                    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                self._context = multiprocessing.get_context(method)
+                self._slots = threading.BoundedSemaphore(max(1, config['WORKERS']))
+
+    @staticmethod
+    def _failure_key(file_path: str) -> Tuple[str, int, int]:
+        stat = os.stat(file_path)
+        return file_path, stat.st_mtime_ns, stat.st_size
+
+    def _acquire_worker(self, config: Dict[str, Any]) -> _Worker:
+        with self._lock:
+            while self._idle:
+                worker = self._idle.pop()
+                if worker.process.is_alive():
+                    return worker
+                worker.kill()
+        return _Worker(self._context, config)
+
+    def _release_worker(self, worker: _Worker, config: Dict[str, Any]) -> None:
+        if worker.tasks >= config['MAX_TASKS_PER_WORKER'] or not worker.process.is_alive():
+            self._retire(worker)
+            return
+        with self._lock:
+            self._idle.append(worker)
+
+    def _retire(self, worker: _Worker) -> None:
+        try:
+            worker.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        worker.kill()
+        self.recycled += 1
+
+    def _remember_failure(self, key: Tuple[str, int, int], reason: str) -> None:
+        with self._lock:
+            self._failures[key] = reason
+            while len(self._failures) > self.MAX_FAILURES:
+                self._failures.popitem(last=False)
+
+    def convert(self, file_path: str, encoding: Optional[str] = None, image_mode: Optional[str] = None,
+                asset_owner: Optional[int] = None) -> str:
+        """在工作进程中读取并转换文件，返回HTML；超出上限时抛出 RenderLimitExceeded"""
+        config = get_isolation_config()
+        self._setup(config)
+
+        key = self._failure_key(file_path)
+        with self._lock:
+            reason = self._failures.get(key)
+        if reason is not None:
+            raise RenderLimitExceeded(reason)
+
+        with self._slots:
+            worker = self._acquire_worker(config)
+            try:
+                worker.conn.send((file_path, encoding, image_mode, asset_owner, config['CPU_SECONDS']))
+                if not worker.conn.poll(config['TIMEOUT']):
+                    raise RenderLimitExceeded(f"渲染时间超过{config['TIMEOUT']}秒")
+                try:
+                    status, payload = worker.conn.recv()
+                except EOFError:
+                    # 工作进程被系统终止（例如内存不足）
+                    raise RenderLimitExceeded('渲染进程异常退出')
+            except RenderLimitExceeded as e:
+                self._retire(worker)
+                self._remember_failure(key, str(e))
+                logger.warning("渲染超出上限，已回收工作进程: %s（%s）", file_path, e)
+                raise
+            except BaseException:
+                self._retire(worker)
+                raise
+
+            worker.tasks += 1
+            if status == 'limit':
+                worker.process.join(timeout=5)
+                self._retire(worker)
+                self._remember_failure(key, payload)
+                logger.warning("渲染超出上限，已回收工作进程: %s（%s）", file_path, payload)
+                raise RenderLimitExceeded(payload)
+            self._release_worker(worker, config)
+            if status == 'error':
+                raise RuntimeError(payload)
+            return payload
+
+    def shutdown(self) -> None:
+        with self._lock:
+            workers, self._idle = self._idle, []
+        for worker in workers:
+            self._retire(worker)
+
+
+isolated_renderer = IsolatedRenderer()
@@ -0,0 +1,172 @@
+"""
+服务端数学公式渲染
+
+mdx_math 只输出TeX源码（<script type="math/tex">），由浏览器端的 KaTeX 扫描整页后渲染。
+开启 'mathml' 模式后，公式在服务端转换为 MathML，浏览器原生显示，不需要任何脚本。
+同一公式经常在多个文档中重复出现，转换结果按TeX源码缓存在进程内按字节数限制的LRU中。
+
+转换依赖可选的 latex2mathml 包；未安装时仍由浏览器端渲染。无法转换的公式保持原样，页面照常加载 KaTeX 作为后备。
+"""
+import logging
+import threading
+from typing import Any, Dict, Optional
+from xml.etree import ElementTree as etree
+
+from django.conf import settings
+
+from .cache import MemoryLRU
+from .metrics import metrics
+
+try:
+    from latex2mathml.converter import convert as latex_to_mathml
+except ImportError:  # 可选依赖
+    latex_to_mathml = None
+
+logger = logging.getLogger('markdown_renderer')
+
+MATH_MODE_CLIENT = 'client'   # 浏览器端 KaTeX 渲染（默认）
+MATH_MODE_MATHML = 'mathml'   # 服务端转换为 MathML
+
+DEFAULT_MATH_CONFIG = {
+    'MODE': MATH_MODE_CLIENT,
+    'CACHE_MAX_BYTES': 4 * 1024 * 1024,  # 公式缓存上限
+}
+
+MATHML_NAMESPACE = 'http://www.w3.org/1998/Math/MathML'
+
+# 允许输出的 MathML 元素（表示型标记）。latex2mathml 不转义 \text{} 中的 < >，转换结果不能直接当作可信HTML
+MATHML_TAGS = frozenset((
+    'math', 'mrow', 'mi', 'mn', 'mo', 'ms', 'mtext', 'mspace', 'msub', 'msup', 'msubsup',
+    'munder', 'mover', 'munderover', 'mfrac', 'msqrt', 'mroot', 'mstyle', 'merror', 'mpadded',
+    'mphantom', 'mfenced', 'menclose', 'mtable', 'mtr', 'mtd', 'mlabeledtr', 'mmultiscripts',
+    'mprescripts', 'none', 'semantics', 'annotation',
+))
+
+# 可以执行脚本或引用外部资源的属性（\href 会生成 href）
+UNSAFE_ATTRIBUTE_NAMES = frozenset(('href', 'src', 'style'))
+
+# 页面中出现这些内容时仍需要浏览器端渲染：未转换的公式，或尚未加载的分段（其中的公式无法预先确定）
+CLIENT_MATH_MARKERS = ('math/tex', 'md-section-pending')
+
+_warned_missing = False
+
+
+def get_math_config() -> Dict[str, Any]:
+    config = getattr(settings, 'MARKDOWN_RENDER', {})
+    math_config = DEFAULT_MATH_CONFIG.copy()
+    math_config.update(config.get('MATH', {}))
+    return math_config
+
+
+def get_math_mode() -> str:
+    """实际生效的公式渲染方式；配置为 'mathml' 但未安装 latex2mathml 时退回浏览器端渲染"""
+    global _warned_missing
+    mode = get_math_config()['MODE']
+    if mode != MATH_MODE_MATHML:
+        return MATH_MODE_CLIENT
+    if latex_to_mathml is None:
+        if not _warned_missing:
+            _warned_missing = True
+            logger.warning("MARKDOWN_RENDER['MATH']['MODE'] 为 'mathml'，但未安装 latex2mathml，公式仍由浏览器端渲染")
+        return MATH_MODE_CLIENT
+    return MATH_MODE_MATHML
+
+
+def needs_client_math(html: str) -> bool:
+    """页面是否需要加载浏览器端的公式渲染脚本"""
+    if get_math_mode() != MATH_MODE_MATHML:
+        return True
+    return any(marker in html for marker in CLIENT_MATH_MARKERS)
+
+
+def sanitize_mathml(mathml: str) -> Optional[str]:
+    """
+    按元素树重新序列化 MathML：只保留白名单中的元素，去掉事件和链接属性，文本节点重新转义
+
+    不是合法XML或含有其它元素时返回 None，公式交给浏览器端渲染。
+    """
+    try:
+        root = etree.fromstring(mathml)
+    except etree.ParseError:
+        return None
+    for element in root.iter():
+        namespace, _, tag = element.tag.rpartition('}')
+        if namespace not in ('', '{' + MATHML_NAMESPACE) or tag not in MATHML_TAGS:
+            return None
+        element.tag = tag
+        for name in list(element.attrib):
+            if ':' in name or '}' in name or name.lower().startswith('on') or name.lower() in UNSAFE_ATTRIBUTE_NAMES:
+                del element.attrib[name]
+    if root.tag != 'math':
+        return None
+    root.set('xmlns', MATHML_NAMESPACE)
+    return etree.tostring(root, encoding='unicode')
+
+
+class MathMLCache:
+    """
+    TeX源码到 MathML 的转换缓存
+
+    键包含行内/独立显示方式；缓存的是经 sanitize_mathml 处理后的结果。
+    转换失败（或结果含有不允许的内容）记为空字符串，同一公式不再重复尝试。
+    """
+
+    namespace = 'mathml'
+
+    def __init__(self):
+        self._memory: Optional[MemoryLRU] = None
+        self._lock = threading.Lock()
+        self._counters = {'memory_hits': 0, 'store_hits': 0, 'misses': 0, 'failures': 0}
+        metrics.register_cache(self)
+
+    def _get_memory(self) -> MemoryLRU:
+        if self._memory is None:
+            with self._lock:
+                if self._memory is None:
+                    self._memory = MemoryLRU(get_math_config()['CACHE_MAX_BYTES'])
+        return self._memory
+
+    def reset(self) -> None:
+        """丢弃缓存内容和计数，下次使用时重新读取设置"""
+        with self._lock:
+            self._memory = None
+            for name in self._counters:
+                self._counters[name] = 0
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counters[name] += 1
+
+    def convert(self, tex: str, display: bool) -> Optional[str]:
+        """返回 MathML，无法转换时返回 None"""
+        memory = self._get_memory()
+        key = ('block:' if display else 'inline:') + tex
+        mathml = memory.get(key)
+        if mathml is not None:
+            self._count('memory_hits')
+            return mathml or None
+
+        self._count('misses')
+        try:
+            mathml = sanitize_mathml(latex_to_mathml(tex, display='block' if display else 'inline'))
+        except Exception as e:
+            logger.debug("公式无法转换为MathML，保留给浏览器端渲染: %s (%s)", tex[:80], e)
+            mathml = None
+        if mathml is None:
+            self._count('failures')
+            mathml = ''
+        memory.set(key, mathml)
+        return mathml or None
+
+    def stats(self) -> Dict[str, Any]:
+        memory = self._get_memory()
+        with self._lock:
+            stats = dict(self._counters)
+        lookups = stats['memory_hits'] + stats['misses']
+        stats['hit_ratio'] = stats['memory_hits'] / lookups if lookups else 0.0
+        stats['memory_entries'] = len(memory)
+        stats['memory_bytes'] = memory.current_bytes
+        return stats
+
+
+mathml_cache = MathMLCache()
@@ -0,0 +1,184 @@
+"""
+渲染过程的计时和指标
+
+timing('stage') 记录一个阶段的耗时：计入进程内的延迟直方图，并在请求范围内（见 server_timing 装饰器）
+收集起来写入 Server-Timing 响应头。指标可以通过 render_text() 导出为 Prometheus 文本格式。
+"""
+import asyncio
+import contextvars
+import functools
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+# 直方图的桶上界（毫秒）
+DEFAULT_BUCKETS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+STAGE_METRIC = 'markdown_render_stage_ms'
+VIEW_METRIC = 'markdown_view_ms'
+
+_spans: contextvars.ContextVar[Optional[List[Tuple[str, float]]]] = contextvars.ContextVar(
+    'markdown_render_spans', default=None)
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.count += 1
+        self.sum += value
+
+
+class MetricsRegistry:
+    """进程内的指标，按 (名称, 标签) 保存直方图"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], Histogram] = {}
+        self._caches = []
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def register_cache(self, cache) -> None:
+        """登记一个带 namespace 和 stats() 的缓存，导出其命中率"""
+        with self._lock:
+            self._caches.append(cache)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._histograms.clear()
+
+    def snapshot(self) -> Dict[str, dict]:
+        with self._lock:
+            histograms = {key: (list(h.buckets), list(h.counts), h.count, h.sum) for key, h in self._histograms.items()}
+            caches = list(self._caches)
+        return {
+            'histograms': histograms,
+            'caches': {cache.namespace: cache.stats() for cache in caches},
+        }
+
+    def render_text(self) -> str:
+        """Prometheus 文本格式"""
+        snapshot = self.snapshot()
+        lines = []
+        typed = set()
+        for (name, labels), (buckets, counts, count, total) in sorted(snapshot['histograms'].items()):
+            if name not in typed:
+                lines.append(f'# TYPE {name} histogram')
+                typed.add(name)
+            cumulative = 0
+            for bound, bucket_count in zip(list(buckets) + ['+Inf'], counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{_labels(labels + (("le", str(bound)),))} {cumulative}')
+            lines.append(f'{name}_sum{_labels(labels)} {total:.3f}')
+            lines.append(f'{name}_count{_labels(labels)} {count}')
+
+        if snapshot['caches']:
+            lines.append('# TYPE markdown_cache_requests_total counter')
+            for namespace, stats in sorted(snapshot['caches'].items()):
+                for result in ('memory_hits', 'store_hits', 'misses'):
+                    lines.append(f'markdown_cache_requests_total'
+                                 f'{_labels((("cache", namespace), ("result", result)))} {stats[result]}')
+            lines.append('# TYPE markdown_cache_hit_ratio gauge')
+            for namespace, stats in sorted(snapshot['caches'].items()):
+                lines.append(f'markdown_cache_hit_ratio{_labels((("cache", namespace),))} {stats["hit_ratio"]:.4f}')
+            lines.append('# TYPE markdown_cache_memory_bytes gauge')
+            for namespace, stats in sorted(snapshot['caches'].items()):
+                lines.append(f'markdown_cache_memory_bytes{_labels((("cache", namespace),))} {stats["memory_bytes"]}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+
+metrics = MetricsRegistry()
+
+
+@contextmanager
+def timing(stage: str):
+    """记录一个阶段的耗时；嵌套的阶段各自计时（例如 convert 包含 images）"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = (time.perf_counter() - start) * 1000
+        metrics.observe(STAGE_METRIC, elapsed, stage=stage)
+        spans = _spans.get()
+        if spans is not None:
+            spans.append((stage, elapsed))
+
+
+@contextmanager
+def collect_spans():
+    """在当前上下文中收集 timing() 记录的阶段，返回 (阶段, 毫秒) 列表"""
+    spans: List[Tuple[str, float]] = []
+    token = _spans.set(spans)
+    try:
+        yield spans
+    finally:
+        _spans.reset(token)
+
+
+_TOKEN_RE = re.compile(r'[^A-Za-z0-9_.-]')
+
+
+def format_server_timing(spans: List[Tuple[str, float]]) -> str:
+    """同名阶段合并耗时，按首次出现的顺序输出 Server-Timing 头的值"""
+    merged: Dict[str, float] = {}
+    for stage, elapsed in spans:
+        key = _TOKEN_RE.sub('_', stage)
+        merged[key] = merged.get(key, 0.0) + elapsed
+    return ', '.join(f'{stage};dur={elapsed:.2f}' for stage, elapsed in merged.items())
+
+
+def server_timing(view_name: str):
+    """
+    视图装饰器：收集请求中各阶段的耗时写入 Server-Timing 响应头，并记录视图总耗时
+
+    放在 login_required 之内使用，同步和异步视图都可以装饰。
+    """
+    def finish(response, spans, start):
+        total = (time.perf_counter() - start) * 1000
+        metrics.observe(VIEW_METRIC, total, view=view_name)
+        response['Server-Timing'] = format_server_timing(spans + [('total', total)])
+        return response
+
+    def decorator(view_func):
+        if asyncio.iscoroutinefunction(view_func):
+            @functools.wraps(view_func)
+            async def async_wrapper(request, *args, **kwargs):
+                start = time.perf_counter()
+                with collect_spans() as spans:
+                    response = await view_func(request, *args, **kwargs)
+                return finish(response, spans, start)
+            return async_wrapper
+
+        @functools.wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            start = time.perf_counter()
+            with collect_spans() as spans:
+                response = view_func(request, *args, **kwargs)
+            return finish(response, spans, start)
+        return wrapper
+    return decorator
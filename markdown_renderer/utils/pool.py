@@ -0,0 +1,58 @@
+"""
+Markdown引擎池
+
+构造 markdown.Markdown 需要加载全部扩展并编译各处理器的正则，成本不低。
+这里为每个线程按配置指纹保存一个已构造好的引擎，使用前后调用 reset()。
+"""
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator
+
+import markdown
+
+
+class MarkdownEnginePool:
+    """线程本地、按配置指纹划分的引擎池"""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.created = 0
+
+    def _engines(self) -> Dict[str, markdown.Markdown]:
+        engines = getattr(self._local, 'engines', None)
+        if engines is None:
+            engines = self._local.engines = {}
+            self._local.in_use = set()
+        return engines
+
+    @contextmanager
+    def engine(self, fingerprint: str, factory: Callable[[], markdown.Markdown]) -> Iterator[markdown.Markdown]:
+        engines = self._engines()
+        in_use = self._local.in_use
+
+        # 同一线程内重入（例如在渲染过程中又触发渲染）时使用临时引擎
+        if fingerprint in in_use:
+            yield factory()
+            return
+
+        md = engines.get(fingerprint)
+        if md is None:
+            md = engines[fingerprint] = factory()
+            with self._lock:
+                self.created += 1
+
+        in_use.add(fingerprint)
+        try:
+            md.reset()
+            yield md
+        finally:
+            md.reset()
+            in_use.discard(fingerprint)
+
+    def clear(self) -> None:
+        """清空当前线程的引擎（其它线程的引擎在线程结束时释放）"""
+        self._engines().clear()
+
+
+engine_pool = MarkdownEnginePool()
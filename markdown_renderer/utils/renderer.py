@@ -1,16 +1,28 @@
 import os
+import copy
+import json
+import hashlib
 import traceback
-import base64
-import re
 from typing import Union, Optional, Dict, Any, List
 from pathlib import Path
 
 import markdown
 from django.conf import settings
+from django.utils.html import escape
 from django.utils.safestring import mark_safe, SafeString
 from django.core.exceptions import ValidationError
 
 from .sanitizer import FileValidator
+from .cache import render_cache, file_digest
+from .pool import engine_pool
+from .encoding import read_text
+from .metrics import timing
+from .concurrency import render_limiter
+from .isolation import RenderLimitExceeded, isolated_renderer, isolation_enabled
+from .blocks import get_incremental_config, render_blocks, supports_extensions
+from .mathml import MATH_MODE_MATHML, get_math_mode
+from .images import get_images_fingerprint
+from .extensions import ASSET_TOKEN_VERSION, ImageAssetExtension, TableStyleExtension, MathMLExtension, IMAGE_MODE_URL
 
 
 class MarkdownRenderer:
@@ -53,7 +65,8 @@ class MarkdownRenderer:
     @classmethod
     def get_markdown_extensions(cls) -> List[str]:
         config = getattr(settings, 'MARKDOWN_RENDER', {})
-        extensions = config.get('EXTENSIONS', cls.DEFAULT_EXTENSIONS)
+        # 复制一份，避免修改类属性或settings中的列表
+        extensions = list(config.get('EXTENSIONS', cls.DEFAULT_EXTENSIONS))
         
         # 确保tables扩展被包含
         if 'tables' not in extensions:
@@ -67,190 +80,175 @@ class MarkdownRenderer:
     @classmethod
     def get_extension_configs(cls) -> Dict[str, Dict[str, Any]]:
         config = getattr(settings, 'MARKDOWN_RENDER', {})
-        ext_configs = cls.DEFAULT_EXTENSION_CONFIGS.copy()
+        ext_configs = copy.deepcopy(cls.DEFAULT_EXTENSION_CONFIGS)
         
         user_configs = config.get('EXTENSION_CONFIGS', {})
         for ext_name, ext_config in user_configs.items():
             if ext_name in ext_configs:
                 ext_configs[ext_name].update(ext_config)
             else:
-                ext_configs[ext_name] = ext_config
+                ext_configs[ext_name] = dict(ext_config)
                 
         return ext_configs
     
     @classmethod
-    def _process_image_links(cls, content: str, file_path: str) -> str:
-        def replace_image(match):
-            alt_text = match.group(1)
-            img_path = match.group(2).strip()
-            
-            if img_path.startswith(('http://', 'https://', 'data:')):
-                return f"![{alt_text}]({img_path})"
-                
-            if not os.path.isabs(img_path):
-                base_dir = os.path.dirname(os.path.abspath(file_path))
-                
-                if img_path.startswith('./images/') or img_path.startswith('images/'):
-                    full_path = os.path.normpath(os.path.join(base_dir, img_path))
+    def get_image_mode(cls) -> str:
+        config = getattr(settings, 'MARKDOWN_RENDER', {})
+        return config.get('IMAGE_MODE', IMAGE_MODE_URL)
+    
+    @classmethod
+    def get_config_fingerprint(cls, image_mode: Optional[str] = None) -> str:
+        """扩展列表和扩展配置的指纹，配置变化时缓存自动失效"""
+        payload = json.dumps({
+            'markdown': markdown.__version__,
+            'extensions': cls.get_markdown_extensions(),
+            'extension_configs': cls.get_extension_configs(),
+            'image_mode': image_mode or cls.get_image_mode(),
+            'math_mode': get_math_mode(),
+            'images': get_images_fingerprint(),
+            # 图片地址的签名内容（路径 + 所有者），格式变化后旧缓存中的地址失效
+            'asset_token': ASSET_TOKEN_VERSION,
+        }, sort_keys=True, default=repr)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+    
+    @classmethod
+    def get_cache_key(cls, content_digest: str, file_path: Optional[str] = None,
+                      image_mode: Optional[str] = None, asset_owner: Optional[int] = None) -> str:
+        """
+        缓存键：内容哈希 + 配置指纹（+ 文件所在目录，相对图片路径依赖它）
 
-                    if not os.path.exists(full_path):
-                        markdown_root = r'E:\GitHub\markdown'
-                        if img_path.startswith('./'):
-                            img_path = img_path[2:]  # 移除开头的 ./
-                        full_path = os.path.normpath(os.path.join(markdown_root, img_path))
-                        
-                    img_path = full_path
-                else:
-                    img_path = os.path.normpath(os.path.join(base_dir, img_path))
-        
-            print(f"处理图片: alt='{alt_text}', 路径='{img_path}'")
-            
-            if not os.path.exists(img_path):
-                error_msg = f"""
-                <div style="color: red; border: 1px solid red; padding: 10px; margin: 10px 0; background-color: #ffeeee;">
-                    <strong>图片加载错误:</strong> 文件不存在 - {img_path}
-                </div>
-                """
-                print(f"图片未找到: {img_path}")
-                return error_msg
-            
-            try:
-                with open(img_path, 'rb') as img_file:
-                    img_data = img_file.read()
-                    
-                import mimetypes
-                mime_type, _ = mimetypes.guess_type(img_path)
-                if not mime_type:
-                    ext = os.path.splitext(img_path.lower())[1]
-                    mime_map = {
-                        '.png': 'image/png',
-                        '.jpg': 'image/jpeg',
-                        '.jpeg': 'image/jpeg',
-                        '.gif': 'image/gif',
-                        '.bmp': 'image/bmp',
-                        '.webp': 'image/webp',
-                        '.svg': 'image/svg+xml'
-                    }
-                    mime_type = mime_map.get(ext, 'image/png')
-                
-                img_base64 = base64.b64encode(img_data).decode('utf-8')
-                data_uri = f"data:{mime_type};base64,{img_base64}"
-                
-                print(f"图片加载成功: {img_path}，大小: {len(img_data)} 字节")
-                return f"![{alt_text}]({data_uri})"
-            except Exception as e:
-                error_msg = f"""
-                <div style="color: red; border: 1px solid red; padding: 10px; margin: 10px 0; background-color: #ffeeee;">
-                    <strong>图片加载错误:</strong> {str(e)} <br>
-                    <strong>图片路径:</strong> {img_path}
-                </div>
-                """
-                print(f"图片加载错误 {img_path}: {str(e)}")
-                return error_msg
-        
-        print(f"处理Markdown文件中的图片: {file_path}")
-        
-        img_pattern = r'!\[(.*?)\]\s*\((.*?)\)'
-        processed = re.sub(img_pattern, replace_image, content)
-        
-        if '![' in content:
-            print(f"原始内容中的图片引用数量: {content.count('![')}")
-            print(f"处理后内容中的图片引用数量: {processed.count('![')}")
-            
-        return processed
+        asset_owner 为图片地址签发给的用户（见 build_asset_url），不同用户的渲染结果分别缓存。
+        """
+        parts = [content_digest, cls.get_config_fingerprint(image_mode)]
+        if file_path:
+            # render_file 使用 validate_file 返回的真实路径；这里同样解析符号链接，
+            # 调用方传入未解析的路径（例如 document.file.path）时也能命中同一条缓存
+            parts.append(os.path.dirname(os.path.realpath(file_path)))
+        if asset_owner is not None:
+            parts.append(f'owner:{asset_owner}')
+        return hashlib.sha256('|'.join(parts).encode('utf-8')).hexdigest()
     
     @classmethod
-    def _add_table_styles(cls, html_content: str) -> str:
-        """为所有表格添加Bootstrap样式"""
-        # 将普通表格转换为Bootstrap样式表格
-        html_content = html_content.replace('<table>', '<table class="table table-bordered table-striped">')
-        
-        # 查找表格
-        table_pattern = r'<table[^>]*>'
-        tables = re.findall(table_pattern, html_content)
-        
-        # 检查是否需要添加样式
-        for table in tables:
-            if 'class=' not in table:
-                styled_table = table.replace('<table', '<table class="table table-bordered table-striped"')
-                html_content = html_content.replace(table, styled_table)
-            elif 'table ' not in table and 'table"' not in table:
-                styled_table = table.replace('class="', 'class="table table-bordered table-striped ')
-                html_content = html_content.replace(table, styled_table)
-        
-        # 添加表格容器样式，使表格可滚动
-        html_content = re.sub(
-            r'(<table[^>]*>.*?</table>)',
-            r'<div class="table-responsive">\1</div>',
-            html_content,
-            flags=re.DOTALL
+    def get_cache_stats(cls) -> Dict[str, Any]:
+        return render_cache.stats()
+    
+    @classmethod
+    def create_engine(cls) -> markdown.Markdown:
+        """按当前配置构造新的Markdown引擎"""
+        extensions = cls.get_markdown_extensions() + [ImageAssetExtension(), TableStyleExtension()]
+        if get_math_mode() == MATH_MODE_MATHML:
+            # 公式在服务端转换为 MathML（见 MathMLTreeprocessor）
+            extensions.append(MathMLExtension())
+        return markdown.Markdown(
+            extensions=extensions,
+            extension_configs=cls.get_extension_configs(),
+            output_format='html5'
         )
-        
-        return html_content
     
     @classmethod
-    def render_markdown_content(cls, content: str, file_path: Optional[str] = None) -> SafeString:
+    def _convert(cls, content: str, file_path: Optional[str] = None,
+                 image_mode: Optional[str] = None, asset_owner: Optional[int] = None) -> str:
+        # 复用当前线程中相同配置的引擎，避免每次重新加载扩展
+        with engine_pool.engine(cls.get_config_fingerprint(), cls.create_engine) as md:
+            # 图片在元素树中解析（见 ImageAssetTreeprocessor）
+            md.source_path = file_path
+            md.image_mode = image_mode or cls.get_image_mode()
+            md.asset_owner = asset_owner
+            # 表格样式在元素树中添加（见 TableStyleTreeprocessor）
+            with timing('convert'):
+                if cls._use_incremental(content):
+                    # 大文档按块渲染，重新上传的修改版只转换变化的块
+                    context = cls.get_cache_key('blocks', file_path, md.image_mode, asset_owner)
+                    html_content = render_blocks(md, content, context)
+                    if html_content is not None:
+                        return html_content
+                return md.convert(content)
+
+    @classmethod
+    def _use_incremental(cls, content: str) -> bool:
+        config = get_incremental_config()
+        return (bool(config['ENABLED'])
+                and len(content) >= config['MIN_LENGTH']
+                and supports_extensions(cls.get_markdown_extensions()))
+    
+    @classmethod
+    def _error_html(cls, e: Exception) -> SafeString:
+        error_message = f"""
+        <div class="markdown-error">
+            <h3>Markdown渲染错误</h3>
+            <p>{str(e)}</p>
+        </div>
+        """
+        return mark_safe(error_message)
+    
+    @classmethod
+    def _fallback_html(cls, file_path: str, encoding: Optional[str], e: Exception) -> SafeString:
+        """渲染超出时间或内存上限时显示转义后的原文"""
         try:
-            # 处理图片链接
-            if file_path:
-                content = cls._process_image_links(content, file_path)
-                
-            extensions = cls.get_markdown_extensions()
-            extension_configs = cls.get_extension_configs()
-            
-            md = markdown.Markdown(
-                extensions=extensions,
-                extension_configs=extension_configs,
-                output_format='html5'
-            )
-            
-            html_content = md.convert(content)
-            
-            # 处理表格样式
-            html_content = cls._add_table_styles(html_content)
-            
-            return mark_safe(html_content)
-            
-        except Exception as e:
-            error_message = f"""
-            <div class="markdown-error">
-                <h3>Markdown渲染错误</h3>
-                <p>{str(e)}</p>
-            </div>
-            """
-            return mark_safe(error_message)
+            content, _ = read_text(FileValidator.validate_file(file_path), encoding)
+        except Exception:
+            content = ''
+        return mark_safe(f"""
+        <div class="markdown-error markdown-render-limit">
+            <h3>文档过于复杂，未能完整渲染</h3>
+            <p>{escape(str(e))}，以下显示原始文本。</p>
+        </div>
+        <pre class="text-content">{escape(content)}</pre>
+        """)
     
     @classmethod
-    def render_markdown_file(cls, file_path: str) -> SafeString:
+    def render_markdown_content(cls, content: str, file_path: Optional[str] = None,
+                                image_mode: Optional[str] = None, asset_owner: Optional[int] = None) -> SafeString:
         try:
+            return mark_safe(cls._convert(content, file_path, image_mode, asset_owner))
+        except Exception as e:
+            return cls._error_html(e)
+    
+    @classmethod
+    def render_file(cls, file_path: str, image_mode: Optional[str] = None,
+                    encoding: Optional[str] = None, asset_owner: Optional[int] = None) -> str:
+        """
+        渲染Markdown文件并返回HTML字符串
+        
+        与 render_markdown_file 不同，验证或渲染失败时直接抛出异常，供后台任务等调用方自行处理。
+        encoding 为已知的文件编码（例如保存在文档记录中的编码），未提供时自动检测。
+        asset_owner 为文档所有者的用户ID，图片地址只对该用户有效。
+        """
+        with timing('validate'):
             validated_path = FileValidator.validate_file(file_path)
+        
+        # 文件上传后内容不再变化，命中缓存时完全不需要读取和转换
+        with timing('cache'):
+            cache_key = cls.get_cache_key(file_digest(validated_path), validated_path, image_mode, asset_owner)
+            cached = render_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        if isolation_enabled():
+            # 在有时间和内存上限的工作进程中读取并转换，超出上限时抛出 RenderLimitExceeded
+            with timing('isolated'):
+                html_content = isolated_renderer.convert(validated_path, encoding, image_mode, asset_owner)
+        else:
+            # 只读取一次文件，编码已知时直接解码
+            with timing('decode'):
+                content, _ = read_text(validated_path, encoding)
+            html_content = cls._convert(content, validated_path, image_mode, asset_owner)
+        render_cache.set(cache_key, html_content)
+        return html_content
+    
+    @classmethod
+    def render_markdown_file(cls, file_path: str, image_mode: Optional[str] = None,
+                             encoding: Optional[str] = None, asset_owner: Optional[int] = None) -> SafeString:
+        """
+        渲染Markdown文件
+        
+        image_mode 为 'inline' 时图片内联为 data URI（离线导出），默认改写为资源地址。
+        """
+        try:
+            return mark_safe(cls.render_file(file_path, image_mode, encoding, asset_owner))
             
-            content = None
-            encodings = ['utf-8', 'gbk', 'gb2312', 'latin-1']
-            
-            for encoding in encodings:
-                try:
-                    with open(validated_path, 'r', encoding=encoding) as f:
-                        content = f.read()
-                    
-                    # 检查是否有乱码（Unicode替换字符）
-                    if '\ufffd' not in content[:100]:
-                        break
-                except UnicodeDecodeError:
-                    continue
-            
-            if content is None or '\ufffd' in content[:100]:
-                with open(validated_path, 'rb') as f:
-                    raw_content = f.read()
-                    try:
-                        import chardet
-                        detected = chardet.detect(raw_content)
-                        encoding = detected['encoding'] or 'utf-8'
-                        content = raw_content.decode(encoding)
-                    except (ImportError, UnicodeDecodeError):
-                        content = raw_content.decode('latin-1')
-                
-            return cls.render_markdown_content(content, validated_path)
+        except RenderLimitExceeded as e:
+            return cls._fallback_html(file_path, encoding, e)
             
         except ValidationError as e:
             error_message = f"""
@@ -273,5 +271,24 @@ class MarkdownRenderer:
             return mark_safe(error_message)
 
 
-def render_markdown(file_path: str) -> SafeString:
-    return MarkdownRenderer.render_markdown_file(file_path) 
\ No newline at end of file
+def render_markdown(file_path: str, image_mode: Optional[str] = None,
+                    encoding: Optional[str] = None, asset_owner: Optional[int] = None) -> SafeString:
+    return MarkdownRenderer.render_markdown_file(file_path, image_mode, encoding, asset_owner)
+
+async def render_markdown_async(file_path: str, image_mode: Optional[str] = None,
+                                encoding: Optional[str] = None,
+                                content_digest: Optional[str] = None,
+                                asset_owner: Optional[int] = None) -> SafeString:
+    """
+    异步视图使用的 render_markdown
+
+    调用方已知文件内容哈希（例如文档记录中的 sha256）时，先在进程内缓存中查找，命中时不占用线程；
+    否则在有界的渲染线程池中渲染。
+    """
+    if content_digest:
+        with timing('cache'):
+            cached = render_cache.get_memory(
+                MarkdownRenderer.get_cache_key(content_digest, file_path, image_mode, asset_owner))
+        if cached is not None:
+            return mark_safe(cached)
+    return await render_limiter.run(render_markdown, file_path, image_mode, encoding, asset_owner)
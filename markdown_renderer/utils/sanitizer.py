@@ -1,14 +1,21 @@
 import os
+import codecs
+import logging
 import mimetypes
-from pathlib import Path
+import threading
+from collections import OrderedDict
 from typing import Union, Optional, Tuple, List
 from django.conf import settings
 from django.core.exceptions import ValidationError
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+logger = logging.getLogger('markdown_renderer')
 
 
 class FileValidator:
     
-    ALLOWED_EXTENSIONS = (
+    ALLOWED_EXTENSIONS = frozenset((
         # 文本文件
         '.md', '.markdown', '.txt', '.log', '.ini', '.conf', '.cfg', '.properties',
         # 代码文件
@@ -19,12 +26,12 @@ class FileValidator:
         '.pdf',
         # Office文档
         '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx',
-    )
+    ))
     
-    ALLOWED_MIMETYPES = (
+    ALLOWED_MIMETYPES = frozenset((
         # 文本文件
         'text/markdown', 'text/plain', 'text/html', 'text/xml', 'application/json', 
-        'application/xml', 'text/css', 'application/javascript',
+        'application/xml', 'text/css', 'application/javascript', 'text/javascript',
         # 图片文件
         'image/jpeg', 'image/png', 'image/gif', 'image/bmp', 'image/svg+xml', 'image/webp',
         # PDF文档
@@ -33,10 +40,38 @@ class FileValidator:
         'application/msword', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
         'application/vnd.ms-excel', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
         'application/vnd.ms-powerpoint', 'application/vnd.openxmlformats-officedocument.presentationml.presentation',
-    )
+    ))
     
     DEFAULT_MAX_SIZE = 10 * 1024 * 1024  # 增加到10MB
     
+    # 二进制格式的文件头：每个扩展名对应若干候选，候选中的 (偏移, 字节) 全部匹配即可
+    MAGIC_NUMBERS = {
+        '.png': (((0, b'\x89PNG\r\n\x1a\n'),),),
+        '.jpg': (((0, b'\xff\xd8\xff'),),),
+        '.jpeg': (((0, b'\xff\xd8\xff'),),),
+        '.gif': (((0, b'GIF87a'),), ((0, b'GIF89a'),)),
+        '.bmp': (((0, b'BM'),),),
+        '.webp': (((0, b'RIFF'), (8, b'WEBP')),),
+        '.pdf': (((0, b'%PDF-'),),),
+        # OOXML 是 zip，旧版Office是 OLE 复合文档
+        '.docx': (((0, b'PK\x03\x04'),),),
+        '.xlsx': (((0, b'PK\x03\x04'),),),
+        '.pptx': (((0, b'PK\x03\x04'),),),
+        '.doc': (((0, b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'),),),
+        '.xls': (((0, b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'),),),
+        '.ppt': (((0, b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'),),),
+    }
+    
+    # 判断内容类型时需要的文件头长度
+    HEADER_SIZE = 512
+    
+    # 验证通过的结果按 (路径, 修改时间, 大小) 缓存，文件变化后自动重新验证
+    VALIDATION_CACHE_SIZE = 4096
+    
+    _allowed_roots: Optional[Tuple[str, ...]] = None
+    _validated: 'OrderedDict[Tuple[str, int, int], str]' = OrderedDict()
+    _lock = threading.Lock()
+    
     @classmethod
     def get_max_size(cls) -> int:
         config = getattr(settings, 'MARKDOWN_RENDER', {})
@@ -50,7 +85,8 @@ class FileValidator:
         return True
     
     @classmethod
-    def validate_mimetype(cls, file_path: str) -> bool:
+    def guess_mimetype(cls, file_path: str) -> Optional[str]:
+        """按扩展名猜测MIME类型，猜不出时读取文件头判断是否为文本"""
         mime_type, _ = mimetypes.guess_type(file_path)
         
         if not mime_type and os.path.exists(file_path):
@@ -61,9 +97,55 @@ class FileValidator:
                     mime_type = 'text/plain'
                 except UnicodeDecodeError:
                     mime_type = 'application/octet-stream'
+        return mime_type
+    
+    @classmethod
+    def looks_like_text(cls, header: bytes) -> bool:
+        """文件头中没有 NUL 字节（UTF-16 以BOM开头的除外）时视为文本"""
+        if header.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+            return True
+        return b'\x00' not in header
+    
+    @classmethod
+    def sniff_mimetype(cls, file_name: str, header: bytes) -> str:
+        """
+        按文件名和文件头判断MIME类型，用于还没有写入磁盘的上传内容
         
+        文本类扩展名（包括猜不出类型的 .log、.yaml 等）的内容必须是文本，不在白名单中的 text/* 类型按 text/plain 处理。
+        """
+        mime_type, _ = mimetypes.guess_type(file_name)
+        if mime_type and not mime_type.startswith('text/') and mime_type != 'image/svg+xml':
+            return mime_type
+        if not cls.looks_like_text(header):
+            return 'application/octet-stream'
         if mime_type not in cls.ALLOWED_MIMETYPES:
-            raise ValidationError(f"不支持的MIME类型: {mime_type}。仅支持 {', '.join(cls.ALLOWED_MIMETYPES)}")
+            return 'text/plain'
+        return mime_type
+    
+    @classmethod
+    def validate_header(cls, file_name: str, header: bytes) -> str:
+        """
+        检查文件头与扩展名是否相符（二进制格式比对魔数，文本格式不能含有二进制内容），返回MIME类型
+        
+        header 为文件开头至少 HEADER_SIZE 字节（文件更短时为全部内容）。
+        """
+        _, ext = os.path.splitext(file_name.lower())
+        candidates = cls.MAGIC_NUMBERS.get(ext)
+        if candidates and not any(all(header[offset:offset + len(magic)] == magic for offset, magic in candidate)
+                                  for candidate in candidates):
+            raise ValidationError(f"文件内容与扩展名 {ext} 不符")
+        
+        mime_type = cls.sniff_mimetype(file_name, header)
+        if mime_type not in cls.ALLOWED_MIMETYPES:
+            raise ValidationError(f"不支持的MIME类型: {mime_type}")
+        return mime_type
+    
+    @classmethod
+    def validate_mimetype(cls, file_path: str) -> bool:
+        mime_type = cls.guess_mimetype(file_path)
+        
+        if mime_type not in cls.ALLOWED_MIMETYPES:
+            raise ValidationError(f"不支持的MIME类型: {mime_type}。仅支持 {', '.join(sorted(cls.ALLOWED_MIMETYPES))}")
         return True
     
     @classmethod
@@ -79,75 +161,94 @@ class FileValidator:
         return True
     
     @classmethod
-    def sanitize_path(cls, file_path: str) -> str:
-        abs_path = os.path.abspath(file_path)
-        print(f"验证文件路径: {file_path}")
-        print(f"绝对路径: {abs_path}")
+    def get_allowed_roots(cls) -> Tuple[str, ...]:
+        """
+        允许访问的目录：MEDIA_ROOT、BASE_DIR 和 MARKDOWN_RENDER['EXTERNAL_DIRS']
         
-        allowed_paths = []
+        第一次使用时解析为真实路径（以路径分隔符结尾），之后直接复用；相关设置变化时重新解析。
+        """
+        roots = cls._allowed_roots
+        if roots is not None:
+            return roots
         
-        if hasattr(settings, 'MEDIA_ROOT'):
-            allowed_paths.append(os.path.abspath(settings.MEDIA_ROOT))
-            
-        if hasattr(settings, 'BASE_DIR'):
-            allowed_paths.append(os.path.abspath(settings.BASE_DIR))
+        paths = []
+        for name in ('MEDIA_ROOT', 'BASE_DIR'):
+            value = getattr(settings, name, None)
+            if value:
+                paths.append(value)
         
-        # 添加外部目录支持
         config = getattr(settings, 'MARKDOWN_RENDER', {})
         external_dirs = config.get('EXTERNAL_DIRS')
-        if external_dirs:
-            if isinstance(external_dirs, str):
-                allowed_paths.append(os.path.abspath(external_dirs))
-                print(f"添加允许的外部目录(字符串): {os.path.abspath(external_dirs)}")
-            elif isinstance(external_dirs, (list, tuple)):
-                for ext_dir in external_dirs:
-                    allowed_paths.append(os.path.abspath(ext_dir))
-                    print(f"添加允许的外部目录(列表项): {os.path.abspath(ext_dir)}")
+        if isinstance(external_dirs, str):
+            paths.append(external_dirs)
+        elif isinstance(external_dirs, (list, tuple)):
+            paths.extend(external_dirs)
         
-        # 添加特定的外部目录
-        ext_dir_path = os.path.abspath(r'E:\GitHub\markdown')
-        allowed_paths.append(ext_dir_path)
-        print(f"添加特定外部目录: {ext_dir_path}")
+        resolved = []
+        for path in paths:
+            root = os.path.join(os.path.realpath(os.fspath(path)), '')
+            if root not in resolved:
+                resolved.append(root)
+        roots = cls._allowed_roots = tuple(resolved)
+        logger.debug("允许的目录: %s", roots)
+        return roots
+    
+    @classmethod
+    def reset(cls) -> None:
+        """清除已解析的目录和验证结果缓存"""
+        with cls._lock:
+            cls._allowed_roots = None
+            cls._validated.clear()
+    
+    @classmethod
+    def sanitize_path(cls, file_path: str) -> str:
+        """返回文件的真实路径；不在允许的目录内（包括通过符号链接指向外部）时抛出 ValidationError"""
+        real_path = os.path.realpath(file_path)
         
-        # 添加当前文件目录
-        if os.path.exists(file_path):
-            file_dir = os.path.abspath(os.path.dirname(file_path))
-            allowed_paths.append(file_dir)
-            print(f"添加文件所在目录: {file_dir}")
-            
-        print(f"允许的路径列表: {allowed_paths}")
-            
-        path_allowed = False
-        for allowed_path in allowed_paths:
-            if abs_path.startswith(allowed_path):
-                path_allowed = True
-                print(f"路径验证成功: {abs_path} 在允许的目录 {allowed_path} 内")
-                break
-                
-        if not path_allowed and allowed_paths:
-            error_msg = f"安全警告: 不允许访问系统目录外部的文件"
-            print(f"路径验证失败: {error_msg}")
-            print(f"  文件路径: {abs_path}")
-            print(f"  允许的路径: {allowed_paths}")
-            raise ValidationError(error_msg)
-                
-        path_obj = Path(abs_path)
-        if '..' in path_obj.parts:
-            error_msg = "安全警告: 检测到目录遍历尝试"
-            print(f"路径验证失败: {error_msg}")
+        # 根目录以分隔符结尾，/media 不会匹配 /media-other
+        if not real_path.startswith(cls.get_allowed_roots()):
+            error_msg = "安全警告: 不允许访问系统目录外部的文件"
+            logger.warning("路径验证失败: %s（文件路径: %s，允许的目录: %s）",
+                           error_msg, real_path, cls.get_allowed_roots())
             raise ValidationError(error_msg)
         
-        print(f"路径验证通过: {abs_path}")    
-        return abs_path
+        return real_path
     
     @classmethod
-    def validate_file(cls, file_path: str) -> str:
-        clean_path = cls.sanitize_path(file_path)
-        
-        cls.validate_extension(clean_path)
+    def validate_file(cls, file_path: str, max_size: Optional[int] = None) -> str:
+        """max_size 覆盖 MARKDOWN_RENDER['MAX_SIZE']（例如分段渲染允许更大的文件）"""
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            raise ValidationError(f"文件不存在: {file_path}")
         
-        cls.validate_mimetype(clean_path)
+        # 大小上限因调用方而异，不计入缓存的验证结果
+        key = (file_path, stat.st_mtime_ns, stat.st_size)
+        with cls._lock:
+            clean_path = cls._validated.get(key)
+            if clean_path is not None:
+                cls._validated.move_to_end(key)
         
-        cls.validate_size(clean_path)
+        if clean_path is None:
+            clean_path = cls.sanitize_path(file_path)
+            
+            cls.validate_extension(clean_path)
+            
+            cls.validate_mimetype(clean_path)
+            
+            with cls._lock:
+                cls._validated[key] = clean_path
+                while len(cls._validated) > cls.VALIDATION_CACHE_SIZE:
+                    cls._validated.popitem(last=False)
         
-        return clean_path 
\ No newline at end of file
+        if max_size is None:
+            max_size = cls.get_max_size()
+        if stat.st_size > max_size:
+            raise ValidationError(f"文件大小({stat.st_size}字节)超过允许的最大值({max_size}字节)")
+        return clean_path
+
+
+@receiver(setting_changed)
+def _reset_file_validator(sender, setting, **kwargs):
+    if setting in ('MEDIA_ROOT', 'BASE_DIR', 'MARKDOWN_RENDER'):
+        FileValidator.reset()
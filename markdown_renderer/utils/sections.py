@@ -0,0 +1,200 @@
+"""
+长文档分段渲染
+
+超大Markdown文档在标题处分成若干段：页面先返回目录和第一段，其余各段在浏览器滚动到附近时再请求。
+每段单独渲染和缓存，首屏时间只取决于第一段，而不是整个文件。
+
+分段在源文本的顶层块边界上进行（见 blocks），不需要先转换全文。标题 id 与完整渲染相同：
+建立索引时把全部标题行一起转换一次，得到目录和每个标题的 id；渲染某一段时把之前各段的标题 id 作为已占用的 id。
+"""
+import hashlib
+import json
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+from .blocks import (BLOCK_MARKER, UnsupportedDocument, assign_heading_ids, block_ranges, build_toc,
+                     convert_blocks, find_markers, get_toc_processor, group_blocks, is_metadata_head,
+                     join_pieces, reference_blocks, supports_extensions)
+from .cache import TieredCache, file_digest
+from .encoding import read_text
+from .isolation import isolation_enabled
+from .metrics import timing
+from .pool import engine_pool
+from .renderer import MarkdownRenderer
+from .sanitizer import FileValidator
+
+DEFAULT_SECTIONS_CONFIG = {
+    'LEVEL': 2,                       # 在这一级及更高级别的标题处分段
+    'MAX_SECTION_LENGTH': 64 * 1024,  # 字符数；标题之间的内容过长时在块边界处继续拆分
+    'MAX_SIZE': 32 * 1024 * 1024,     # 每次请求只转换一段，允许比 MARKDOWN_RENDER['MAX_SIZE'] 更大的文件
+}
+
+section_cache = TieredCache('sections')
+
+_ATX_RE = re.compile(r'^(#{1,6})(?!#)')
+_SETEXT_RE = re.compile(r'^(=+|-+)[ ]*$')
+_FENCE_START_RE = re.compile(r'^(`{3,}|~{3,})')
+
+
+def get_sections_config() -> Dict[str, Any]:
+    config = getattr(settings, 'MARKDOWN_RENDER', {})
+    sections_config = DEFAULT_SECTIONS_CONFIG.copy()
+    sections_config.update(config.get('SECTIONS', {}))
+    return sections_config
+
+
+def sections_supported() -> bool:
+    """当前配置能否分段渲染；开启隔离渲染时各段不在工作进程中转换，因此不分段"""
+    return supports_extensions(MarkdownRenderer.get_markdown_extensions()) and not isolation_enabled()
+
+
+def _heading_level(lines: List[str], start: int, end: int) -> Optional[int]:
+    """块以标题开头时返回标题级别"""
+    atx = _ATX_RE.match(lines[start])
+    if atx:
+        return len(atx.group(1))
+    if end - start >= 2 and _SETEXT_RE.match(lines[start + 1]):
+        return 1 if lines[start + 1][0] == '=' else 2
+    return None
+
+
+def _heading_lines(lines: List[str], start: int, end: int) -> List[str]:
+    """块中各标题的源文本（Python-Markdown 在块内任意一行识别 # 标题）"""
+    if _FENCE_START_RE.match(lines[start]) or lines[start][:1] in (' ', '\t'):
+        return []
+    headings = [line for line in lines[start:end] if _ATX_RE.match(line)]
+    if not headings and end - start >= 2 and _SETEXT_RE.match(lines[start + 1]):
+        headings = ['\n'.join(lines[start:start + 2])]
+    return headings
+
+
+def build_section_index(md, content: str, context: str) -> Dict[str, Any]:
+    """
+    分段索引：{'sections': [[起始行, 结束行, [标题id...]], ...], 'toc': 目录HTML, 'references': 引用定义}
+
+    不适合按块处理的文档抛出 UnsupportedDocument。
+    """
+    if BLOCK_MARKER in content:
+        raise UnsupportedDocument()
+    config = get_sections_config()
+    toc = get_toc_processor(md)
+    lines = content.split('\n')
+    ranges = block_ranges(lines)
+    if not ranges:
+        raise UnsupportedDocument()
+
+    sections: List[List[int]] = []
+    section_headings: List[List[str]] = []
+    length = 0
+    for start, end in ranges:
+        level = _heading_level(lines, start, end)
+        if not sections or (level is not None and level <= config['LEVEL']) or length >= config['MAX_SECTION_LENGTH']:
+            sections.append([start, end])
+            section_headings.append([])
+            length = 0
+        else:
+            sections[-1][1] = end
+        length += sum(len(line) + 1 for line in lines[start:end])
+        section_headings[-1].extend(_heading_lines(lines, start, end))
+
+    references = '\n\n'.join(reference_blocks(['\n'.join(lines[a:b]) for a, b in ranges]))
+
+    # 只转换标题行，得到与完整渲染相同的 id 和目录
+    anchors: List[List[str]] = [[] for _ in sections]
+    toc_html = ''
+    if toc is not None:
+        entries = convert_blocks(md, toc, ['\n\n'.join(headings) for headings in section_headings],
+                                 references, context + ':headings')
+        used_ids = set()
+        tokens = []
+        for number, entry in enumerate(entries):
+            _, section_tokens = assign_heading_ids([entry], used_ids, anchors[number])
+            tokens.extend(section_tokens)
+        if tokens:
+            toc_html = build_toc(md, toc, tokens)
+
+    return {
+        'sections': [[start, end, ids] for (start, end), ids in zip(sections, anchors)],
+        'toc': toc_html,
+        'references': references,
+    }
+
+
+def render_section_html(md, content: str, index: Dict[str, Any], number: int, context: str) -> str:
+    """渲染第 number 段（从0开始），文档中的 [TOC] 替换为整篇文档的目录"""
+    toc = get_toc_processor(md)
+    start, end, _ = index['sections'][number]
+    lines = content.split('\n')[start:end]
+    marker = toc.marker if toc is not None else ''
+    blocks = group_blocks(['\n'.join(lines[a:b]) for a, b in block_ranges(lines)], marker)
+    marker_indexes = find_markers(blocks, marker)
+    entries = convert_blocks(md, toc, blocks, index['references'], context,
+                             head_alone=number == 0 and is_metadata_head(md, blocks[0]))
+
+    used_ids = set()
+    for _, _, ids in index['sections'][:number]:
+        used_ids.update(ids)
+    pieces, _ = assign_heading_ids(entries, used_ids)
+    for marker_index in marker_indexes:
+        pieces[marker_index] = index['toc']
+    return join_pieces(pieces)
+
+
+def _section_key(document_key: str, name: str) -> str:
+    return hashlib.sha256(f'{document_key}:{name}'.encode('utf-8')).hexdigest()
+
+
+def render_section(file_path: str, number: int, image_mode: Optional[str] = None,
+                   encoding: Optional[str] = None,
+                   asset_owner: Optional[int] = None) -> Optional[Tuple[Dict[str, Any], str]]:
+    """
+    返回 (分段索引, 第 number 段的HTML)
+
+    索引和各段分别缓存；文档不适合分段或段号超出范围时返回 None。验证失败时抛出异常。
+    """
+    if not sections_supported():
+        return None
+    with timing('validate'):
+        validated_path = FileValidator.validate_file(file_path, get_sections_config()['MAX_SIZE'])
+    image_mode = image_mode or MarkdownRenderer.get_image_mode()
+    with timing('cache'):
+        document_key = MarkdownRenderer.get_cache_key(file_digest(validated_path), validated_path, image_mode,
+                                                      asset_owner)
+        index_key = _section_key(document_key, 'index')
+        cached_index = section_cache.get(index_key)
+        index = json.loads(cached_index) if cached_index else None
+    if cached_index == '':
+        # 之前已确定不适合分段
+        return None
+    if index is not None and not 0 <= number < len(index['sections']):
+        return None
+
+    section_key = _section_key(document_key, str(number))
+    if index is not None:
+        with timing('cache'):
+            cached = section_cache.get(section_key)
+        if cached is not None:
+            return index, cached
+
+    with timing('decode'):
+        content, _ = read_text(validated_path, encoding)
+    context = MarkdownRenderer.get_cache_key('blocks', validated_path, image_mode, asset_owner)
+    with engine_pool.engine(MarkdownRenderer.get_config_fingerprint(), MarkdownRenderer.create_engine) as md:
+        md.source_path = validated_path
+        md.image_mode = image_mode
+        md.asset_owner = asset_owner
+        with timing('convert'):
+            try:
+                if index is None:
+                    index = build_section_index(md, content, context)
+                    section_cache.set(index_key, json.dumps(index, ensure_ascii=False))
+                if not 0 <= number < len(index['sections']):
+                    return None
+                html_content = render_section_html(md, content, index, number, context)
+            except UnsupportedDocument:
+                section_cache.set(index_key, '')
+                return None
+    section_cache.set(section_key, html_content)
+    return index, html_content
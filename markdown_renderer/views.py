@@ -0,0 +1,109 @@
+"""
+Markdown渲染器视图
+
+提供文档中本地图片和代码高亮样式表的访问地址，以及渲染指标
+"""
+import os
+
+from django.contrib.auth.decorators import login_required
+from django.core import signing
+from django.core.exceptions import ValidationError
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils.cache import get_conditional_response
+from django.views.decorators.http import require_GET
+
+from .utils.cache import file_digest
+from .utils.extensions import IMAGE_MIME_MAP, get_image_mime_type, unsign_asset_token
+from .utils.highlight import get_pygments_stylesheet
+from .utils.images import derivative_etag, derivative_widths, get_derivative
+from .utils.metrics import metrics
+from .utils.sanitizer import FileValidator
+
+# 地址中带有内容哈希，内容不变时浏览器可以长期缓存
+ASSET_CACHE_SECONDS = 365 * 24 * 60 * 60
+
+
+@login_required
+@require_GET
+def asset_view(request, token, name, width=None):
+    """
+    返回Markdown文档引用的图片
+
+    token 是渲染时签发的文件路径和文档所有者的签名，只有渲染过程中引用过的文件才能被访问，
+    签入了所有者时只有该用户可以访问；路径还需通过 FileValidator 的目录检查。
+    给出 width 时返回该宽度的缩略图，没有对应缩略图时返回原图。
+    """
+    try:
+        img_path, owner = unsign_asset_token(token)
+    except signing.BadSignature:
+        raise Http404("资源不存在")
+
+    if owner is not None and owner != request.user.pk:
+        raise Http404("资源不存在")
+
+    if os.path.splitext(img_path.lower())[1] not in IMAGE_MIME_MAP:
+        raise Http404("资源不存在")
+
+    try:
+        img_path = FileValidator.sanitize_path(img_path)
+    except ValidationError:
+        raise Http404("资源不存在")
+
+    if not os.path.isfile(img_path):
+        raise Http404("资源不存在")
+
+    digest = file_digest(img_path)
+    etag = f'"{digest}"'
+    if name.startswith(digest[:16]):
+        cache_control = f'private, max-age={ASSET_CACHE_SECONDS}, immutable'
+    else:
+        # 文件在渲染后被修改过，地址中的哈希已过期
+        cache_control = 'private, no-cache'
+
+    # 先按 ETag 判断是否返回 304，之后才生成（可能需要缩放的）缩略图
+    if width and width in derivative_widths(img_path, digest):
+        etag = derivative_etag(digest, width)
+    
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        derivative = get_derivative(img_path, width, digest) if width else None
+        if derivative is not None:
+            response = FileResponse(open(derivative[0], 'rb'), content_type=derivative[1])
+        else:
+            # 没有该宽度的缩略图或生成失败时返回原图
+            etag = f'"{digest}"'
+            response = FileResponse(open(img_path, 'rb'), content_type=get_image_mime_type(img_path))
+    response['ETag'] = etag
+    response['Cache-Control'] = cache_control
+    return response
+
+
+@require_GET
+def pygments_css_view(request, digest):
+    """代码高亮样式表，地址中的哈希与当前样式一致时允许长期缓存"""
+    css, current_digest = get_pygments_stylesheet()
+    etag = f'"{current_digest}"'
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(css, content_type='text/css; charset=utf-8')
+    response['ETag'] = etag
+    if digest == current_digest:
+        response['Cache-Control'] = f'public, max-age={ASSET_CACHE_SECONDS}, immutable'
+    else:
+        response['Cache-Control'] = 'no-cache'
+    return response
+
+
+@require_GET
+def metrics_view(request):
+    """
+    Prometheus 文本格式的渲染指标：各阶段延迟直方图和缓存命中率
+
+    只允许管理员或 INTERNAL_IPS 中的地址访问。
+    """
+    user = getattr(request, 'user', None)
+    is_staff = bool(user and user.is_authenticated and user.is_staff)
+    if not is_staff and request.META.get('REMOTE_ADDR') not in getattr(settings, 'INTERNAL_IPS', ()):
+        raise Http404()
+    return HttpResponse(metrics.render_text(), content_type='text/plain; version=0.0.4; charset=utf-8')